@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+Shared harvesting tools for the US federal government dataset back-ups
+Brown University Library, GIS & Data Services
+
+Notes:
+1. The downloader scripts in each dataset folder import these modules
+2. Scripts are run from inside their own dataset folder, so each one adds the
+parent datasets folder to sys.path before importing harvest
+"""
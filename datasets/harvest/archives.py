@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Background integrity checks for downloaded ZIP archives
+Brown University Library, GIS & Data Services
+
+Notes:
+1. As each .zip lands it is handed to a small thread pool that reads the central
+directory and checks every member's CRC (zipfile.testzip), while the download
+workers carry on with the next files
+2. zlib and crc32 release the GIL on large buffers, so checks overlap with downloads
+without a separate process
+3. download_all collects the results once its list is done; a failed archive is
+removed and fetched again from scratch, and if it still fails it goes in _ERRORS
+4. Results for the whole snapshot are kept in _ARCHIVES.json, and summary() gives the
+line added to each folder's _METADATA file
+5. Archives using a compression method zipfile can't read are recorded as unchecked,
+not failed
+"""
+
+import os, json, zlib, zipfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+ARCHIVES='_ARCHIVES.json'
+WORKERS=2
+
+class CorruptArchive(requests.exceptions.RequestException):
+    'Raised when a ZIP still fails its integrity check after being fetched again'
+
+def is_archive(path):
+    return path.lower().endswith('.zip')
+
+def check_zip(path):
+    'Returns (members, ok, error); ok is None when the archive could not be checked'
+    try:
+        with zipfile.ZipFile(path) as archive:
+            members=len(archive.infolist())
+            bad=archive.testzip()
+    except NotImplementedError as e:
+        return 0,None,str(e)
+    except (zipfile.BadZipFile,zlib.error,EOFError,OSError) as e:
+        return 0,False,'{}: {}'.format(type(e).__name__,e)
+    if bad is not None:
+        return members,False,'bad CRC for member {}'.format(bad)
+    return members,True,None
+
+class ArchiveChecker:
+    'Checks ZIPs for one snapshot in the background and records the results'
+    def __init__(self,snapshot,workers=WORKERS):
+        self.root=os.path.abspath(snapshot)
+        self.executor=ThreadPoolExecutor(max_workers=workers)
+        self.results=self.load()
+        self.lock=threading.Lock()
+
+    def load(self):
+        path=os.path.join(self.root,ARCHIVES)
+        if os.path.exists(path):
+            with open(path) as readfile:
+                return json.load(readfile)
+        return {}
+
+    def relpath(self,filepath):
+        return os.path.relpath(os.path.abspath(filepath),self.root).replace(os.sep,'/')
+
+    def check(self,filepath,url):
+        'Checks one archive now and records it, returns the result entry'
+        start=time.monotonic()
+        members,ok,error=check_zip(filepath)
+        entry={'url':url,'ok':ok,'members':members,'error':error,
+               'seconds':round(time.monotonic()-start,3)}
+        with self.lock:
+            old=self.results.get(self.relpath(filepath),{})
+            entry['refetched']=old.get('refetched',0)
+            self.results[self.relpath(filepath)]=entry
+        return entry
+
+    def submit(self,filepath,url):
+        'Queues a check for filepath if it is an archive, returns a future or None'
+        if not is_archive(filepath):
+            return None
+        return self.executor.submit(self.check,filepath,url)
+
+    def refetched(self,filepath):
+        'Counts a re-download of filepath after a failed check'
+        with self.lock:
+            entry=self.results.setdefault(self.relpath(filepath),{})
+            entry['refetched']=entry.get('refetched',0)+1
+
+    def summary(self,folder=None):
+        'One line for the _METADATA file, for the whole snapshot or one folder in it'
+        with self.lock:
+            if folder is None:
+                entries=list(self.results.values())
+            else:
+                entries=[v for k,v in self.results.items()
+                         if os.path.dirname(os.path.join(self.root,k))==os.path.abspath(folder)]
+        good=len([e for e in entries if e.get('ok') is True])
+        bad=len([e for e in entries if e.get('ok') is False])
+        skipped=len([e for e in entries if e.get('ok') is None])
+        return '{} ZIP archives checked: {} passed, {} failed, {} unchecked'.format(len(entries),good,bad,skipped)
+
+    def save(self):
+        with self.lock:
+            tmp=os.path.join(self.root,ARCHIVES+'.tmp')
+            with open(tmp,'w') as writefile:
+                json.dump(self.results,writefile,indent=1,sort_keys=True)
+            os.replace(tmp,os.path.join(self.root,ARCHIVES))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+ASP.NET WebForms postbacks over plain HTTP
+Brown University Library, GIS & Data Services
+
+Notes:
+1. WebForms pages (.aspx) keep their state in hidden fields (__VIEWSTATE,
+__VIEWSTATEGENERATOR, __EVENTVALIDATION) and every button press posts the whole form
+back to the page; a browser only runs the JavaScript that builds that POST, so the
+POST can be sent directly instead
+2. Form.load gets a page and reads its form: the action, the hidden and text inputs,
+checked boxes, and each select with its options; controls are looked up by element id
+(e.g. MainContent_ddlConsolidatedSPR), the posted names (ctl00$MainContent$...) are
+generated by the server
+3. data() builds the body a browser would send: the form's own values, the changes
+asked for (by id) and the button pressed; a submit input posts its own name and value,
+a link button sets __EVENTTARGET from its __doPostBack call
+4. Each Form keeps its own cookies (ASP.NET_SessionId) and sends them over the shared
+session, so several pages can be worked at once without sharing a server session,
+which ASP.NET would make them take turns on
+5. download() posts a change and a button and streams the reply into a .part file,
+named from Content-Disposition, renamed into place once Content-Length is reached;
+an html reply means the postback gave no file and returns None
+6. The form is posted again from its original state for every download, as a browser
+reloading the page between downloads would; posts are retried with backoff like GETs
+(see retry.py), each attempt starting the file over, and every file is recorded as a
+telemetry 'file' event
+"""
+
+import os, re, time, mimetypes, email.message
+import requests
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+from harvest import fetch, links, retry, session, telemetry
+
+POSTBACK=re.compile(r'''__doPostBack\(\s*['"]([^'"]*)['"]\s*,\s*['"]([^'"]*)['"]''')
+PAGE_TYPES=('text/html','application/xhtml+xml')
+
+class FormParser(HTMLParser):
+    'Collects the inputs, selects and postback links of a WebForms page'
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.action=None
+        self.inputs=[]
+        self.selects=[] # {'name', 'id', 'options': [[value, text, selected]]}
+        self.postbacks={} # element id -> (event target, event argument)
+        self.select=None
+        self.option=None
+
+    def handle_starttag(self,tag,attrs):
+        attrs={k:('' if v is None else v) for k,v in attrs}
+        if tag=='form' and self.action is None:
+            self.action=attrs.get('action','')
+        elif tag=='input':
+            self.inputs.append(attrs)
+        elif tag=='select':
+            self.select={'name':attrs.get('name'),'id':attrs.get('id'),'options':[]}
+            self.selects.append(self.select)
+        elif tag=='option' and self.select is not None:
+            self.option=[attrs.get('value'),'','selected' in attrs]
+            self.select['options'].append(self.option)
+        found=POSTBACK.search(attrs.get('href','')+' '+attrs.get('onclick',''))
+        if found and attrs.get('id'):
+            self.postbacks[attrs['id']]=found.groups()
+
+    def handle_endtag(self,tag):
+        if tag in ('option','select'):
+            self.option=None
+        if tag=='select':
+            self.select=None
+
+    def handle_data(self,data):
+        if self.option is not None:
+            self.option[1]=self.option[1]+data
+
+class Form:
+    'The form on a WebForms page as it was served, with its own cookies'
+    def __init__(self,url,webpage,cookies=None):
+        parser=FormParser()
+        parser.feed(links.decode(webpage))
+        parser.close()
+        self.url=url
+        self.action=urljoin(url,parser.action) if parser.action else url
+        self.cookies=cookies if cookies is not None else requests.cookies.RequestsCookieJar()
+        self.fields={} # posted name -> value
+        self.names={} # element id -> posted name
+        self.buttons={} # element id -> (posted name, value)
+        self.options={} # element id -> [(value, text)]
+        self.postbacks=parser.postbacks
+        for attrs in parser.inputs:
+            name=attrs.get('name')
+            kind=attrs.get('type','text').lower()
+            if not name:
+                continue
+            if attrs.get('id'):
+                self.names[attrs['id']]=name
+            if kind in ('submit','image','button','reset'):
+                if attrs.get('id'):
+                    self.buttons[attrs['id']]=(name,attrs.get('value',''))
+            elif kind in ('checkbox','radio'):
+                if 'checked' in attrs:
+                    self.fields[name]=attrs.get('value','on')
+            elif kind!='file':
+                self.fields[name]=attrs.get('value','')
+        for select in parser.selects:
+            options=[(text.strip() if value is None else value,' '.join(text.split()))
+                     for value,text,selected in select['options']]
+            if select['id']:
+                self.options[select['id']]=options
+                if select['name']:
+                    self.names[select['id']]=select['name']
+            chosen=[o[0] for o in select['options'] if o[2]]
+            if select['name'] and options:
+                self.fields[select['name']]=chosen[0] if chosen else options[0][0]
+
+    @classmethod
+    def load(cls,url,cookies=None):
+        'Gets url through the shared session and reads its form'
+        cookies=cookies if cookies is not None else requests.cookies.RequestsCookieJar()
+        response=session.get(url,cookies=cookies)
+        response.raise_for_status()
+        keep_cookies(cookies,response)
+        return cls(response.url if response.history else url,response.content,cookies)
+
+    def values(self,control_id):
+        'The (value, text) options of a select, by element id'
+        if control_id not in self.options:
+            raise KeyError('no select {} on {}'.format(control_id,self.url))
+        return self.options[control_id]
+
+    def data(self,changes=None,button=None):
+        'The body a browser would post after the changes, {element id: value}, and a press of button'
+        data=dict(self.fields)
+        for control_id,value in (changes or {}).items():
+            if control_id not in self.names:
+                raise KeyError('no control {} on {}'.format(control_id,self.url))
+            data[self.names[control_id]]=value
+        if button in self.buttons:
+            name,value=self.buttons[button]
+            data[name]=value
+        elif button in self.postbacks:
+            data['__EVENTTARGET'],data['__EVENTARGUMENT']=self.postbacks[button]
+        elif button is not None:
+            raise KeyError('no button {} on {}'.format(button,self.url))
+        return data
+
+    def post(self,changes=None,button=None,headers=None,**kwargs):
+        'Posts the form back to its page with this form\'s cookies, returns the response'
+        headers=dict(headers or {})
+        headers.setdefault('Referer',self.url)
+        # name and value only: the jar is this page's, and session.redirect may have scoped it to another host
+        response=session.post(self.action,data=self.data(changes,button),cookies=self.cookies.get_dict(),
+                              headers=headers,**kwargs)
+        keep_cookies(self.cookies,response)
+        return response
+
+def keep_cookies(cookies,response):
+    'Adds the cookies set along the way to a response, redirects included'
+    for r in response.history+[response]:
+        cookies.update(r.cookies)
+
+def disposition_filename(header):
+    'The file name in a Content-Disposition header, without any folders, or None'
+    if not header:
+        return None
+    message=email.message.Message()
+    message['Content-Disposition']=header
+    name=message.get_filename()
+    return os.path.basename(name.replace('\\','/')) if name else None
+
+def default_filename(changes,ctype):
+    'A name for a file the server sent without one, from the values posted'
+    stem='_'.join(re.sub(r'[^\w.-]+','_',str(v)) for v in changes.values()) or 'download'
+    return stem+(mimetypes.guess_extension(ctype) or '')
+
+def receive(form,changes,button,outpath,fname,bufsize,info):
+    'One postback, streamed into outpath; returns (file name, bytes) or None for a page'
+    response=form.post(changes,button,headers={'Accept-Encoding':'identity'},stream=True)
+    try:
+        info['status']=response.status_code
+        info['ttfb']=response.elapsed.total_seconds()
+        response.raise_for_status() # 429 and 5xx are tried again by retry.call
+        ctype=response.headers.get('Content-Type','').split(';')[0].strip().lower()
+        disposition=response.headers.get('Content-Disposition')
+        if ctype in PAGE_TYPES and not (disposition or '').lower().startswith('attachment'):
+            response.content # read it, so the connection goes back to the pool
+            return None
+        fname=fname or disposition_filename(disposition) or default_filename(changes,ctype)
+        filepath=os.path.join(outpath,fname)
+        partpath=filepath+'.part'
+        with open(partpath,'wb') as writefile:
+            nbytes=fetch.stream_into(response,writefile,bufsize,form.action)
+        expected=response.headers.get('Content-Length')
+        if expected is not None and int(expected)!=nbytes:
+            raise fetch.IncompleteDownload('got {:,} of {:,} bytes posting {} to {}'.format(
+                nbytes,int(expected),changes,form.action))
+        os.replace(partpath,filepath)
+        return fname,nbytes
+    finally:
+        response.close()
+
+def download(form,changes,button,outpath,fname=None,bufsize=None,attempts=None):
+    '''Posts changes ({element id: value}) and a press of button, streams the file that
+    comes back into outpath; returns (file name, bytes), or None if a page came back'''
+    info={'status':None,'ttfb':None,'retries':0}
+    def attempt(n):
+        info.update(status=None,ttfb=None,retries=n)
+        return receive(form,changes,button,outpath,fname,bufsize,info)
+    url=form.action
+    start=time.monotonic()
+    try:
+        result=retry.call(url,attempt,attempts)
+    except requests.exceptions.RequestException as e:
+        telemetry.emit('file',url=url,host=telemetry.host_of(url),path=None,bytes=None,
+                       ttfb=info['ttfb'],duration=time.monotonic()-start,status=info['status'],
+                       outcome='failed',retries=info['retries'],posted=changes,
+                       error='{}: {}'.format(type(e).__name__,e))
+        raise
+    if result is not None:
+        telemetry.emit('file',url=url,host=telemetry.host_of(url),path=os.path.join(outpath,result[0]),
+                       bytes=result[1],ttfb=info['ttfb'],duration=time.monotonic()-start,
+                       status=info['status'],outcome='downloaded',retries=info['retries'],posted=changes)
+    return result
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the harvesters against the local stand-in server
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Starts mockserver.py with the chosen latency, bandwidth, error rate and rate limit,
+then runs each scenario in its own child process pointed at it
+2. Scenarios are the cores of the real downloaders: engine.harvest_spec for the
+single-page specs, and the NOAA SLR, NOAA Lake Level, DHS data and NCHE (browserless
+postbacks) scripts run as-is in a scratch folder
+3. For each one it reports files, MB, wall time, files/s, MB/s, peak RSS of the child,
+requests made and errors, so runs before and after a change can be compared;
+--json saves the numbers
+4. Scratch folders are deleted afterwards unless --keep is given
+5. --stall-rate makes some files trickle after half their bytes; --stall-window sets how
+long the stall watchdog waits before dropping them (see watchdog.py)
+
+Usage, from the datasets folder:
+python -m harvest.bench                                   (every scenario)
+python -m harvest.bench noaa_ll imls_mdf --latency 0.05 --bandwidth 20 --error-rate 0.01
+"""
+
+import os, sys, json, time, runpy, shutil, argparse, resource, subprocess, tempfile
+from harvest import manifest, mockserver
+
+DATASETS=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOSTS=['coast.noaa.gov','chs.coast.noaa.gov','coastalimagery.blob.core.windows.net',
+       'sciencecouncil.noaa.gov','sealevel.globalchange.gov','www.ncei.noaa.gov',
+       'www.imls.gov','www.irs.gov','api.dhsprogram.com','www.dhsprogram.com',
+       'profiles.nche.seiservices.com']
+SCRIPTS={'noaa_slr':'noaa_coast_slrviewer/downloader_noaa_slr.py',
+         'noaa_ll':'noaa_coast_llviewer/downloader_noaa_ll.py',
+         'dhs_data':'usaid_dhs_indicators/usaid_dhs_ind_data_downloader.py',
+         'nche':'nche_state_profiles/nche_state_profiles_downloader.py'}
+SPEC_NAMES=['imls_mdf','imls_pls','imls_slaa','irs_soi_eobmf','noaa_ncei_climate_glance']
+SCENARIOS=SPEC_NAMES+sorted(SCRIPTS)
+
+def measure(folder):
+    'Payload files, bytes and error lines written under folder'
+    files=0
+    nbytes=0
+    errors=0
+    for path,dirs,names in os.walk(folder):
+        for name in names:
+            if name.startswith('_ERRORS-'):
+                with open(os.path.join(path,name)) as readfile:
+                    errors=errors+max(0,len(readfile.readlines())-1)
+            elif manifest.is_payload(name) and not name.startswith('_WEBPAGE-'):
+                files=files+1
+                nbytes=nbytes+os.path.getsize(os.path.join(path,name))
+    return files,nbytes,errors
+
+def child(scenario,base,folder,stall_window=None):
+    'Runs one scenario against the stand-in and prints its numbers as JSON'
+    from harvest import session, watchdog
+    mockserver.redirect_hosts(base,HOSTS)
+    if stall_window:
+        watchdog.configure(window=stall_window,interval=min(watchdog.INTERVAL,stall_window/4))
+    os.chdir(folder)
+    start=time.monotonic()
+    with open(os.devnull,'w') as quiet:
+        stdout=sys.stdout
+        sys.stdout=quiet
+        try:
+            if scenario in SCRIPTS:
+                runpy.run_path(os.path.join(DATASETS,SCRIPTS[scenario]),run_name='__main__')
+            else:
+                from harvest import engine
+                from harvest.specs import SPECS
+                engine.harvest_spec(SPECS[scenario],os.path.join(folder,'downloaded-bench'),incremental=False)
+        finally:
+            sys.stdout=stdout
+    elapsed=time.monotonic()-start
+    files,nbytes,errors=measure(folder)
+    requests_made=sum(h['requests'] for h in session.stats.values())
+    print(json.dumps({'scenario':scenario,'files':files,'bytes':nbytes,'errors':errors,
+                      'seconds':elapsed,'requests':requests_made,'stalls':watchdog.dog.stalls,
+                      'maxrss_mb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024}))
+
+def run(scenario,base,keep,stall_window=None):
+    folder=tempfile.mkdtemp(prefix='bench-{}-'.format(scenario))
+    cmd=[sys.executable,'-m','harvest.bench','--child',scenario,'--base',base,'--folder',folder]
+    if stall_window:
+        cmd.extend(['--stall-window',str(stall_window)])
+    try:
+        done=subprocess.run(cmd,cwd=DATASETS,capture_output=True,text=True)
+        if done.returncode!=0:
+            lines=done.stderr.split('Traceback')[-1].splitlines()
+            final=[l for l in lines if l and not l[0].isspace()]
+            print(scenario,'stopped:',final[-1] if final else 'exit code {}'.format(done.returncode))
+            return None
+        return json.loads(done.stdout.strip().splitlines()[-1])
+    finally:
+        if keep:
+            print('Kept',folder)
+        else:
+            shutil.rmtree(folder,ignore_errors=True)
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Benchmark the harvesters against a local stand-in server')
+    parser.add_argument('scenarios',nargs='*',help='one or more of: '+', '.join(SCENARIOS))
+    parser.add_argument('--latency',type=float,default=0.0,help='seconds added to every response')
+    parser.add_argument('--bandwidth',type=float,default=0,help='MB/s per response, 0 for unlimited')
+    parser.add_argument('--error-rate',type=float,default=0.0,help='fraction of requests answered 500')
+    parser.add_argument('--rate-limit',type=float,default=0,help='requests/s per host before 429s, 0 for none')
+    parser.add_argument('--stall-rate',type=float,default=0.0,help='fraction of files that stall halfway')
+    parser.add_argument('--stall-window',type=float,help='seconds below the floor before a stream is dropped')
+    parser.add_argument('--file-size',type=float,default=1.0,help='MB per synthetic file')
+    parser.add_argument('--files-per-list',type=int,default=2)
+    parser.add_argument('--surveys',type=int,default=4,help='DHS surveys to serve')
+    parser.add_argument('--json',help='save results to this file')
+    parser.add_argument('--keep',action='store_true',help='keep the scratch folders')
+    parser.add_argument('--child',help=argparse.SUPPRESS)
+    parser.add_argument('--base',help=argparse.SUPPRESS)
+    parser.add_argument('--folder',help=argparse.SUPPRESS)
+    args=parser.parse_args(argv)
+    if args.child:
+        child(args.child,args.base,args.folder,args.stall_window)
+        return 0
+    unknown=[s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error('no scenario '+', '.join(unknown))
+
+    site=mockserver.MockSite(file_size=int(args.file_size*1000000),files_per_list=args.files_per_list,
+                             surveys=args.surveys,latency=args.latency,
+                             bandwidth=args.bandwidth*1000000,error_rate=args.error_rate,
+                             rate_limit=args.rate_limit,stall_rate=args.stall_rate)
+    server,base=mockserver.start(site)
+    print('{:<26} {:>6} {:>9} {:>8} {:>8} {:>8} {:>9} {:>8} {:>7} {:>7}'.format(
+        'scenario','files','MB','seconds','files/s','MB/s','RSS MB','requests','errors','stalls'))
+    results=[]
+    for scenario in args.scenarios or SCENARIOS:
+        r=run(scenario,base,args.keep,args.stall_window)
+        if r is None:
+            print('{:<26} FAILED'.format(scenario))
+            continue
+        results.append(r)
+        secs=r['seconds']
+        print('{:<26} {:>6,} {:>9,.1f} {:>8,.2f} {:>8,.1f} {:>8,.1f} {:>9,.1f} {:>8,} {:>7,} {:>7,}'.format(
+            scenario,r['files'],r['bytes']/1000000,secs,r['files']/secs,r['bytes']/1000000/secs,
+            r['maxrss_mb'],r['requests'],r['errors'],r['stalls']))
+    print('Stand-in server: {} requests, {} answered 429, {} answered 500, {} stalled, {} postbacks'.format(
+        site.requests,site.limited,site.failed,site.stalled,site.postbacks))
+    server.shutdown()
+    if args.json:
+        with open(args.json,'w') as writefile:
+            json.dump({'settings':vars(args),'results':results},writefile,indent=1)
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
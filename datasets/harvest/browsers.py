@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+A pool of long-lived headless browsers for pages that need Selenium
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Scripts that drive JS pages used to start a new Firefox for every page and sleep a
+fixed 5-10 seconds after each step; starting Firefox takes longer than most pages
+2. BrowserPool keeps up to size headless Firefox sessions open for the whole run; run()
+hands tasks to that many worker threads, each borrowing one browser per task and
+returning it afterwards, so at most size pages are worked at once
+3. A browser whose session has died is quit and replaced, one whose task merely failed
+is reused
+4. set_download_dir points a running Firefox at a new folder before each task, by
+setting browser.download.dir from the privileged chrome context, so each task's files
+land straight in its own folder
+5. wait_for waits for an element by id (present, or clickable) and wait_for_download
+waits until a new file is in the folder, no .part file is left and its size holds
+still, in place of fixed sleeps; both give up after TIMEOUT seconds
+6. Tasks record the seconds spent in each stage with stage(); run() adds the total,
+prints a line per task, emits a telemetry 'task' event and returns the timings,
+which write_timings saves as _TIMINGS-<date>.json beside the downloads; run_timed does
+the same on plain threads, for tasks that need no browser (see aspnet.py)
+7. Selenium and geckodriver are only needed by the scripts that use this module
+(have_selenium()); chrome context access needs -remote-allow-system-access on
+Firefox 138 and later, older versions ignore the flag
+"""
+
+import os, json, time, queue, tempfile, shutil, threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from harvest import telemetry
+
+WORKERS=4
+TIMEOUT=60 # seconds to wait for an element or a download
+POLL=0.5
+SAVE_TYPES=','.join(['application/x-gzip','application/gzip','application/zip','application/pdf',
+                     'application/octet-stream','application/vnd.ms-excel','text/csv',
+                     'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'])
+
+class DownloadTimeout(TimeoutError):
+    'Raised when no finished file turned up in the download folder in time'
+
+def have_selenium():
+    try:
+        import selenium
+        return True
+    except ImportError:
+        return False
+
+def firefox_options(download_dir,headless=True):
+    'Firefox that saves downloads to download_dir without asking'
+    from selenium.webdriver.firefox.options import Options
+    options=Options()
+    if headless:
+        options.add_argument('-headless')
+    options.add_argument('-remote-allow-system-access') # for set_download_dir
+    options.set_preference('browser.download.folderList',2)
+    options.set_preference('browser.download.manager.showWhenStarting',False)
+    options.set_preference('browser.download.alwaysOpenPanel',False)
+    options.set_preference('browser.download.useDownloadDir',True)
+    options.set_preference('browser.download.dir',download_dir)
+    options.set_preference('browser.helperApps.neverAsk.saveToDisk',SAVE_TYPES)
+    options.set_preference('pdfjs.disabled',True) # save PDFs rather than show them
+    return options
+
+def set_download_dir(driver,path):
+    'Points a running Firefox at a new download folder'
+    with driver.context(driver.CONTEXT_CHROME):
+        driver.execute_script('Services.prefs.setStringPref("browser.download.dir", arguments[0]);',
+                              os.path.abspath(path))
+
+def wait_for(driver,element_id,timeout=TIMEOUT,clickable=False):
+    'Returns the element with element_id once it is on the page (and clickable if asked)'
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    condition=EC.element_to_be_clickable if clickable else EC.presence_of_element_located
+    return WebDriverWait(driver,timeout,poll_frequency=POLL).until(condition((By.ID,element_id)))
+
+def listing(folder):
+    return set(os.listdir(folder))
+
+def wait_for_download(folder,before,timeout=TIMEOUT):
+    'Waits for new files in folder, not in before, to finish, returns their names'
+    deadline=time.monotonic()+timeout
+    sizes=None
+    while time.monotonic()<deadline:
+        names=listing(folder)
+        new=sorted(n for n in names-before if not n.endswith('.part'))
+        if new and not any(n.endswith('.part') for n in names):
+            current=[os.path.getsize(os.path.join(folder,n)) for n in new]
+            if current==sizes:
+                return new
+            sizes=current
+        else:
+            sizes=None
+        time.sleep(POLL)
+    raise DownloadTimeout('No finished download in {} after {} s'.format(folder,timeout))
+
+def close_extra_windows(driver):
+    'Closes any tabs a click opened and goes back to the first one'
+    handles=driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+
+@contextmanager
+def stage(timing,name):
+    'Adds the seconds spent in the block to timing[name]'
+    start=time.perf_counter()
+    try:
+        yield
+    finally:
+        timing[name]=timing.get(name,0.0)+time.perf_counter()-start
+
+class BrowserPool:
+    'Up to size long-lived browsers, borrowed one per task'
+    def __init__(self,size=WORKERS,headless=True,make=None):
+        self.size=size
+        self.headless=headless
+        self.make=make or self.firefox
+        self.scratch=tempfile.mkdtemp(prefix='harvest-browsers-') # downloads before the first task
+        self.idle=queue.LifoQueue()
+        self.drivers={} # driver -> worker number
+        self.lock=threading.Lock()
+        self.started=0
+        self.replaced=0
+
+    def firefox(self):
+        from selenium import webdriver
+        return webdriver.Firefox(options=firefox_options(self.scratch,self.headless))
+
+    def alive(self,driver):
+        try:
+            driver.current_url
+            return True
+        except Exception: # a dead session fails in webdriver, urllib3 or the socket
+            return False
+
+    def discard(self,driver):
+        with self.lock:
+            self.drivers.pop(driver,None)
+            self.replaced=self.replaced+1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @contextmanager
+    def browser(self):
+        'Borrows an idle browser, starting one if none is free, returns (driver, worker number)'
+        try:
+            driver=self.idle.get_nowait()
+        except queue.Empty:
+            driver=self.make()
+            with self.lock:
+                self.started=self.started+1
+                self.drivers[driver]=self.started
+        try:
+            yield driver,self.drivers[driver]
+        except Exception:
+            if self.alive(driver):
+                self.idle.put(driver)
+            else:
+                self.discard(driver)
+            raise
+        self.idle.put(driver)
+
+    def close(self):
+        with self.lock:
+            drivers=list(self.drivers)
+            self.drivers.clear()
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        shutil.rmtree(self.scratch,ignore_errors=True)
+
+def run_timed(tasks,work,workers=WORKERS):
+    '''Runs work(name, item, timing) for each (name, item) in tasks on workers threads,
+    prints a line per task, returns ({name: timing}, {name: error})'''
+    timings={}
+    errors={}
+    lock=threading.Lock()
+
+    def one(name,item):
+        timing={}
+        start=time.perf_counter()
+        error=None
+        try:
+            work(name,item,timing)
+        except Exception as e:
+            message=str(e).strip().splitlines() # webdriver messages carry a stack trace
+            error='{}: {}'.format(type(e).__name__,message[0] if message else '')
+        timing['total']=time.perf_counter()-start
+        stages=', '.join('{} {:,.1f}'.format(k,v) for k,v in timing.items()
+                         if isinstance(v,float) and k!='total')
+        if error is None:
+            print('{}: {} files in {:,.1f} s ({})'.format(name,timing.get('files',0),timing['total'],stages))
+        else:
+            print('{}: failed after {:,.1f} s, {}'.format(name,timing['total'],error))
+        telemetry.emit('task',task=name,error=error,**timing)
+        with lock:
+            timings[name]=timing
+            if error is not None:
+                errors[name]=error
+
+    start=time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for name,item in tasks:
+            executor.submit(one,name,item)
+    print('Finished {} tasks in {:,.1f} s on {} workers, {} failed'.format(
+        len(timings),time.perf_counter()-start,workers,len(errors)))
+    return timings,errors
+
+def run(tasks,work,workers=WORKERS,headless=True,pool=None):
+    '''Runs work(driver, name, item, timing) for each (name, item) in tasks on a pool
+    of browsers, returns ({name: timing}, {name: error})'''
+    own=pool is None
+    pool=pool or BrowserPool(workers,headless)
+
+    def borrow(name,item,timing):
+        with pool.browser() as (driver,worker):
+            timing['worker']=worker
+            work(driver,name,item,timing)
+
+    try:
+        return run_timed(tasks,borrow,pool.size)
+    finally:
+        if own:
+            pool.close()
+        print('Started {} browsers, replaced {}'.format(pool.started,pool.replaced))
+
+def write_timings(folder,timings,errors=None):
+    'Saves per-task stage timings as folder/_TIMINGS-<date>.json, returns the path'
+    path=os.path.join(folder,'_TIMINGS-{}.json'.format(date.today()))
+    with open(path,'w') as writefile:
+        json.dump({'tasks':timings,'errors':errors or {}},writefile,indent=1,sort_keys=True)
+    return path
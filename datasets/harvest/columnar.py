@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Parquet output alongside the CSV files
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Optional: needs pyarrow, callers check have_pyarrow() and carry on with CSV only
+2. Columns are typed, strings are dictionary encoded, pages are zstd compressed
+3. Every row group keeps min/max statistics, so a filtered read (e.g. on IndicatorId
+or year_published) skips row groups that can't match; sorting on the filter column
+before writing makes those ranges tight
+4. BatchWriter takes records a batch at a time so a large file is never held whole;
+the schema is passed in when the caller knows the whole file's columns (see
+schema_from_dtypes), otherwise it comes from the first batch and a later batch with a
+key the schema lacks raises ValueError rather than losing the column
+5. Sorting a batch at a time would leave every row group spanning the whole range, so
+BatchWriter spills batches unsorted to an uncompressed Arrow file beside the output and
+sorts once at close(): the file is memory mapped, the order comes from the sort columns
+alone, and rows are taken a row group at a time into the parquet
+"""
+
+import os
+
+ROW_GROUP=50000
+COMPRESSION='zstd'
+
+def have_pyarrow():
+    try:
+        import pyarrow, pyarrow.parquet
+        return True
+    except ImportError:
+        return False
+
+def write_options():
+    return {'compression':COMPRESSION,'use_dictionary':True,'write_statistics':True}
+
+def sort_keys(table,sort_by):
+    return [(c,'ascending') for c in sort_by or [] if c in table.column_names]
+
+def sort_table(table,sort_by):
+    'Sorts a pyarrow table on the columns in sort_by that it actually has'
+    keys=sort_keys(table,sort_by)
+    return table.sort_by(keys) if keys else table
+
+def write_dataframe(df,path,sort_by=None,row_group_size=ROW_GROUP):
+    'Writes a whole pandas DataFrame as parquet, sorted on sort_by for tight row-group stats'
+    import pyarrow as pa, pyarrow.parquet as pq
+    table=sort_table(pa.Table.from_pandas(string_columns(df),preserve_index=False),sort_by)
+    tmp=path+'.part'
+    pq.write_table(table,tmp,row_group_size=row_group_size,**write_options())
+    os.replace(tmp,path)
+
+def string_columns(df):
+    'A copy of df with object (mixed text/number) columns as plain strings'
+    df=df.copy()
+    for c in df.columns:
+        if df[c].dtype==object:
+            df[c]=df[c].astype('string')
+    return df
+
+def schema_from_dtypes(columns,dtypes):
+    'An Arrow schema for columns typed as {column: pandas dtype}, object columns as strings'
+    import pyarrow as pa
+    return pa.schema([(c,pa.string() if dtypes[c].kind in 'OSU' else pa.from_numpy_dtype(dtypes[c]))
+                      for c in columns])
+
+class BatchWriter:
+    'Collects batches of records (lists of dicts) into one parquet file, sorted on sort_by at close'
+    def __init__(self,path,sort_by=None,row_group_size=ROW_GROUP,schema=None):
+        self.path=path
+        self.tmp=path+'.part'
+        self.spill=path+'.arrow.part'
+        self.sort_by=sort_by
+        self.row_group_size=row_group_size
+        self.writer=None
+        self.schema=schema
+
+    def write(self,records):
+        import pyarrow as pa
+        if self.schema is None:
+            table=pa.Table.from_pylist(records)
+            self.schema=table.schema
+        else:
+            unknown={k for rec in records for k in rec}-set(self.schema.names)
+            if unknown:
+                raise ValueError('columns not in the parquet schema: {}'.format(', '.join(sorted(unknown))))
+            table=pa.Table.from_pylist(records,schema=self.schema) # raises if types drift
+        self.write_table(table)
+
+    def write_frame(self,df):
+        'Writes a DataFrame batch, its columns cast to the schema'
+        import pyarrow as pa
+        df=string_columns(df)
+        if self.schema is None:
+            table=pa.Table.from_pandas(df,preserve_index=False)
+            self.schema=table.schema
+        else:
+            table=pa.Table.from_pandas(df,schema=self.schema,preserve_index=False)
+        self.write_table(table)
+
+    def write_table(self,table):
+        import pyarrow.ipc as ipc
+        if self.writer is None:
+            self.writer=ipc.new_file(self.spill,self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        'Sorts the spilled batches into the parquet file'
+        import pyarrow as pa, pyarrow.compute as pc, pyarrow.ipc as ipc, pyarrow.parquet as pq
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer=None
+        with pa.memory_map(self.spill) as source:
+            table=ipc.open_file(source).read_all()
+            keys=sort_keys(table,self.sort_by)
+            order=pc.sort_indices(table,sort_keys=keys) if keys else None # reads the sort columns only
+            with pq.ParquetWriter(self.tmp,self.schema,**write_options()) as writer:
+                for start in range(0,table.num_rows,self.row_group_size):
+                    if order is None:
+                        rows=table.slice(start,self.row_group_size)
+                    else:
+                        rows=table.take(order.slice(start,self.row_group_size))
+                    writer.write_table(rows,row_group_size=self.row_group_size)
+        os.remove(self.spill)
+        os.replace(self.tmp,self.path)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer=None
+        for path in (self.spill,self.tmp):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent discovery of URLlist_*.txt file lists, cached per snapshot
+Brown University Library, GIS & Data Services
+
+Notes:
+1. The NOAA pages list their files in URLlist_*.txt text files, one url per line;
+resolve() fetches all of a run's lists at once through a bounded pool instead of one
+blocking request after another
+2. Each list, its url, ETag and Last-Modified are saved in the snapshot's _DISCOVERY.json
+3. Rerunning or resuming on the same day reuses the saved lists without any request
+4. A new snapshot asks for each list conditionally, using the previous snapshot's
+validators, and a 304 reuses the previous list
+5. refresh=True ignores today's saved lists and revalidates everything
+6. stream() yields each list as soon as it arrives, so downloads can begin while the
+rest are still being fetched (see products.py)
+7. List requests are retried by the session (see retry.py); a list that still fails
+is kept in failed with its error, left out of _DISCOVERY.json so the next run asks
+again, and does not stop the other lists
+"""
+
+import os, json, threading, requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from harvest import session, snapshots
+from harvest.pool import HostLimiter, WORKERS, PER_HOST
+
+DISCOVERY='_DISCOVERY.json'
+
+def load_index(snapshot):
+    'Reads _DISCOVERY.json from a snapshot folder, empty dict if missing'
+    if snapshot is None:
+        return {}
+    dpath=os.path.join(snapshot,DISCOVERY)
+    if not os.path.exists(dpath):
+        return {}
+    with open(dpath) as readfile:
+        return json.load(readfile)
+
+def parse_list(text):
+    'One url per line, dropping the empty line after the final newline'
+    filelist=text.split('\n')
+    if filelist[-1]=="":
+        del filelist[-1]
+    return filelist
+
+class DiscoveryIndex:
+    'Resolved file lists for one snapshot, with the validators to recheck them'
+    def __init__(self,outfolder,refresh=False):
+        self.outfolder=os.path.abspath(outfolder)
+        self.current={} if refresh else load_index(self.outfolder)
+        self.old=load_index(snapshots.previous_snapshot(self.outfolder))
+        self.new={}
+        self.lock=threading.Lock()
+        self.counts={'saved':0,'unchanged':0,'fetched':0}
+        self.failed={} # list url -> error
+
+    def fetch_list(self,url):
+        'Returns the urls listed at url, using a saved copy when it is still good'
+        if url in self.current:
+            entry=self.current[url]
+            how='saved'
+        else:
+            old=self.old.get(url,{})
+            headers={}
+            if old.get('etag'):
+                headers['If-None-Match']=old['etag']
+            if old.get('last_modified'):
+                headers['If-Modified-Since']=old['last_modified']
+            response=session.get(url,headers=headers)
+            if response.status_code==304 and old:
+                urls=old['urls']
+                how='unchanged'
+            else:
+                response.raise_for_status()
+                urls=parse_list(response.text)
+                how='fetched'
+            entry={'urls':urls,
+                   'etag':response.headers.get('ETag') or old.get('etag'),
+                   'last_modified':response.headers.get('Last-Modified') or old.get('last_modified'),
+                   'checked':datetime.now(timezone.utc).isoformat(timespec='seconds')}
+        with self.lock:
+            self.new[url]=entry
+            self.counts[how]=self.counts[how]+1
+        return list(entry['urls'])
+
+    def stream(self,list_urls,workers=WORKERS,per_host=PER_HOST,limiter=None):
+        'Fetches every list concurrently, yields (list url, [file urls]) as each arrives, skipping failures'
+        if limiter is None:
+            limiter=HostLimiter(per_host)
+        def worker(url):
+            with limiter.get(url):
+                return self.fetch_list(url)
+        unique=list(dict.fromkeys(list_urls))
+        try:
+            with ThreadPoolExecutor(max_workers=max(1,workers)) as executor:
+                futures={executor.submit(worker,u):u for u in unique}
+                for f in as_completed(futures):
+                    try:
+                        urls=f.result()
+                    except requests.exceptions.RequestException as e:
+                        print('Could not retrieve list',futures[f],'because of',e)
+                        with self.lock:
+                            self.failed[futures[f]]=e
+                        continue
+                    yield futures[f],urls
+        finally:
+            self.save() # keep whatever was resolved if the run stops
+        print(self.summary())
+
+    def resolve(self,list_urls,workers=WORKERS,per_host=PER_HOST,limiter=None):
+        'Fetches every list concurrently, returns {list url: [file urls]} in input order, empty for failures'
+        lists=dict(self.stream(list_urls,workers,per_host,limiter))
+        return {u:lists.get(u,[]) for u in dict.fromkeys(list_urls)}
+
+    def save(self):
+        'Writes _DISCOVERY.json, keeping lists saved earlier today that were not asked for'
+        with self.lock:
+            merged=dict(self.current)
+            merged.update(self.new)
+            tmp=os.path.join(self.outfolder,DISCOVERY+'.tmp')
+            with open(tmp,'w') as writefile:
+                json.dump(merged,writefile,indent=1,sort_keys=True)
+            os.replace(tmp,os.path.join(self.outfolder,DISCOVERY))
+
+    def summary(self):
+        line='Discovered {} file lists: {} saved earlier today, {} unchanged since the last snapshot, {} fetched'.format(
+            sum(self.counts.values()),self.counts['saved'],self.counts['unchanged'],self.counts['fetched'])
+        if self.failed:
+            line=line+', {} failed'.format(len(self.failed))
+        return line
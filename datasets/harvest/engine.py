@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+One harvesting engine for the single-page dataset specs
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Scrape the page, filter and rebase links per the spec, crawl any sub-pages,
+download, then save the page, metadata and errors, same as the old scripts, plus a
+checksum manifest of everything saved and a check of every ZIP as it lands
+2. Each dataset script calls harvest_spec for its own spec
+3. Running the module harvests several datasets in one process: scrapes run side by
+side and every download goes through one shared worker pool and per-host limiter
+
+Usage, from the datasets folder:
+python -m harvest.engine                      (every spec)
+python -m harvest.engine imls_mdf imls_pls    (just these)
+python -m harvest.engine --cache replay       (pages and sub-pages from the saved cache only)
+python -m harvest.engine --telemetry logs --prom-dir /var/lib/node_exporter/textfile_collector
+"""
+
+import os, sys, argparse, threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from harvest import links as linkparse, pages, pool, session, snapshots, telemetry
+from harvest.archives import ArchiveChecker
+from harvest.manifest import Manifest
+from harvest.specs import SPECS
+
+DATASETS=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def rebase(href,rules):
+    'Puts the matching base in front of a relative href'
+    for prefix,base in rules.items():
+        if href.startswith(prefix):
+            return base+href
+    return href
+
+def hrefs(links):
+    'href values of anchors that have one'
+    for lnk in links:
+        if 'href' in lnk.attrs:
+            yield lnk.attrs['href']
+
+def select_links(links,spec):
+    'Returns {filename: url} for data links and a list of sub-page urls'
+    datalinks={}
+    sub_urls=[]
+    subpages=spec.get('subpages')
+    for href in hrefs(links):
+        if href.startswith(spec['skip']):
+            continue
+        if spec['extensions'] is None or href.endswith(spec['extensions']):
+            filename=href.split('/')[-1]
+            if filename:
+                datalinks[filename]=rebase(href,spec['rebase'])
+        elif subpages and href.startswith(subpages['prefix']):
+            sub_urls.append(rebase(href,subpages['rebase']))
+    return datalinks,sub_urls
+
+def crawl_subpages(sub_urls,subpages,datalinks):
+    'Adds every link found in each sub-page container to datalinks'
+    pubcount=0
+    for p in sub_urls:
+        subpage=session.get(p).content
+        title,sublinks=linkparse.extract(subpage,subpages['container'])
+        for href in hrefs(sublinks):
+            datalinks[href.split('/')[-1]]=rebase(href,subpages['link_rebase'])
+            pubcount=pubcount+1
+    print('Got {} additional links for {} publications stored on different pages \n'.format(pubcount,len(sub_urls)))
+
+def scrape(spec):
+    'Returns the raw page, its title and {filename: url} for everything to download'
+    webpage,page_title,links=pages.page_scrape(spec['url'],spec['container'])
+    datalinks,sub_urls=select_links(links,spec)
+    if spec.get('subpages'):
+        crawl_subpages(sub_urls,spec['subpages'],datalinks)
+    return webpage,page_title,datalinks
+
+def harvest_spec(spec,outfolder,incremental=True,workers=pool.WORKERS,per_host=pool.PER_HOST,
+                 executor=None,limiter=None,today=None):
+    'Runs one spec into outfolder, returns (count, errors)'
+    today=today if today is not None else str(date.today())
+    if not os.path.exists(outfolder):
+        os.makedirs(outfolder)
+    tracker=snapshots.Incremental(outfolder) if incremental else None
+    manifest=Manifest(outfolder,snapshots.previous_snapshot(outfolder))
+    archives=ArchiveChecker(outfolder)
+    webpage,page_title,datalinks=scrape(spec)
+    counter,errors=pool.download_all(list(datalinks.values()),outfolder,page_title,
+                                     workers=workers,per_host=per_host,incremental=tracker,
+                                     manifest=manifest,executor=executor,limiter=limiter,
+                                     archives=archives)
+    archives.close()
+    if tracker is not None:
+        print(tracker.summary())
+    pages.save_page(spec['url'],outfolder,webpage,today,manifest)
+    pages.write_metadata(spec['dataset'],pages.PERSON,page_title,spec['url'],counter,errors,outfolder,today,
+                         archives.summary())
+    return counter,errors
+
+def harvest_all(names,workers=pool.WORKERS,per_host=pool.PER_HOST,incremental=True):
+    'Harvests several specs at once through one shared download pool'
+    today=str(date.today())
+    session.configure(pool_maxsize=workers)
+    limiter=pool.HostLimiter(per_host)
+    results={}
+    with ThreadPoolExecutor(max_workers=max(1,workers)) as executor:
+        def run(name):
+            outfolder=os.path.join(DATASETS,name,'downloaded-'+today)
+            try:
+                results[name]=harvest_spec(SPECS[name],outfolder,incremental,workers,per_host,
+                                           executor,limiter,today)
+            except Exception as e: # one broken page should not stop the other datasets
+                print('Could not harvest',name,'because of',e)
+                results[name]=None
+        threads=[threading.Thread(target=run,args=(n,)) for n in names]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    for name in names:
+        if results[name] is None:
+            print(name+': FAILED')
+        else:
+            counter,errors=results[name]
+            print('{}: {} files, {} errors'.format(name,counter,len(errors)))
+    session.report()
+    return results
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Harvest the single-page datasets in one process')
+    parser.add_argument('names',nargs='*',help='spec names: '+', '.join(sorted(SPECS)))
+    parser.add_argument('--workers',type=int,default=pool.WORKERS)
+    parser.add_argument('--per-host',type=int,default=pool.PER_HOST)
+    parser.add_argument('--full',action='store_true',help='download everything, not just changed files')
+    parser.add_argument('--cache',choices=['record','replay'],help='save pages to disk, or serve only saved ones')
+    parser.add_argument('--extractor',choices=linkparse.EXTRACTORS,help='how links are pulled from pages (default: stream)')
+    parser.add_argument('--telemetry',help='folder for the JSONL event log')
+    parser.add_argument('--prom-dir',help='node exporter textfile folder for the metrics (default: --telemetry)')
+    args=parser.parse_args(argv)
+    unknown=[n for n in args.names if n not in SPECS]
+    if unknown:
+        parser.error('no spec for '+', '.join(unknown))
+    if args.cache:
+        session.configure(cache=args.cache)
+    if args.extractor:
+        linkparse.configure(args.extractor)
+    if args.telemetry:
+        telemetry.start(args.telemetry,args.prom_dir)
+    harvest_all(args.names or sorted(SPECS),args.workers,args.per_host,not args.full)
+
+if __name__=='__main__':
+    sys.exit(main())
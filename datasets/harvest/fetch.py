@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Resumable single file downloads
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Bytes are written to a .part file next to the final file, never to the final name
+2. The response's Content-Length, ETag, and Last-Modified are kept in a .part.json sidecar
+3. If a .part exists on the next run, a Range request picks up where it stopped, with
+If-Range so a file that changed on the server is restarted from zero instead
+4. Only when the size matches the expected length is the .part renamed into place
+5. Requests go through the shared pooled session (session.py).
+Identity encoding is requested so Content-Length and Range count the bytes on disk
+6. With an Incremental tracker (see snapshots.py) the request is made conditional on
+the previous snapshot's copy, and a 304 links that copy forward instead
+7. With a Manifest (see manifest.py) bytes are hashed as they are written and the
+file's size, sha256, url and validators are recorded once it is in place
+8. The body is read straight into one preallocated buffer per worker thread
+(readinto on a memoryview) and written from it, instead of allocating a new bytes
+object for every chunk; BUFSIZE sets the buffer size, default 1 MB; reads are
+capped so a body at the stall floor still reports progress within the window
+9. Transient failures (dropped connections, timeouts, short reads, 429 and 5xx) are
+tried again with backoff behind the per-host circuit breaker (see retry.py), each
+attempt resuming from the .part; only permanent failures reach the caller; that
+includes a body the stall watchdog dropped for trickling in below its floor
+(see watchdog.py); only errors reading the body count as network errors, an error
+writing the file (a full disk, a denied write) is raised as it is and not retried
+10. Each call is recorded as a telemetry 'file' event (see telemetry.py) with its bytes,
+time to first byte, total duration, status and outcome: downloaded, resumed, carried
+(linked from the previous snapshot), completed (a finished .part renamed) or failed
+"""
+
+import requests, os, json, time, hashlib, threading, http.client
+from harvest import retry, session, telemetry, watchdog
+from harvest.manifest import HashingFile, hash_file
+
+BUFSIZE=1048576
+_buffers=threading.local()
+
+class IncompleteDownload(requests.exceptions.RequestException):
+    'Raised when the bytes on disk do not add up to the expected length'
+
+def read_partmeta(metapath):
+    'Returns the validators saved with a .part file, or an empty dict'
+    if not os.path.exists(metapath):
+        return {}
+    try:
+        with open(metapath) as readfile:
+            return json.load(readfile)
+    except (OSError, ValueError):
+        return {}
+
+def write_partmeta(metapath,meta):
+    'Saves validators for a .part file'
+    with open(metapath,'w') as writefile:
+        json.dump(meta,writefile)
+
+def total_length(response):
+    'Full size of the file from Content-Range (206) or Content-Length (200), or None'
+    crange=response.headers.get('Content-Range','')
+    if '/' in crange and not crange.endswith('/*'):
+        return int(crange.rsplit('/',1)[1])
+    clen=response.headers.get('Content-Length')
+    if clen is not None and response.status_code==200:
+        return int(clen)
+    return None
+
+def get_buffer(bufsize=None):
+    'The calling thread\'s reusable read buffer, as a memoryview'
+    bufsize=bufsize or BUFSIZE
+    view=getattr(_buffers,'view',None)
+    if view is None or len(view)!=bufsize:
+        view=memoryview(bytearray(bufsize))
+        _buffers.view=view
+    return view
+
+def stream_into(response,writefile,bufsize=None,url=None):
+    'Copies a streamed response body into writefile through a reused buffer, returns bytes'
+    view=get_buffer(bufsize)
+    raw=response.raw
+    fp=getattr(raw,'_fp',None)
+    # with no content coding the body can go from the socket into the buffer directly
+    direct=(fp is not None and hasattr(fp,'readinto')
+            and response.headers.get('Content-Encoding','identity').lower()=='identity')
+    if not direct:
+        raw.decode_content=True
+    source=fp if direct else raw
+    piece=view[:watchdog.dog.step(len(view))]
+    watched=watchdog.watch(response,url)
+    nbytes=0
+    try:
+        while True:
+            try:
+                n=source.readinto(piece)
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                if watched.stalled:
+                    break
+                if isinstance(e,ValueError):
+                    raise
+                raise requests.exceptions.ConnectionError(e)
+            if not n:
+                break
+            writefile.write(piece[:n]) # a full disk or a denied write is raised as it is, not retried
+            nbytes=nbytes+n
+            watched.progress(n)
+    finally:
+        watchdog.release(watched)
+    if watched.stalled: # cut off by the watchdog, with or without an error from the read
+        raise watchdog.Stalled('stalled below {:,} bytes/s after {:,} bytes: {}'.format(
+            watchdog.dog.floor,nbytes,url or response.url))
+    if direct and fp.isclosed():
+        raw.release_conn() # what urllib3 does itself at the end of a body, keeps the connection pooled
+    return nbytes
+
+def fetch_file(url,outpath,fname=None,incremental=None,manifest=None,bufsize=None,attempts=None):
+    'Streams url into outpath, resuming a .part left by an earlier run, returns bytes written'
+    if fname is None:
+        fname=os.path.split(url)[1]
+    filepath=os.path.join(outpath,fname)
+    info={'status':None,'ttfb':None,'outcome':'downloaded','retries':0}
+    def attempt(n):
+        info.update(status=None,ttfb=None,outcome='downloaded',retries=n)
+        return transfer(url,filepath,incremental,manifest,bufsize,info)
+    start=time.monotonic()
+    try:
+        nbytes=retry.call(url,attempt,attempts)
+    except requests.exceptions.RequestException as e:
+        telemetry.emit('file',url=url,host=telemetry.host_of(url),path=filepath,bytes=None,
+                       ttfb=info['ttfb'],duration=time.monotonic()-start,status=info['status'],
+                       outcome='failed',retries=info['retries'],error='{}: {}'.format(type(e).__name__,e))
+        raise
+    telemetry.emit('file',url=url,host=telemetry.host_of(url),path=filepath,bytes=nbytes,
+                   ttfb=info['ttfb'],duration=time.monotonic()-start,status=info['status'],
+                   outcome=info['outcome'],retries=info['retries'])
+    return nbytes
+
+def transfer(url,filepath,incremental,manifest,bufsize,info):
+    'The download itself; fills info with status, time to first byte and outcome'
+    partpath=filepath+'.part'
+    metapath=partpath+'.json'
+
+    meta=read_partmeta(metapath)
+    have=os.path.getsize(partpath) if os.path.exists(partpath) else 0
+    headers={'Accept-Encoding':'identity'}
+    validator=meta.get('etag') or meta.get('last_modified')
+    if have>0 and validator:
+        headers['Range']='bytes={}-'.format(have)
+        headers['If-Range']=validator
+    else:
+        have=0
+
+    prevpath=None
+    if incremental is not None and have==0:
+        prevpath,old=incremental.prior(filepath)
+        if prevpath is not None:
+            headers.update(incremental.conditional_headers(old))
+            head=incremental.same_size(url,prevpath) if len(old)==0 else None
+            if head is not None:
+                info['outcome']='carried'
+                carry(prevpath,filepath,url,old,head,incremental,manifest)
+                return 0
+
+    nbytes=0
+    with session.get(url, stream=True, headers=headers) as response:
+        info['status']=response.status_code
+        info['ttfb']=response.elapsed.total_seconds()
+        if response.status_code==304 and prevpath is not None:
+            info['outcome']='carried'
+            carry(prevpath,filepath,url,old,response.headers,incremental,manifest)
+            return 0
+        if response.status_code==416 and have>0 and have==meta.get('length'):
+            # a previous run got every byte but stopped before renaming
+            info['outcome']='completed'
+            finish(partpath,metapath,filepath,url,meta,hash_file(partpath),incremental,manifest)
+            return 0
+        response.raise_for_status()
+        if response.status_code==206:
+            info['outcome']='resumed'
+            mode='ab'
+            h=hash_file(partpath) # only the resumed prefix is read back
+        else: # server sent the whole file, either first try or the file changed
+            mode='wb'
+            have=0
+            h=hashlib.sha256()
+        expected=total_length(response)
+        meta={'url':url,'length':expected,
+              'etag':response.headers.get('ETag'),
+              'last_modified':response.headers.get('Last-Modified')}
+        write_partmeta(metapath,meta)
+        with HashingFile(partpath,mode,h) as writefile:
+            nbytes=stream_into(response,writefile,bufsize,url)
+
+    size=os.path.getsize(partpath)
+    if expected is not None and size!=expected:
+        raise IncompleteDownload('got {} of {} bytes for {}, kept {} to resume'.format(size,expected,url,partpath))
+    finish(partpath,metapath,filepath,url,meta,h,incremental,manifest)
+    return nbytes
+
+def finish(partpath,metapath,filepath,url,meta,h,incremental,manifest):
+    'Renames a complete .part into place and records it'
+    os.replace(partpath,filepath)
+    os.remove(metapath)
+    if incremental is not None:
+        incremental.record(filepath,url,meta)
+    if manifest is not None:
+        manifest.add(filepath,os.path.getsize(filepath),h.hexdigest(),url,
+                     meta.get('etag'),meta.get('last_modified'))
+
+def carry(prevpath,filepath,url,old,headers,incremental,manifest):
+    'Links an unchanged file forward from the previous snapshot and records it'
+    entry=incremental.carry_forward(prevpath,filepath,url,old,headers)
+    if manifest is not None:
+        manifest.carry(filepath,url,entry['etag'],entry['last_modified'])
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Fixity verification for downloaded-* snapshot trees
+Brown University Library, GIS & Data Services
+
+Notes:
+1. verify re-hashes every file listed in each snapshot's manifest-sha256.txt and
+reports missing, changed, and unlisted files, with a pass/fail line per dataset
+2. Files are hashed in a pool of processes, each reading in large sequential blocks
+into one reused buffer (or through mmap with --mmap)
+3. A cache of size, mtime and last good hash lets verify skip files that passed within
+--max-age days and haven't been touched since
+4. backfill writes manifests for older snapshots that were made before manifests
+existed, such as imls_mdf/downloaded-2025-02-05; source urls come from
+_VALIDATORS.json where there is one
+5. Throughput (files and MB per second) is printed at the end
+
+Usage, from the datasets folder:
+python -m harvest.fixity verify [dataset or snapshot folders...] [--workers N]
+python -m harvest.fixity backfill [dataset or snapshot folders...]
+"""
+
+import os, sys, json, time, mmap, hashlib, argparse
+from concurrent.futures import ProcessPoolExecutor
+from harvest import manifest, snapshots
+from harvest.store import dataset_folders
+
+DATASETS=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE=os.path.join(DATASETS,'_fixity_cache.json')
+BLOCK=16777216
+
+def sha256_file(path,use_mmap=False,blocksize=BLOCK):
+    'Returns (path, sha256) reading the file once, sequentially'
+    h=hashlib.sha256()
+    with open(path,'rb') as readfile:
+        if use_mmap and os.fstat(readfile.fileno()).st_size>0:
+            with mmap.mmap(readfile.fileno(),0,access=mmap.ACCESS_READ) as mm:
+                for start in range(0,len(mm),blocksize):
+                    h.update(mm[start:start+blocksize])
+        else:
+            buf=bytearray(blocksize)
+            view=memoryview(buf)
+            while True:
+                n=readfile.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+    return path,h.hexdigest()
+
+def find_snapshots(paths):
+    'Snapshot folders under the given dataset folders (or the snapshots themselves)'
+    snaps=[]
+    for path in paths:
+        path=os.path.abspath(path)
+        if snapshots.SNAPSHOT.match(os.path.basename(path)):
+            snaps.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            if snapshots.SNAPSHOT.match(name) and os.path.isdir(os.path.join(path,name)):
+                snaps.append(os.path.join(path,name))
+    return snaps
+
+def payload_files(snap):
+    'Relative paths of every payload file in a snapshot'
+    found=[]
+    for path,folders,files in os.walk(snap):
+        for fname in files:
+            if manifest.is_payload(fname):
+                found.append(os.path.relpath(os.path.join(path,fname),snap).replace(os.sep,'/'))
+    return sorted(found)
+
+def load_bagit(snap):
+    'Reads manifest-sha256.txt into {path: sha256}'
+    listed={}
+    with open(os.path.join(snap,manifest.BAGIT)) as readfile:
+        for line in readfile:
+            if line.strip():
+                digest,rel=line.rstrip('\n').split('  ',1)
+                listed[rel]=digest
+    return listed
+
+def load_cache():
+    if os.path.exists(CACHE):
+        with open(CACHE) as readfile:
+            return json.load(readfile)
+    return {}
+
+def save_cache(cache):
+    tmp=CACHE+'.tmp'
+    with open(tmp,'w') as writefile:
+        json.dump(cache,writefile)
+    os.replace(tmp,CACHE)
+
+def cached(cache,path,digest,max_age):
+    'True if path passed with this hash recently and its size and mtime are unchanged'
+    entry=cache.get(path)
+    if entry is None or entry['sha256']!=digest:
+        return False
+    st=os.stat(path)
+    return (entry['size']==st.st_size and entry['mtime_ns']==st.st_mtime_ns
+            and time.time()-entry['verified']<max_age*86400)
+
+def hash_many(paths,workers,use_mmap):
+    'Hashes paths across a process pool, largest first so big files start early'
+    paths=sorted(paths,key=os.path.getsize,reverse=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(sha256_file,paths,[use_mmap]*len(paths))
+
+def verify(paths,workers,max_age,use_mmap):
+    'Checks every snapshot against its manifest, returns True if all pass'
+    cache=load_cache()
+    results={} # dataset -> [passed, failed, missing, unlisted, skipped]
+    problems=[]
+    todo={}
+    start=time.monotonic()
+    nbytes=0
+    for snap in find_snapshots(paths):
+        dataset=os.path.basename(os.path.dirname(snap))
+        res=results.setdefault(dataset,[0,0,0,0,0])
+        if not os.path.exists(os.path.join(snap,manifest.BAGIT)):
+            problems.append('{}: no manifest, run backfill'.format(os.path.relpath(snap,DATASETS)))
+            res[1]=res[1]+1
+            continue
+        listed=load_bagit(snap)
+        present=set(payload_files(snap))
+        for rel in sorted(present-set(listed)):
+            problems.append('UNLISTED {}'.format(os.path.relpath(os.path.join(snap,rel),DATASETS)))
+            res[3]=res[3]+1
+        for rel,digest in listed.items():
+            path=os.path.join(snap,rel)
+            if not os.path.exists(path):
+                problems.append('MISSING {}'.format(os.path.relpath(path,DATASETS)))
+                res[2]=res[2]+1
+            elif cached(cache,path,digest,max_age):
+                res[4]=res[4]+1
+            else:
+                todo[path]=(dataset,digest)
+
+    for path,actual in hash_many(list(todo),workers,use_mmap):
+        dataset,digest=todo[path]
+        st=os.stat(path)
+        nbytes=nbytes+st.st_size
+        if actual==digest:
+            results[dataset][0]=results[dataset][0]+1
+            cache[path]={'sha256':actual,'size':st.st_size,'mtime_ns':st.st_mtime_ns,'verified':time.time()}
+        else:
+            results[dataset][1]=results[dataset][1]+1
+            problems.append('CHANGED {}'.format(os.path.relpath(path,DATASETS)))
+            cache.pop(path,None)
+    elapsed=time.monotonic()-start
+    save_cache(cache)
+
+    for p in problems:
+        print(p)
+    ok=True
+    for dataset,(passed,failed,missing,unlisted,skipped) in sorted(results.items()):
+        status='PASS' if failed==0 and missing==0 else 'FAIL'
+        ok=ok and status=='PASS'
+        print('{}: {} - {} verified, {} cached, {} failed, {} missing, {} unlisted'.format(
+            status,dataset,passed,skipped,failed,missing,unlisted))
+    rate=len(todo)/elapsed if elapsed>0 else 0.0
+    print('Hashed {} files, {:,.1f} MB in {:,.1f} s ({:,.1f} files/s, {:,.1f} MB/s)'.format(
+        len(todo),nbytes/1000000,elapsed,rate,nbytes/1000000/elapsed if elapsed>0 else 0.0))
+    return ok
+
+def backfill(paths,workers,use_mmap):
+    'Writes manifests for snapshots that do not have one yet'
+    for snap in find_snapshots(paths):
+        if os.path.exists(os.path.join(snap,manifest.BAGIT)):
+            continue
+        validators=snapshots.load_validators(snap)
+        rels=payload_files(snap)
+        man=manifest.Manifest(snap)
+        for path,digest in hash_many([os.path.join(snap,r) for r in rels],workers,use_mmap):
+            rel=man.relpath(path)
+            old=validators.get(rel,{})
+            man.add(path,os.path.getsize(path),digest,old.get('url'),old.get('etag'),old.get('last_modified'))
+        man.save()
+        print('Wrote manifest for',os.path.relpath(snap,DATASETS),'with',len(rels),'files')
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Verify or backfill snapshot checksum manifests')
+    parser.add_argument('command',choices=['verify','backfill'])
+    parser.add_argument('folders',nargs='*',help='dataset or snapshot folders, default is all datasets')
+    parser.add_argument('--workers',type=int,default=os.cpu_count())
+    parser.add_argument('--max-age',type=float,default=30,help='days a cached pass stays valid, 0 to re-hash all')
+    parser.add_argument('--mmap',action='store_true',help='hash through mmap instead of buffered reads')
+    args=parser.parse_args(argv)
+    folders=args.folders or dataset_folders()
+    if args.command=='backfill':
+        backfill(folders,args.workers,args.mmap)
+        return 0
+    return 0 if verify(folders,args.workers,args.max_age,args.mmap) else 1
+
+if __name__=='__main__':
+    sys.exit(main())
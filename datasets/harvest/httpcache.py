@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk record/replay cache for pages and API responses
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Plain GETs made through the shared session (scraped pages, sub-pages, URL lists,
+API JSON) are saved to disk as a body file plus a small JSON of url, status and headers
+2. record mode serves a saved response younger than ttl seconds and fetches and saves
+anything else, so rerunning link extraction doesn't touch the live site
+3. replay mode is strict and offline: only saved responses are served, whatever their
+age, and anything not on disk raises CacheMiss instead of going to the network
+4. Streamed file downloads and Range requests are not cached; in replay mode they
+fail with CacheMiss like any other request that wasn't recorded
+5. Conditional headers are dropped when a request is answered from the cache
+6. 200s and redirects (a 3xx with a Location) are saved; the session follows a redirect
+one request at a time, so each hop is saved under its own url and a replayed redirect
+is followed through the cache like a live one
+7. Turn it on with session.configure(cache='record') or the HARVEST_CACHE environment
+variable (record or replay); HARVEST_CACHE_DIR and HARVEST_CACHE_TTL set the folder
+(default datasets/_httpcache) and age limit in seconds (default one day)
+"""
+
+import os, json, time, hashlib, threading
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CACHE_DIR=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'_httpcache')
+TTL=86400
+MODES=('record','replay')
+DROP_HEADERS=('content-encoding','content-length','transfer-encoding')
+
+class CacheMiss(requests.exceptions.RequestException):
+    'Raised in replay mode for a request that was never recorded'
+
+class HttpCache:
+    'Saved responses keyed by method and url'
+    def __init__(self,mode,folder=None,ttl=None):
+        if mode not in MODES:
+            raise ValueError('cache mode must be one of '+', '.join(MODES))
+        self.mode=mode
+        self.folder=folder or CACHE_DIR
+        self.ttl=TTL if ttl is None else ttl
+        self.lock=threading.Lock()
+        self.hits=0
+        self.stored=0
+        os.makedirs(self.folder,exist_ok=True)
+
+    def paths(self,method,url):
+        key=hashlib.sha256('{} {}'.format(method,url).encode()).hexdigest()
+        base=os.path.join(self.folder,key[:2],key)
+        return base+'.json',base+'.body'
+
+    def cacheable(self,request,stream):
+        'Plain GETs only; ranged requests are never served from or saved to the cache'
+        return (request.method=='GET' and not stream
+                and 'range' not in {k.lower() for k in request.headers})
+
+    def lookup(self,request):
+        'Returns a saved Response for request, or None'
+        metapath,bodypath=self.paths(request.method,request.url)
+        if not (os.path.exists(metapath) and os.path.exists(bodypath)):
+            return None
+        with open(metapath) as readfile:
+            meta=json.load(readfile)
+        if self.mode=='record' and time.time()-meta['recorded']>self.ttl:
+            return None
+        with open(bodypath,'rb') as readfile:
+            body=readfile.read()
+        response=requests.Response()
+        response.status_code=meta['status']
+        response.reason=meta.get('reason')
+        response.headers=CaseInsensitiveDict(meta['headers'])
+        response.headers['Content-Length']=str(len(body))
+        response.headers['X-Harvest-Cache']='hit'
+        response._content=body
+        response._content_consumed=True # nothing to read or close, as when following a redirect
+        response.url=meta['url']
+        response.request=request
+        response.encoding=requests.utils.get_encoding_from_headers(response.headers)
+        with self.lock:
+            self.hits=self.hits+1
+        return response
+
+    def store(self,request,response):
+        'Saves a successful response or a redirect, body first so a reader never sees half an entry'
+        if response.status_code!=200 and not response.is_redirect:
+            return
+        metapath,bodypath=self.paths(request.method,request.url)
+        os.makedirs(os.path.dirname(metapath),exist_ok=True)
+        headers={k:v for k,v in response.headers.items() if k.lower() not in DROP_HEADERS}
+        meta={'url':response.url,'status':response.status_code,'reason':response.reason,
+              'headers':headers,'recorded':time.time()}
+        for path,data,mode in ((bodypath,response.content,'wb'),(metapath,json.dumps(meta,indent=1),'w')):
+            tmp=path+'.{}.tmp'.format(threading.get_ident())
+            with open(tmp,mode) as writefile:
+                writefile.write(data)
+            os.replace(tmp,path)
+        with self.lock:
+            self.stored=self.stored+1
+
+    def summary(self):
+        return 'HTTP cache ({}): {} responses served from {}, {} saved'.format(
+            self.mode,self.hits,self.folder,self.stored)
+
+def from_environment():
+    'An HttpCache set up from HARVEST_CACHE and friends, or None'
+    mode=os.environ.get('HARVEST_CACHE')
+    if not mode:
+        return None
+    ttl=os.environ.get('HARVEST_CACHE_TTL')
+    return HttpCache(mode,os.environ.get('HARVEST_CACHE_DIR'),float(ttl) if ttl else None)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming JSON writers for paginated API results
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Records are appended to disk one page at a time, so memory holds one page, not a survey
+2. Array output is byte for byte what json.dump(records, f, indent=4) used to write
+3. NDJSON output writes one compact record per line, for tools that read line by line
+4. Data goes to a .part file that is renamed on close(), abort() removes it, so a
+half written survey never looks complete
+5. iter_records reads either format back one record at a time; the array reader decodes
+at a position in a block rather than slicing it, so each block is copied once
+6. Output is written as UTF-8 bytes through a HashingFile, so sha256 and size are known
+when the file closes without reading it back (\n line endings on every platform)
+"""
+
+import json, os, re
+from harvest.manifest import HashingFile
+
+SEPARATORS=re.compile(r'[ \t\n\r,]*') # between array items
+NUMBER=set('0123456789.eE+-') # characters a number cut off by the block could go on with
+
+class JsonArrayWriter:
+    'Writes a JSON array of records incrementally, counting them as it goes'
+    def __init__(self,path,indent=4):
+        self.path=path
+        self.partpath=path+'.part'
+        self.indent=indent
+        self.count=0
+        self.file=HashingFile(self.partpath,'wb')
+
+    def put(self,text):
+        self.file.write(text.encode('utf-8'))
+
+    @property
+    def sha256(self):
+        return self.file.hash.hexdigest()
+
+    @property
+    def size(self):
+        return self.file.size
+
+    def write(self,records):
+        pad=' '*self.indent
+        for rec in records:
+            text=json.dumps(rec,indent=self.indent)
+            self.put('[\n' if self.count==0 else ',\n')
+            self.put(pad+text.replace('\n','\n'+pad))
+            self.count=self.count+1
+
+    def close(self):
+        self.put('[]' if self.count==0 else '\n]')
+        self.file.close()
+        os.replace(self.partpath,self.path)
+        return self.count
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.partpath):
+            os.remove(self.partpath)
+
+class NdjsonWriter(JsonArrayWriter):
+    'Writes one JSON record per line'
+    def write(self,records):
+        for rec in records:
+            self.put(json.dumps(rec)+'\n')
+            self.count=self.count+1
+
+    def close(self):
+        self.file.close()
+        os.replace(self.partpath,self.path)
+        return self.count
+
+def open_writer(path,fmt='array'):
+    'JsonArrayWriter for fmt array, NdjsonWriter for fmt ndjson'
+    if fmt=='ndjson':
+        return NdjsonWriter(path)
+    return JsonArrayWriter(path)
+
+def iter_json_array(path,blocksize=1048576):
+    'Yields the items of a top-level JSON array one at a time without loading the whole file'
+    decoder=json.JSONDecoder()
+    with open(path) as readfile:
+        buf=readfile.read(blocksize).lstrip()
+        while not buf: # leading whitespace filled the block
+            more=readfile.read(blocksize)
+            if not more:
+                break
+            buf=more.lstrip()
+        if not buf.startswith('['):
+            raise ValueError('{} is not a JSON array'.format(path))
+        pos=1
+        eof=False
+        while True:
+            pos=SEPARATORS.match(buf,pos).end()
+            if pos==len(buf) and not eof:
+                more=readfile.read(blocksize)
+                eof=more==''
+                buf=more
+                pos=0
+                continue
+            if buf.startswith(']',pos):
+                return
+            try:
+                item,end=decoder.raw_decode(buf,pos)
+                complete=eof or (end<len(buf) and buf[end] not in NUMBER) # a number at the end may continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete=False
+            if not complete: # item runs past the buffer, keep its start and read on
+                more=readfile.read(blocksize)
+                eof=more==''
+                buf=buf[pos:]+more
+                pos=0
+                continue
+            yield item
+            pos=end
+
+def iter_records(path):
+    'Records from a .ndjson file line by line, or from a .json array with iter_json_array'
+    if path.endswith('.ndjson'):
+        with open(path) as readfile:
+            for line in readfile:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from iter_json_array(path)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the link extractors on saved pages
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Runs every extractor in links.py over each page and checks that the title and the
+list of hrefs match what the original BeautifulSoup code finds
+2. Pages are the saved _WEBPAGE-*.html files in the downloaded-* folders (or the files
+given), scraped with their dataset's spec container where there is one, plus a
+synthetic directory listing shaped like the NCEI climdiv/ page with --listing rows
+3. Each extractor is timed --repeat times per page and the best time is reported, with
+its speedup over 'soup'; lxml is skipped if it is not installed
+4. Exits with status 1 if the default extractor finds different links on any page
+
+Usage, from the datasets folder:
+python -m harvest.linkbench
+python -m harvest.linkbench --listing 20000 --repeat 10
+python -m harvest.linkbench some/page.html --container table
+"""
+
+import os, sys, glob, time, argparse
+from harvest import links
+from harvest.specs import SPECS
+
+DATASETS=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def listing_page(rows):
+    'An Apache style directory index like https://www.ncei.noaa.gov/pub/data/cirs/climdiv/'
+    lines=['<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">',
+           '<html><head><title>Index of /pub/data/cirs/climdiv</title></head><body>',
+           '<h1>Index of /pub/data/cirs/climdiv</h1><table>',
+           '<tr><th><a href="?C=N;O=D">Name</a></th><th><a href="?C=M;O=A">Last modified</a></th>'
+           '<th><a href="?C=S;O=A">Size</a></th></tr>',
+           '<tr><th colspan="3"><hr></th></tr>',
+           '<tr><td><a href="/pub/data/cirs/">Parent Directory</a></td><td>&nbsp;</td><td>-</td></tr>']
+    for i in range(rows):
+        name='climdiv-{}-v1.0.0-{:08d}'.format(('pcpndv','tmpcdv','tmaxdv','tmindv')[i%4],20250000+i)
+        lines.append('<tr><td><a href="{0}">{0}</a></td><td align="right">2025-04-04 06:{1:02d}  </td>'
+                     '<td align="right">{2}K</td></tr>'.format(name,i%60,100+i%900))
+    lines.append('<tr><th colspan="3"><hr></th></tr></table>')
+    lines.append('<address>Apache Server at www.ncei.noaa.gov Port 443</address></body></html>')
+    return '\n'.join(lines).encode('utf-8')
+
+def fixtures(paths,container,rows):
+    'Returns [(name, bytes, container)] for the pages to compare'
+    pages=[]
+    if not paths:
+        paths=sorted(glob.glob(os.path.join(DATASETS,'*','downloaded-*','_WEBPAGE-*.html')))
+    for path in paths:
+        folder=os.path.relpath(path,DATASETS).split(os.sep)[0]
+        spec=SPECS.get(folder)
+        c=container or (spec['container'] if spec else ('body',{}))
+        with open(path,'rb') as readfile:
+            pages.append((os.path.relpath(path,DATASETS),readfile.read(),c))
+    if rows:
+        pages.append(('synthetic climdiv/ listing, {:,} rows'.format(rows),listing_page(rows),('table',{})))
+    return pages
+
+def best_time(extractor,webpage,container,repeat):
+    best=None
+    for n in range(repeat):
+        start=time.perf_counter()
+        try:
+            title,found=links.extract(webpage,container,extractor)
+        except links.ContainerNotFound: # compared like an empty container
+            title,found=None,[]
+        elapsed=time.perf_counter()-start
+        best=elapsed if best is None else min(best,elapsed)
+    return best,(title,[l.get('href') for l in found])
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Compare link extractors on saved pages')
+    parser.add_argument('pages',nargs='*',help='html files (default: every saved _WEBPAGE-*.html)')
+    parser.add_argument('--container',help='tag name to search in, instead of each spec\'s container')
+    parser.add_argument('--listing',type=int,default=5000,help='rows in the synthetic listing, 0 for none')
+    parser.add_argument('--repeat',type=int,default=5)
+    args=parser.parse_args(argv)
+
+    extractors=['soup']+[e for e in links.EXTRACTORS if e!='soup' and (e!='lxml' or links.have_lxml())]
+    if 'lxml' not in extractors:
+        print('lxml is not installed, comparing',' and '.join(extractors))
+    container=(args.container,{}) if args.container else None
+    header='{:<52} {:>7} {:>6}'.format('page','KB','links')
+    for e in extractors:
+        header=header+' {:>9} {:>7}'.format(e+' ms','x soup' if e!='soup' else '')
+    print(header)
+    different=[]
+    for name,webpage,c in fixtures(args.pages,container,args.listing):
+        reference=best_time('soup',webpage,c,args.repeat)
+        label=name if len(name)<=52 else '...'+name[-49:]
+        line='{:<52} {:>7,.0f} {:>6,}'.format(label,len(webpage)/1000,len(reference[1][1]))
+        for e in extractors:
+            elapsed,found=reference if e=='soup' else best_time(e,webpage,c,args.repeat)
+            mark=''
+            if found!=reference[1]:
+                mark='DIFFERS'
+                different.append((name,e))
+            speed='' if e=='soup' else '{:.1f}'.format(reference[0]/elapsed)
+            line=line+' {:>9,.2f} {:>7}'.format(elapsed*1000,mark or speed)
+        print(line)
+    for name,e in different:
+        print('{} finds different links than soup in {}'.format(e,name))
+    return 1 if any(e==links.EXTRACTOR for name,e in different) else 0
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Pluggable link extraction for scraped pages
+Brown University Library, GIS & Data Services
+
+Notes:
+1. extract(webpage, container, extractor) returns the page title and the <a> tags in
+the first tag matching container, a (tag, attrs) pair as used by soup.find; a page
+with no such tag raises ContainerNotFound, as soup.find(...).find_all did, so a
+changed page layout stops the harvest instead of finding nothing; the title is None
+for a page without one
+2. 'soup' is the original code: a full BeautifulSoup html.parser tree, searched after
+the whole page is built
+3. 'stream' (the default) runs the same html.parser tokenizer bs4 uses, keeps only the
+stack of open tag names and applies bs4's rules to it (void elements never open,
+an end tag closes back to the most recent open tag of that name, stray end tags are
+ignored), so it finds the same container and the same anchors; it keeps no tree
+and stops feeding the page as soon as the title is read and the container has closed
+4. 'lxml' uses the C libxml2 parser through lxml.etree.iterparse and also stops after
+the container; it is optional (have_lxml()) and libxml2 repairs broken markup its own
+way, so check it against 'soup' on the pages at hand with linkbench.py first
+5. Anchors come back as Link objects with the same .attrs dict and .get() the
+callers use on bs4 tags (attrs values are plain strings, class is not split)
+6. Bytes are decoded the way bs4 does for these pages: a byte order mark, then a
+charset declared in a <meta> tag near the top, then UTF-8, then Windows-1252
+7. Attribute filters may be strings, True (present) or None (absent); a class filter
+matches one class or the whole class list, as in bs4
+"""
+
+import re, codecs
+from html.parser import HTMLParser
+
+EXTRACTORS=('stream','soup','lxml')
+EXTRACTOR='stream'
+FEED=65536 # characters handed to the tokenizer at a time
+VOID=frozenset(['area','base','basefont','bgsound','br','col','command','embed','frame','hr',
+                'image','img','input','isindex','keygen','link','menuitem','meta','nextid',
+                'param','source','spacer','track','wbr'])
+MULTI_VALUED={'*':('class','accesskey','dropzone'),'a':('rel','rev'),'link':('rel','rev'),
+              'area':('rel',),'td':('headers',),'th':('headers',),'form':('accept-charset',),
+              'object':('archive',),'icon':('sizes',),'iframe':('sandbox',),'output':('for',)}
+META_CHARSET=re.compile(rb'<\s*meta[^>]+charset\s*=\s*["\']?([^>]*?)[ /;\'">]',re.I)
+BOMS=((codecs.BOM_UTF8,'utf-8-sig'),(codecs.BOM_UTF16_LE,'utf-16'),(codecs.BOM_UTF16_BE,'utf-16'),
+      (codecs.BOM_UTF32_LE,'utf-32'),(codecs.BOM_UTF32_BE,'utf-32'))
+
+class Link:
+    'An anchor found in the container, with bs4\'s .attrs and .get()'
+    __slots__=('attrs',)
+    def __init__(self,attrs):
+        self.attrs=attrs
+
+    def get(self,key,default=None):
+        return self.attrs.get(key,default)
+
+    def __repr__(self):
+        return 'Link({!r})'.format(self.attrs)
+
+def have_lxml():
+    try:
+        import lxml.etree
+        return True
+    except ImportError:
+        return False
+
+def decode(webpage):
+    'Page bytes to text: byte order mark, declared charset, UTF-8, then Windows-1252'
+    if isinstance(webpage,str):
+        return webpage
+    for bom,encoding in BOMS:
+        if webpage.startswith(bom):
+            return webpage.decode(encoding,'replace')
+    candidates=[]
+    declared=META_CHARSET.search(webpage[:max(2048,len(webpage)//20)])
+    if declared:
+        candidates.append(declared.group(1).decode('ascii','ignore').strip().lower())
+    candidates.append('utf-8')
+    for encoding in candidates:
+        try:
+            return webpage.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return webpage.decode('windows-1252','replace')
+
+def attr_matches(tag,name,value,wanted):
+    'One attribute filter against one attribute value, None if the tag lacks it'
+    if wanted is None:
+        return value is None
+    if value is None:
+        return False
+    if wanted is True:
+        return True
+    if name in MULTI_VALUED['*'] or name in MULTI_VALUED.get(tag,()):
+        parts=value.split()
+        return wanted in parts or ' '.join(parts)==wanted
+    return value==wanted
+
+def matches(tag,attrs,container):
+    'True if a start tag is the container bs4 would find'
+    name,wanted=container
+    if tag!=name:
+        return False
+    return all(attr_matches(tag,k,attrs.get(k),v) for k,v in wanted.items())
+
+def check_container(container):
+    for k,v in container[1].items():
+        if not (v is None or v is True or isinstance(v,str)):
+            raise ValueError('stream and lxml extractors take string, True or None filters, not {!r} for {}'.format(v,k))
+
+class ContainerNotFound(ValueError):
+    'Raised when no tag on the page matches the container, e.g. after a layout change'
+
+class _Done(Exception):
+    'Stops the tokenizer once everything wanted has been seen'
+
+class StreamExtractor(HTMLParser):
+    'Tokenizes a page, tracking open tags like bs4, until the container closes'
+    def __init__(self,container):
+        super().__init__(convert_charrefs=True)
+        self.container=container
+        self.stack=[] # open tag names, void elements never go on it
+        self.depth=None # stack position of the container while it is open
+        self.found=False
+        self.closed=False
+        self.links=[]
+        self.title=None
+        self.title_depth=None
+        self.title_text=[]
+
+    def start(self,tag,attrs,void):
+        attrs={k:('' if v is None else v) for k,v in attrs}
+        if not self.found and matches(tag,attrs,self.container):
+            self.found=True
+            self.depth=len(self.stack)
+            if void:
+                self.close_container()
+        elif self.depth is not None and tag=='a':
+            self.links.append(Link(attrs))
+        if self.title is None and self.title_depth is None and tag=='title':
+            self.title_depth=len(self.stack)
+            if void:
+                self.close_title()
+        if not void:
+            self.stack.append(tag)
+
+    def handle_starttag(self,tag,attrs):
+        self.start(tag,attrs,tag in VOID)
+
+    def handle_startendtag(self,tag,attrs):
+        self.start(tag,attrs,True) # <tag/> opens and closes at once, whatever the tag
+
+    def handle_endtag(self,tag):
+        if tag in VOID or tag not in self.stack:
+            return
+        i=len(self.stack)-1-self.stack[::-1].index(tag)
+        del self.stack[i:]
+        if self.title_depth is not None and self.title_depth>=i:
+            self.close_title()
+        if self.depth is not None and self.depth>=i:
+            self.close_container()
+
+    def handle_data(self,data):
+        if self.title_depth is not None:
+            self.title_text.append(data)
+
+    def close_title(self):
+        self.title=''.join(self.title_text)
+        self.title_depth=None
+        if self.closed:
+            raise _Done()
+
+    def close_container(self):
+        self.depth=None
+        self.closed=True
+        if self.title is not None:
+            raise _Done()
+
+    def run(self,text):
+        try:
+            for i in range(0,len(text),FEED):
+                self.feed(text[i:i+FEED])
+            self.close()
+        except _Done:
+            pass
+        if self.title is None and self.title_depth is not None: # page ended inside <title>
+            self.title=''.join(self.title_text)
+        return self.title,(self.links if self.found else None)
+
+def extract_stream(webpage,container):
+    check_container(container)
+    return StreamExtractor(container).run(decode(webpage))
+
+def extract_soup(webpage,container):
+    from bs4 import BeautifulSoup as soup
+    soup_page=soup(webpage,'html.parser')
+    title=soup_page.title.text if soup_page.title is not None else None
+    found=soup_page.find(container[0],container[1])
+    return title,(found.find_all('a') if found is not None else None)
+
+def extract_lxml(webpage,container):
+    import io
+    from lxml import etree
+    check_container(container)
+    if isinstance(webpage,str):
+        webpage=webpage.encode('utf-8')
+    title=None
+    found=None
+    links=[]
+    for event,element in etree.iterparse(io.BytesIO(webpage),events=('start','end'),html=True,
+                                         recover=True,encoding=None):
+        tag=element.tag if isinstance(element.tag,str) else None
+        if event=='start':
+            if found is None and tag is not None and matches(tag,dict(element.attrib),container):
+                found=element
+        elif tag=='title' and title is None:
+            title=''.join(element.itertext())
+        elif element is found:
+            links=[Link(dict(a.attrib)) for a in element.iter('a') if a is not element]
+            if title is not None:
+                break
+    return title,(links if found is not None else None)
+
+def extract(webpage,container=('body',{}),extractor=None):
+    'Returns (page title, anchors in the first tag matching container)'
+    extractor=extractor or EXTRACTOR
+    if extractor=='stream':
+        title,links=extract_stream(webpage,container)
+    elif extractor=='soup':
+        title,links=extract_soup(webpage,container)
+    elif extractor=='lxml':
+        title,links=extract_lxml(webpage,container)
+    else:
+        raise ValueError('no extractor {}, choose from {}'.format(extractor,', '.join(EXTRACTORS)))
+    if links is None:
+        raise ContainerNotFound('no {} {} on the page'.format(container[0],container[1] or ''))
+    return title,links
+
+def configure(extractor):
+    'Sets the default extractor for the run'
+    global EXTRACTOR
+    if extractor not in EXTRACTORS:
+        raise ValueError('no extractor {}, choose from {}'.format(extractor,', '.join(EXTRACTORS)))
+    EXTRACTOR=extractor
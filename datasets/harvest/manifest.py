@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Checksum manifests written while files download
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Bytes are hashed as they are written, so no file is read back to checksum it
+2. Each snapshot gets manifest-sha256.txt in BagIt form (sha256, two spaces, path) and
+_MANIFEST.tsv with path, size, sha256, source url, ETag and Last-Modified
+3. Paths are relative to the snapshot folder, with forward slashes
+4. Files carried forward from the previous snapshot reuse its recorded hash when the
+size matches; only a resumed .part prefix or an unknown carried file is read to hash it
+5. _METADATA, _ERRORS, _VALIDATORS, _ARCHIVES, _PLAN, _DISCOVERY and the manifests
+themselves are not listed
+"""
+
+import os, csv, hashlib, threading
+
+BAGIT='manifest-sha256.txt'
+TSV='_MANIFEST.tsv'
+FIELDS=['path','size','sha256','url','etag','last_modified']
+TAGFILES=('_METADATA-','_ERRORS-','_TIMINGS-','_VALIDATORS','_ARCHIVES','_PLAN','_DISCOVERY','_MANIFEST','_RECORD_COUNT','manifest-')
+
+def is_payload(fname):
+    'False for the metadata/manifest files a snapshot describes itself with, and .part files'
+    return not fname.startswith(TAGFILES) and not fname.endswith(('.part','.part.json'))
+
+def hash_file(path,blocksize=8388608):
+    'sha256 of a file already on disk'
+    h=hashlib.sha256()
+    with open(path,'rb') as readfile:
+        while True:
+            block=readfile.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    return h
+
+def load_tsv(snapshot):
+    'Reads _MANIFEST.tsv from a snapshot folder into {path: row}'
+    if snapshot is None:
+        return {}
+    tpath=os.path.join(snapshot,TSV)
+    if not os.path.exists(tpath):
+        return {}
+    with open(tpath,newline='') as readfile:
+        reader=csv.DictReader(readfile,delimiter='\t',quoting=csv.QUOTE_NONE)
+        return {row['path']:row for row in reader}
+
+class HashingFile:
+    'Binary file wrapper that hashes and counts every byte written'
+    def __init__(self,path,mode='wb',h=None):
+        self.file=open(path,mode)
+        self.hash=h if h is not None else hashlib.sha256()
+        self.size=0
+
+    def write(self,data):
+        self.hash.update(data)
+        self.size=self.size+len(data)
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+class Manifest:
+    'Collects path, size, sha256 and source for every file in one snapshot'
+    def __init__(self,snapshot,previous=None):
+        self.root=os.path.abspath(snapshot)
+        self.entries=load_tsv(self.root) # keep entries from an earlier run today
+        self.previous=load_tsv(previous)
+        self.lock=threading.Lock()
+
+    def relpath(self,filepath):
+        return os.path.relpath(os.path.abspath(filepath),self.root).replace(os.sep,'/')
+
+    def add(self,filepath,size,sha256,url=None,etag=None,last_modified=None):
+        row={'path':self.relpath(filepath),'size':str(size),'sha256':sha256,
+             'url':url or '','etag':etag or '','last_modified':last_modified or ''}
+        with self.lock:
+            self.entries[row['path']]=row
+
+    def discard(self,filepath):
+        'Removes a file that failed a later check'
+        with self.lock:
+            self.entries.pop(self.relpath(filepath),None)
+
+    def add_bytes(self,filepath,data,url=None):
+        'For small files written from memory, such as the _WEBPAGE copy'
+        self.add(filepath,len(data),hashlib.sha256(data).hexdigest(),url)
+
+    def carry(self,filepath,url=None,etag=None,last_modified=None):
+        'Records a file linked from the previous snapshot, reusing its hash if possible'
+        rel=self.relpath(filepath)
+        size=os.path.getsize(filepath)
+        old=self.previous.get(rel)
+        if old is not None and old['size']==str(size):
+            sha256=old['sha256']
+        else:
+            sha256=hash_file(filepath).hexdigest()
+        self.add(filepath,size,sha256,url,etag,last_modified)
+
+    def save(self):
+        'Writes manifest-sha256.txt and _MANIFEST.tsv for the snapshot'
+        with self.lock:
+            rows=[self.entries[k] for k in sorted(self.entries)]
+            # new files renamed over the old, never rewritten in place: the store may have linked them
+            tmp=os.path.join(self.root,BAGIT+'.tmp')
+            with open(tmp,'w',newline='\n') as writefile:
+                for row in rows:
+                    writefile.write('{}  {}\n'.format(row['sha256'],row['path']))
+            os.replace(tmp,os.path.join(self.root,BAGIT))
+            tmp=os.path.join(self.root,TSV+'.tmp')
+            with open(tmp,'w',newline='') as writefile:
+                writer=csv.DictWriter(writefile,fieldnames=FIELDS,delimiter='\t',lineterminator='\n',
+                                      quoting=csv.QUOTE_NONE,quotechar=None) # ETags keep their quotes
+                writer.writeheader()
+                writer.writerows(rows)
+            os.replace(tmp,os.path.join(self.root,TSV))
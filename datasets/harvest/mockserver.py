@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the NOAA, IMLS, IRS and DHS servers, for benchmarks and offline runs
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Every site is served from one local server under /<original host>/<path>, and
+session.redirect() points the real urls at it, so the scripts run unchanged
+2. Synthetic content, chosen by the shape of the path:
+- URLlist_*.txt: files_per_list absolute urls to zips beside the list
+- /rest/dhs/surveys: surveys survey ids
+- /rest/dhs/v8/data: records_per_survey records paginated per_page at a time, with
+TotalPages and RecordCount like the real API
+- paths ending in a file extension: file_size bytes; zips are valid stored archives
+so the archive checks pass
+- anything else: an html page with links in the style each site uses (IMLS site
+relative /sites/ links and /publications/ sub-pages, a relative directory listing for
+NCEI, relative zips on the wetlands page, absolute links elsewhere)
+3. Network behavior: latency seconds before each response, bandwidth bytes per second
+per response, error_rate chance of a 500, rate_limit requests per second per host
+above which the server answers 429 with Retry-After, and stall_rate chance that a file
+sends half its bytes and then trickles (100 bytes/s) until the client gives up
+4. HEAD gets the same headers without the body; a Range request with a matching
+If-Range gets a 206 with the rest of the file
+5. Each synthetic file is built once and kept in memory, so very large file_size
+values cost that much memory in the server process
+6. .aspx paths are an ASP.NET WebForms page like NCHE's StateProfile.aspx: a form with
+__VIEWSTATE and __EVENTVALIDATION, the report year drop down (report_years years, the
+most recent of which has no report yet) and the download button; a POST back with the
+state fields intact, the session cookie and a year gets a file_size attachment, a bad
+viewstate or a year not in the list gets the 500 ASP.NET gives, anything else gets
+the page again
+"""
+
+import io, json, time, base64, random, hashlib, zipfile, threading, http.server
+from urllib.parse import urlsplit, parse_qs
+from harvest.ratelimit import TokenBucket
+
+FILE_TYPES=('.zip','.pdf','.csv','.xlsx','.dat','.txt','.tif','.json')
+CHUNK=65536
+TRICKLE=100 # bytes per second once a stalled response stops
+DROPDOWN='ctl00$MainContent$ddlConsolidatedSPR'
+BUTTON='ctl00$MainContent$btndownload'
+LATEST=2024 # first year of the most recent school year in the drop down
+
+class MockSite:
+    'Settings and generated content for one stand-in server'
+    def __init__(self,file_size=1000000,files_per_list=2,links_per_page=4,surveys=4,
+                 records_per_survey=2500,per_page=1000,latency=0.0,bandwidth=0,
+                 error_rate=0.0,rate_limit=0,stall_rate=0.0,report_years=4,seed=0):
+        self.file_size=file_size
+        self.files_per_list=files_per_list
+        self.links_per_page=links_per_page
+        self.surveys=surveys
+        self.records_per_survey=records_per_survey
+        self.per_page=per_page
+        self.latency=latency
+        self.bandwidth=bandwidth
+        self.error_rate=error_rate
+        self.rate_limit=rate_limit
+        self.stall_rate=stall_rate
+        self.report_years=report_years
+        self.random=random.Random(seed)
+        self.buckets={}
+        self.bodies={}
+        self.lock=threading.Lock()
+        self.requests=0
+        self.limited=0
+        self.failed=0
+        self.stalled=0
+        self.postbacks=0
+
+    def file_body(self,ext):
+        'file_size bytes for a file type, a valid stored zip for .zip'
+        with self.lock:
+            if ext not in self.bodies:
+                block=bytes(range(256))*(self.file_size//256+1)
+                if ext=='.zip':
+                    buf=io.BytesIO()
+                    with zipfile.ZipFile(buf,'w',zipfile.ZIP_STORED) as archive:
+                        archive.writestr('data.bin',block[:max(0,self.file_size-200)])
+                    self.bodies[ext]=buf.getvalue()
+                else:
+                    self.bodies[ext]=block[:self.file_size]
+            return self.bodies[ext]
+
+    def limited_host(self,host):
+        'True if host is over its request rate'
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            bucket=self.buckets.setdefault(host,TokenBucket(self.rate_limit))
+        return bucket.take()>0
+
+    def url_list(self,host,path):
+        folder=path.rsplit('/',1)[0]
+        name=path.rsplit('/',1)[1][len('URLlist_'):-len('.txt')]
+        lines=['https://{}{}/{}_{}.zip'.format(host,folder,name,i) for i in range(self.files_per_list)]
+        return ('\n'.join(lines)+'\n').encode(),'text/plain'
+
+    def surveys_json(self):
+        data=[{'SurveyId':'MK{:04d}DHS'.format(i)} for i in range(self.surveys)]
+        return json.dumps({'Data':data,'RecordsReturned':len(data),'TotalPages':1,'Page':1}).encode(),'application/json'
+
+    def data_json(self,query):
+        survey=query.get('surveyIds',[''])[0]
+        page=int(query.get('page',['1'])[0])
+        total=self.records_per_survey
+        pages=max(1,-(-total//self.per_page))
+        start=(page-1)*self.per_page
+        records=[{'SurveyId':survey,'Indicator':'Mock indicator {}'.format(i),'IndicatorId':'MK_{:06d}'.format(i),
+                  'CharacteristicLabel':query.get('breakdown',[''])[0],'Value':round(i*0.37,2),'ByVariableId':0}
+                 for i in range(start,min(total,start+self.per_page))]
+        body={'RecordsReturned':len(records),'TotalPages':pages,'Page':page,'RecordCount':total,'Data':records}
+        return json.dumps(body).encode(),'application/json'
+
+    def page(self,host,path):
+        'An html page whose links look like the ones on the real site'
+        folder=path.rsplit('/',1)[0]
+        stem=path.rstrip('/').rsplit('/',1)[-1].split('.')[0] or 'file'
+        links=[]
+        exts=('.pdf','.zip','.csv','.xlsx')
+        for i in range(self.links_per_page):
+            ext=exts[i%len(exts)]
+            fname='{}_{}{}'.format(stem,i,ext)
+            if host=='www.imls.gov':
+                links.append('/sites/default/files{}/{}'.format(folder,fname))
+            elif host=='www.ncei.noaa.gov':
+                links.append('climdiv-{}.dat'.format(i))
+            elif host=='coastalimagery.blob.core.windows.net':
+                links.append('wetlands_{}.zip'.format(i))
+            else:
+                links.append('https://{}{}/{}'.format(host,folder,fname))
+        if host=='www.imls.gov' and not path.startswith('/publications/'):
+            links.extend('/publications/mock-publication-{}'.format(i) for i in range(2))
+        if host=='www.ncei.noaa.gov':
+            links=['?C=N;O=D','/pub/data/cirs/']+links
+        anchors=''.join('<tr><td><a href="{0}">{0}</a></td></tr>'.format(l) for l in links)
+        html=('<html><head><title>Mock {}{}</title></head><body>'
+              '<div class="pup-header-content-rt no-gutter col-sm-12 col-md-9">'
+              '<table>{}</table></div></body></html>').format(host,path,anchors)
+        return html.encode(),'text/html; charset=utf-8'
+
+    def years(self):
+        'School years in the drop down, oldest first'
+        return ['{}-{}'.format(y,y+1) for y in range(LATEST-self.report_years,LATEST+1)]
+
+    def viewstate(self,page):
+        'A __VIEWSTATE for one page, about as long as a real one'
+        return base64.b64encode(hashlib.sha256(('viewstate'+page).encode()).digest()*256).decode()
+
+    def validation(self,page):
+        return base64.b64encode(hashlib.sha256(('validation'+page+'|'.join(self.years())).encode()).digest()).decode()
+
+    def form_page(self,page):
+        'A WebForms page with the NCHE report drop down, page is its path and query'
+        options=''.join('<option value="{0}">{0}</option>'.format(y) for y in self.years())
+        html=('<html><head><title>National Center for Homeless Education (NCHE)</title></head><body>'
+              '<form method="post" action=".{0}" id="form1"><div class="aspNetHidden">'
+              '<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />'
+              '<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />'
+              '<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{1}" /></div>'
+              '<div class="aspNetHidden">'
+              '<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="A1B2C3D4" />'
+              '<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{2}" /></div>'
+              '<div class="col-1-1"><h1>Mock {0}</h1></div>'
+              '<select name="{3}" id="MainContent_ddlConsolidatedSPR">'
+              '<option selected="selected" value="0">Select a school year</option>{4}</select>'
+              '<input type="submit" name="{5}" value="Download" id="MainContent_btndownload" />'
+              '<a id="MainContent_btnConvertToPDF1" href="javascript:__doPostBack(&#39;'
+              'ctl00$MainContent$btnConvertToPDF1&#39;,&#39;&#39;)">Print</a>'
+              '</form></body></html>').format(page,self.viewstate(page),self.validation(page),
+                                               DROPDOWN,options,BUTTON)
+        return html.encode(),'text/html; charset=utf-8'
+
+    def form(self,host,path,query,fields,cookie):
+        'Returns (status, body, content type, headers) for a WebForms page or a postback to it'
+        headers=[]
+        if 'ASP.NET_SessionId=' not in cookie:
+            with self.lock:
+                token='{:024x}'.format(self.random.getrandbits(96))
+            headers.append(('Set-Cookie','ASP.NET_SessionId={}; path=/; HttpOnly'.format(token)))
+        page=path+'?'+'&'.join('{}={}'.format(k,v[0]) for k,v in sorted(query.items()))
+        content,ctype=self.form_page(page)
+        if fields is None:
+            return 200,content,ctype,headers
+        with self.lock:
+            self.postbacks=self.postbacks+1
+        state=(fields.get('__VIEWSTATE',[''])[0],fields.get('__EVENTVALIDATION',[''])[0])
+        if state!=(self.viewstate(page),self.validation(page)):
+            return 500,b'Validation of viewstate MAC failed.','text/html; charset=utf-8',headers
+        year=fields.get(DROPDOWN,['0'])[0]
+        years=self.years()
+        if year!='0' and year not in years:
+            return 500,b'Invalid postback or callback argument.','text/html; charset=utf-8',headers
+        if headers or BUTTON not in fields or year not in years[:-1]:
+            return 200,content,ctype,headers # no session, no button pressed, or no report
+        name='{}_{}_Consolidated_SPR.xlsx'.format(query.get('StateID',['0'])[0],year)
+        return 200,self.file_body('.xlsx'),'application/octet-stream',[
+            ('Content-Disposition','attachment; filename="{}"'.format(name))]
+
+    def respond(self,host,path,query):
+        'Returns (status, body, content type) for one request'
+        if path.startswith('/rest/dhs/surveys'):
+            return (200,)+self.surveys_json()
+        if path.startswith('/rest/dhs/v8/data'):
+            return (200,)+self.data_json(query)
+        name=path.rsplit('/',1)[-1]
+        if name.startswith('URLlist_') and name.endswith('.txt'):
+            return (200,)+self.url_list(host,path)
+        for ext in FILE_TYPES:
+            if name.endswith(ext):
+                return 200,self.file_body(ext),'application/octet-stream'
+        return (200,)+self.page(host,path)
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version='HTTP/1.1'
+    site=None
+
+    def do_HEAD(self):
+        self.serve(body=False)
+
+    def do_GET(self):
+        self.serve(body=True)
+
+    def do_POST(self):
+        self.serve(body=True)
+
+    def serve(self,body):
+        site=self.site
+        parts=urlsplit(self.path)
+        host,_,path=parts.path.lstrip('/').partition('/')
+        path='/'+path
+        fields=None
+        if self.command=='POST':
+            posted=self.rfile.read(int(self.headers.get('Content-Length',0)))
+            fields=parse_qs(posted.decode('utf-8'),keep_blank_values=True)
+        with site.lock:
+            site.requests=site.requests+1
+        if site.latency:
+            time.sleep(site.latency)
+        if site.limited_host(host):
+            with site.lock:
+                site.limited=site.limited+1
+            return self.send_body(429,b'Too Many Requests','text/plain',body,[('Retry-After','1')])
+        if site.error_rate and site.random.random()<site.error_rate:
+            with site.lock:
+                site.failed=site.failed+1
+            return self.send_body(500,b'Mock server error','text/plain',body)
+        if path.endswith('.aspx'):
+            status,content,ctype,extra=site.form(host,path,parse_qs(parts.query),fields,
+                                                  self.headers.get('Cookie',''))
+        elif fields is not None:
+            status,content,ctype,extra=405,b'Method Not Allowed','text/plain',[]
+        else:
+            status,content,ctype=site.respond(host,path,parse_qs(parts.query))
+            extra=[]
+        etag='"mock-{}"'.format(len(content))
+        extra.append(('ETag',etag))
+        ranged=self.headers.get('Range','')
+        if status==200 and ranged.startswith('bytes=') and self.headers.get('If-Range')==etag:
+            start=int(ranged[len('bytes='):].split('-')[0])
+            extra.append(('Content-Range','bytes {}-{}/{}'.format(start,len(content)-1,len(content))))
+            status,content=206,content[start:]
+        stall=None
+        if body and ctype=='application/octet-stream' and site.stall_rate and site.random.random()<site.stall_rate:
+            with site.lock:
+                site.stalled=site.stalled+1
+            stall=len(content)//2
+        self.send_body(status,content,ctype,body,extra,stall)
+
+    def send_body(self,status,content,ctype,body,extra=(),stall=None):
+        self.send_response(status)
+        self.send_header('Content-Type',ctype)
+        self.send_header('Content-Length',str(len(content)))
+        for k,v in extra:
+            self.send_header(k,v)
+        self.end_headers()
+        if not body:
+            return
+        view=memoryview(content)
+        try:
+            for start in range(0,len(view),CHUNK):
+                if stall is not None and start>=stall:
+                    for i in range(start,len(view),TRICKLE):
+                        self.wfile.write(view[i:i+TRICKLE])
+                        self.wfile.flush()
+                        time.sleep(1)
+                    return
+                began=time.monotonic()
+                self.wfile.write(view[start:start+CHUNK])
+                if self.site.bandwidth:
+                    pause=CHUNK/self.site.bandwidth-(time.monotonic()-began)
+                    if pause>0:
+                        time.sleep(pause)
+        except (BrokenPipeError,ConnectionResetError,ConnectionAbortedError):
+            pass
+
+    def log_message(self,*args):
+        pass
+
+def start(site=None,port=0):
+    'Runs a stand-in server in a background thread, returns (server, base url)'
+    site=site or MockSite()
+    handler=type('Handler',(MockHandler,),{'site':site})
+    server=http.server.ThreadingHTTPServer(('127.0.0.1',port),handler)
+    server.daemon_threads=True
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server,'http://127.0.0.1:{}'.format(server.server_address[1])
+
+def redirect_hosts(base,hosts):
+    'Points http and https urls for each host at the stand-in server'
+    from harvest import session
+    for host in hosts:
+        for scheme in ('http','https'):
+            session.redirect('{}://{}/'.format(scheme,host),'{}/{}/'.format(base,host))
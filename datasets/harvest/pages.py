@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Page scraping and metadata helpers shared by the downloader scripts
+Brown University Library, GIS & Data Services
+
+Notes:
+1. These were copied word for word between the NOAA scripts, now they live here
+2. Container is a (tag, attrs) pair passed to soup.find, e.g. ('table', {})
+3. Errors are written to the folder the metadata goes in, so each NOAA subfolder
+keeps its own _ERRORS file instead of overwriting one at the top level
+4. Links are pulled out by links.py, by default with a streaming tokenizer that
+stops after the container instead of building a whole BeautifulSoup tree; a page with
+no <title> is named by its url, and a page without the container raises
+"""
+
+import os
+from datetime import date
+from harvest import links as linkparse, session
+
+PERSON='Frank Donnelly, Head of GIS & Data Services, Brown University Library'
+
+def stamp(today=None):
+    return today if today is not None else str(date.today())
+
+def page_scrape(url,container=('body',{}),extractor=None):
+    'Initial page scrape, to save the page and the links in one container'
+    webpage=session.get(url).content
+    page_title,links=linkparse.extract(webpage,container,extractor)
+    if page_title is None: # no <title>, the url names the page in messages and metadata
+        page_title=url
+    return webpage,page_title,links
+
+def save_page(url,path,webpage,today=None,manifest=None):
+    'Saves the page as plain html'
+    webfile = '_WEBPAGE-{}.html'.format(stamp(today))
+    tmp=os.path.join(path,webfile+'.tmp')
+    with open(tmp,'wb') as writefile:
+        writefile.write(webpage)
+    os.replace(tmp,os.path.join(path,webfile))
+    if manifest is not None:
+        manifest.add_bytes(os.path.join(path,webfile),webpage,url)
+        manifest.save()
+
+def write_errors(page_title,errors,outpath,today=None):
+    'Writes the error list for a folder, removing a stale one if there are none'
+    efile = "_ERRORS-{}.txt".format(stamp(today))
+    epath=os.path.join(outpath,efile)
+    if os.path.exists(epath):
+        os.remove(epath)
+    if len(errors)>0:
+        with open(epath,'w') as writefile:
+            writefile.write('Download Errors for {}\n'.format(page_title))
+            for ek,ev in errors.items():
+                writefile.write('{}: {}\n'.format(ek,ev))
+
+def write_metadata(dataset,person,page_title,url,counter,errors,outpath,today=None,archives=None):
+    'Writes metadata files and error lists, archives is an optional ZIP check summary line'
+    metafile = "_METADATA-{}.txt".format(stamp(today))
+    tmp=os.path.join(outpath,metafile+'.tmp')
+    with open(tmp,'w') as writefile:
+        writefile.write(dataset+'\n')
+        writefile.write('{} files archived on {}\n'.format(counter,stamp(today)))
+        writefile.write('From webpage {}\n'.format(page_title))
+        writefile.write('At {}\n'.format(url))
+        writefile.write('By {}'.format(person))
+        if archives is not None:
+            writefile.write('\n'+archives)
+    os.replace(tmp,os.path.join(outpath,metafile))
+    write_errors(page_title,errors,outpath,today)
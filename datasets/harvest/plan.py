@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-flight size planning for multi-list harvests
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Takes the products a script has discovered, as (page url, subfolder, title, urls),
+and sends a HEAD for every file through a bounded pool, same limits as the downloads
+2. Prints files and bytes per product and in total, how many sizes are unknown, and
+how much is likely unchanged since the previous snapshot (same name and size),
+which incremental mode links instead of downloading
+3. Compares the bytes still to come with the free space on the output volume
+4. The sizes are returned for download_all, which then starts the largest files
+first so a big DEM doesn't end up alone at the tail of a run
+5. The plan is saved as _PLAN.json in the snapshot
+"""
+
+import requests, os, json, shutil
+from concurrent.futures import ThreadPoolExecutor
+from harvest import session
+from harvest.pool import HostLimiter, largest_first, WORKERS, PER_HOST
+
+PLAN='_PLAN.json'
+
+def head_size(url):
+    'Content-Length from a HEAD request, or None if the server does not say'
+    try:
+        response=session.head(url, allow_redirects=True, headers={'Accept-Encoding':'identity'})
+        response.raise_for_status()
+    except requests.exceptions.RequestException:
+        return None
+    clen=response.headers.get('Content-Length')
+    return int(clen) if clen is not None else None
+
+def head_sizes(urls,workers=WORKERS,per_host=PER_HOST,limiter=None):
+    'HEADs every url concurrently, returns {url: size or None}'
+    if limiter is None:
+        limiter=HostLimiter(per_host)
+    def worker(url):
+        with limiter.get(url):
+            return head_size(url)
+    unique=list(dict.fromkeys(urls))
+    with ThreadPoolExecutor(max_workers=max(1,workers)) as executor:
+        return dict(zip(unique,executor.map(worker,unique)))
+
+def fmt(nbytes):
+    return '{:,.1f} GB'.format(nbytes/1000000000)
+
+def plan(products,outfolder,workers=WORKERS,per_host=PER_HOST,testcount=None,incremental=None):
+    'HEADs every file in every product, prints the plan, returns (sizes, fits on disk)'
+    if testcount is not None:
+        products=[(k,subpath,title,urls[:testcount]) for k,subpath,title,urls in products]
+    sizes=head_sizes([u for p in products for u in p[3]],workers,per_host)
+    total=0
+    unchanged=0
+    saved={}
+    print('{:<45} {:>7} {:>9} {:>12} {:>12}'.format('product','files','unknown','size','unchanged'))
+    for k,subpath,title,urls in products:
+        known=[sizes[u] for u in urls if sizes[u] is not None]
+        same=0
+        if incremental is not None:
+            for u in urls:
+                prevpath,old=incremental.prior(os.path.join(subpath,os.path.split(u)[1]))
+                if prevpath is not None and sizes[u]==os.path.getsize(prevpath):
+                    same=same+sizes[u]
+        total=total+sum(known)
+        unchanged=unchanged+same
+        print('{:<45} {:>7,} {:>9,} {:>12} {:>12}'.format(title[:45],len(urls),len(urls)-len(known),
+                                                        fmt(sum(known)),fmt(same)))
+        saved[os.path.relpath(subpath,outfolder)]={'page':k,'title':title,'bytes':sum(known),'unchanged':same,
+            'schedule':[[u,sizes[u]] for u in largest_first(urls,sizes)]}
+    needed=total-unchanged
+    free=shutil.disk_usage(outfolder).free
+    fits=needed<free
+    print('Total {:,} files, {} ({} likely unchanged), {} to transfer, {} free on {}'.format(
+        len(sizes),fmt(total),fmt(unchanged),fmt(needed),fmt(free),os.path.abspath(outfolder)))
+    if not fits:
+        print('NOT ENOUGH SPACE: need {} more'.format(fmt(needed-free)))
+    tmp=os.path.join(outfolder,PLAN+'.tmp')
+    with open(tmp,'w') as writefile:
+        json.dump({'total':total,'unchanged':unchanged,'free':free,'products':saved},writefile,indent=1)
+    os.replace(tmp,os.path.join(outfolder,PLAN))
+    return sizes,fits
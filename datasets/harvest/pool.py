@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded-parallel download pool
+Brown University Library, GIS & Data Services
+
+Notes:
+1. A pool of worker threads fetches a list of urls into one folder
+2. Workers sets the global concurrency, per_host caps connections to any one server
+3. Returns the same (count, errors) pair as the serial download_data functions,
+with errors listed in the same order as the input urls
+4. Aggregate files, bytes, and throughput are printed when the pool finishes
+5. Setting workers=1 gives the old one-at-a-time behavior
+6. Testcount stops after that many files, replaces the old TESTCOUNT debug lines
+7. Each file goes through fetch.fetch_file, so interrupted files resume on the next run
+and transient failures are retried with backoff before a url counts as an error; an
+error writing a file (a full disk, a denied write) counts as that url's error too, so
+the files already in still get their manifest, validator and archive records
+8. Passing an Incremental tracker skips files unchanged since the previous snapshot
+9. Passing a Manifest records size and sha256 for each file as it streams in
+10. Several harvests can share one executor and HostLimiter (see engine.py), so the
+worker and per-host limits hold across datasets running at the same time
+11. Passing an ArchiveChecker checks each ZIP in the background as it lands; archives
+that fail are fetched once more after the list is done (see archives.py)
+12. Passing sizes (url to bytes, from plan.py) starts the largest files first;
+errors are still listed in input order
+13. Pipeline is the streaming form: urls are put on a bounded queue while they are
+still being discovered and workers start on them right away; put blocks when the
+queue is full, and join returns (count, errors) for each folder
+14. Files are named by the last part of the url, so when two urls for one folder share
+a file name only the first is fetched; fetching both at once would write the same .part
+"""
+
+import requests, os, queue, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from harvest.fetch import fetch_file
+from harvest.archives import CorruptArchive
+
+WORKERS=8
+PER_HOST=4
+
+class HostLimiter:
+    'Hands out one semaphore per host so no server gets more than per_host connections'
+    def __init__(self,per_host):
+        self.per_host=per_host
+        self.sems={}
+        self.lock=threading.Lock()
+
+    def get(self,url):
+        host=urlsplit(url).netloc
+        with self.lock:
+            if host not in self.sems:
+                self.sems[host]=threading.BoundedSemaphore(self.per_host)
+            return self.sems[host]
+
+def format_rate(nbytes,seconds):
+    'Human readable size and throughput for the end of run summary'
+    mb=nbytes/1000000
+    rate=mb/seconds if seconds>0 else 0.0
+    return '{:,.1f} MB in {:,.1f} s ({:,.2f} MB/s)'.format(mb,seconds,rate)
+
+def filename(url):
+    'The name a url is saved under'
+    return os.path.split(url)[1]
+
+def unique_files(urls):
+    'urls in order, leaving out any whose file name an earlier url already has, see note 14'
+    names=set()
+    kept=[]
+    for d in urls:
+        if filename(d) not in names:
+            names.add(filename(d))
+            kept.append(d)
+    return kept
+
+def largest_first(urls,sizes):
+    'Orders urls by size, biggest first, unknown sizes last'
+    return sorted(urls,key=lambda u: sizes.get(u) or -1,reverse=True)
+
+printlock=threading.Lock()
+
+def fetch_one(d,outpath,fetch,limiter,incremental,manifest,archives):
+    'Downloads one url, returns (bytes, error, archive check future or None)'
+    with limiter.get(d):
+        try:
+            nbytes=fetch(d,outpath,incremental=incremental,manifest=manifest)
+            with printlock:
+                print('Downloaded',os.path.split(d)[1])
+        except requests.exceptions.RequestException as e:
+            with printlock:
+                print('Could not retrieve',d,'because of',e)
+            return 0,e,None
+        except OSError as e: # a full disk or a denied write, the rest of the list still runs
+            with printlock:
+                print('Could not save',d,'because of',e)
+            return 0,e,None
+    check=None
+    if archives is not None:
+        check=archives.submit(os.path.join(outpath,os.path.split(d)[1]),d)
+    return nbytes,None,check
+
+def refetch(d,outpath,fetch,limiter,incremental,manifest,archives,error):
+    'Downloads a failed archive again from scratch and checks it in place'
+    filepath=os.path.join(outpath,os.path.split(d)[1])
+    print('Archive check failed for',os.path.split(d)[1],'-',error,'- fetching again')
+    os.remove(filepath)
+    if manifest is not None:
+        manifest.discard(filepath)
+    if incremental is not None:
+        incremental.forget(filepath)
+    archives.refetched(filepath)
+    with limiter.get(d):
+        try:
+            nbytes=fetch(d,outpath,incremental=None,manifest=manifest)
+        except requests.exceptions.RequestException as e:
+            print('Could not retrieve',d,'because of',e)
+            return 0,e
+        except OSError as e:
+            print('Could not save',d,'because of',e)
+            return 0,e
+    entry=archives.check(filepath,d)
+    if entry['ok'] is False:
+        if manifest is not None:
+            manifest.discard(filepath)
+        print('Archive still corrupt after fetching again:',os.path.split(d)[1])
+        return 0,CorruptArchive(entry['error'])
+    print('Downloaded',os.path.split(d)[1],'again, archive is good')
+    return nbytes,None
+
+def settle(datalinks,outpath,results,fetch,limiter,incremental,manifest,archives):
+    'Waits for archive checks and re-fetches failures, returns {url: (bytes, error)}'
+    settled={}
+    for d in datalinks:
+        nbytes,e,check=results[d]
+        if check is not None and check.result()['ok'] is False:
+            nbytes,e=refetch(d,outpath,fetch,limiter,incremental,manifest,archives,check.result()['error'])
+        settled[d]=(nbytes,e)
+    return settled
+
+def tally(datalinks,settled,page_title,elapsed,workers):
+    'Prints the finish and throughput lines, returns (count, errors) in input order'
+    i=0
+    total=0
+    errors={}
+    for d in datalinks:
+        nbytes,e=settled[d]
+        if e is None:
+            i=i+1
+            total=total+nbytes
+        else:
+            errors[d]=e
+    print('Finished downloading',i,'files from',page_title)
+    print('Throughput for',page_title+':',format_rate(total,elapsed),'with',workers,'workers')
+    return i,errors
+
+def save_records(incremental,manifest,archives):
+    for record in (incremental,manifest,archives):
+        if record is not None:
+            record.save()
+
+def download_all(datalinks,outpath,page_title,workers=WORKERS,per_host=PER_HOST,
+                 testcount=None,incremental=None,manifest=None,fetch=fetch_file,executor=None,limiter=None,
+                 archives=None,sizes=None):
+    'Downloads a list of urls with a bounded worker pool, returns (count, errors)'
+    datalinks=unique_files(datalinks)
+    if testcount is not None:
+        datalinks=datalinks[:testcount]
+    if limiter is None:
+        limiter=HostLimiter(per_host)
+    order=datalinks
+    if sizes is not None:
+        order=largest_first(datalinks,sizes)
+    args=(outpath,fetch,limiter,incremental,manifest,archives)
+
+    start=time.monotonic()
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=max(1,workers)) as own:
+            futures={d:own.submit(fetch_one,d,*args) for d in order}
+            results={d:f.result() for d,f in futures.items()}
+    else:
+        futures={d:executor.submit(fetch_one,d,*args) for d in order}
+        results={d:f.result() for d,f in futures.items()}
+    settled=settle(datalinks,outpath,results,*args[1:])
+    elapsed=time.monotonic()-start
+
+    counter,errors=tally(datalinks,settled,page_title,elapsed,workers)
+    save_records(incremental,manifest,archives)
+    return counter,errors
+
+class Pipeline:
+    'Downloads urls while they are still being discovered, through a bounded queue'
+    def __init__(self,workers=WORKERS,per_host=PER_HOST,queue_size=None,testcount=None,
+                 incremental=None,manifest=None,archives=None,fetch=fetch_file,limiter=None):
+        self.workers=max(1,workers)
+        self.limiter=limiter if limiter is not None else HostLimiter(per_host)
+        self.queue=queue.Queue(maxsize=queue_size or self.workers*4)
+        self.testcount=testcount
+        self.incremental=incremental
+        self.manifest=manifest
+        self.archives=archives
+        self.fetch=fetch
+        self.groups={} # outpath -> {'title', 'urls' in put order, file names 'seen', 'results'}
+        self.lock=threading.Lock()
+        self.start=time.monotonic()
+        self.threads=[threading.Thread(target=self.worker,daemon=True) for n in range(self.workers)]
+        for t in self.threads:
+            t.start()
+
+    def add_group(self,outpath,page_title):
+        'Registers a folder before urls for it are put, so empty folders still get counts'
+        with self.lock:
+            self.groups.setdefault(outpath,{'title':page_title,'urls':[],'seen':set(),'results':{}})
+
+    def put(self,url,outpath):
+        'Queues one url for outpath, blocking while the queue is full'
+        with self.lock:
+            group=self.groups[outpath]
+            if filename(url) in group['seen']: # same url, or same file name, see note 14
+                return
+            if self.testcount is not None and len(group['urls'])>=self.testcount:
+                return
+            group['seen'].add(filename(url))
+            group['urls'].append(url)
+        self.queue.put((url,outpath))
+
+    def worker(self):
+        while True:
+            item=self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            url,outpath=item
+            try:
+                result=fetch_one(url,outpath,self.fetch,self.limiter,self.incremental,self.manifest,self.archives)
+            except Exception as e: # keep the worker alive, the url is reported as an error
+                result=(0,e,None)
+            with self.lock:
+                self.groups[outpath]['results'][url]=result
+            self.queue.task_done()
+
+    def join(self):
+        'Waits for every queued url, returns {outpath: (count, errors)}'
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        elapsed=time.monotonic()-self.start
+        counts={}
+        total=0
+        for outpath,group in self.groups.items():
+            settled=settle(group['urls'],outpath,group['results'],self.fetch,self.limiter,
+                           self.incremental,self.manifest,self.archives)
+            counts[outpath]=tally(group['urls'],settled,group['title'],elapsed,self.workers)
+            total=total+sum(nbytes for nbytes,e in settled.values())
+        print('Pipeline throughput:',format_rate(total,elapsed),'with',self.workers,'workers')
+        save_records(self.incremental,self.manifest,self.archives)
+        return counts
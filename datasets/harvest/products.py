@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Discover and download the multi-list NOAA products in one pipeline
+Brown University Library, GIS & Data Services
+
+Notes:
+1. A product is one data page: (page url, subfolder, page title, URLlist urls, other
+file urls), as gathered by the SLR and Lake Level scripts
+2. By default the lists are streamed: as each URLlist_*.txt arrives its files go on the
+download pipeline's bounded queue, so downloads start while discovery is still running
+3. With preflight, every list is resolved and sized first (plan.py) and the files are
+queued largest first across all products instead
+4. Discovery and downloads share one HostLimiter, so no server gets more than per_host
+connections between them and the session's pool (sized to workers) is never
+outgrown; a list request may wait for a download slot on its host, but lists are
+small and the downloads it waits on are already running
+5. Either way the result is (count, errors) for each product's subfolder, for its
+_METADATA and _ERRORS files; a URLlist that could not be fetched is listed in the
+errors of every subfolder that needed it, and the rest of the run carries on
+"""
+
+from harvest import discovery, plan, pool
+
+def file_lists(products,filelists):
+    'Products as (page url, subfolder, title, file urls) once lists are resolved'
+    full=[]
+    for k,subpath,page_title,list_urls,extras in products:
+        urls=[]
+        for l in list_urls:
+            urls.extend(filelists[l])
+        urls.extend(extras)
+        full.append((k,subpath,page_title,urls))
+    return full
+
+def harvest_products(products,outfolder,workers=pool.WORKERS,per_host=pool.PER_HOST,testcount=None,
+                     incremental=None,manifest=None,archives=None,preflight=False,plan_only=False,
+                     queue_size=None):
+    'Downloads every product, returns {subfolder: (count, errors)}, or None if the plan stops the run'
+    index=discovery.DiscoveryIndex(outfolder)
+    limiter=pool.HostLimiter(per_host) # for discovery and downloads both, see note 4
+    list_urls=[l for p in products for l in p[3]]
+    if preflight:
+        full=file_lists(products,index.resolve(list_urls,workers,per_host,limiter))
+        if testcount is not None:
+            full=[(k,subpath,page_title,urls[:testcount]) for k,subpath,page_title,urls in full]
+        sizes,fits=plan.plan(full,outfolder,workers,per_host,testcount,incremental)
+        if plan_only or not fits:
+            return None
+
+    pipe=pool.Pipeline(workers,per_host,queue_size,testcount,incremental,manifest,archives,limiter=limiter)
+    where={} # list url -> subfolders it fills
+    for k,subpath,page_title,lists,extras in products:
+        pipe.add_group(subpath,page_title)
+        for l in lists:
+            where.setdefault(l,[]).append(subpath)
+    if preflight:
+        queued=[(u,subpath) for k,subpath,page_title,urls in full for u in urls]
+        for u,subpath in sorted(queued,key=lambda q: sizes.get(q[0]) or -1,reverse=True):
+            pipe.put(u,subpath)
+    else:
+        for k,subpath,page_title,lists,extras in products:
+            for u in extras: # known already, so they go first
+                pipe.put(u,subpath)
+        for l,urls in index.stream(list_urls,workers,per_host,limiter):
+            for subpath in where[l]:
+                for u in urls:
+                    pipe.put(u,subpath)
+    results=pipe.join()
+    for l,e in index.failed.items():
+        for subpath in where[l]:
+            results[subpath][1][l]=e
+    return results
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Token bucket rate limiter
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Replaces fixed sleeps with a requests-per-second budget, short bursts allowed
+2. acquire() blocks a thread, wait() is the asyncio version; both share one bucket
+"""
+
+import asyncio, threading, time
+
+class TokenBucket:
+    'Allows rate requests per second on average and up to burst at once'
+    def __init__(self,rate,burst=None):
+        self.rate=float(rate)
+        self.capacity=float(burst if burst is not None else max(1.0,self.rate))
+        self.tokens=self.capacity
+        self.updated=time.monotonic()
+        self.lock=threading.Lock()
+
+    def take(self):
+        'Takes a token if one is free and returns 0, otherwise returns seconds to wait'
+        with self.lock:
+            now=time.monotonic()
+            self.tokens=min(self.capacity,self.tokens+(now-self.updated)*self.rate)
+            self.updated=now
+            if self.tokens>=1:
+                self.tokens=self.tokens-1
+                return 0.0
+            return (1-self.tokens)/self.rate
+
+    def acquire(self):
+        while True:
+            delay=self.take()
+            if delay==0:
+                return
+            time.sleep(delay)
+
+    async def wait(self):
+        while True:
+            delay=self.take()
+            if delay==0:
+                return
+            await asyncio.sleep(delay)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Retries with jittered exponential backoff, and a per-host circuit breaker
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Transient failures are tried again: connection errors, timeouts, short reads and
+responses of 408, 425, 429, 500, 502, 503 and 504; anything else (404, 403, a corrupt
+archive, a cache miss) is permanent and goes straight to the caller and _ERRORS
+2. The wait before retry n is a random time between zero and BACKOFF*2**n seconds,
+capped at MAX_BACKOFF ("full jitter"), so workers that failed together do not all come
+back at the same moment; a Retry-After header, in seconds or as a date, is honored
+as the minimum wait, up to MAX_RETRY_AFTER
+3. Every host has a circuit breaker: after THRESHOLD transient failures in a row the
+host is paused for COOLDOWN seconds, then one request is let through as a probe while
+the others wait for its result; each failed probe doubles the pause
+4. After PROBES failed probes the host is taken as down for the rest of the run, and
+every remaining request to it fails at once with HostDown instead of spending a
+connect timeout on each url; a probe that ends in any other error (a bad url, a
+local error) counts as failed, so the threads waiting on it are never left hanging
+5. The session retries its own non-streamed GET and HEAD requests (pages, url lists,
+API calls); fetch_file retries whole downloads, each attempt resuming the .part
+6. Retries, pauses, probes and hosts given up on are recorded as telemetry events
+"""
+
+import time, random, threading, email.utils
+import requests
+from urllib.parse import urlsplit
+from harvest import telemetry
+
+ATTEMPTS=5 # tries in all, including the first
+BACKOFF=1.0
+MAX_BACKOFF=60.0
+MAX_RETRY_AFTER=300.0
+THRESHOLD=5
+COOLDOWN=30.0
+PROBES=3
+RETRY_STATUSES={408,425,429,500,502,503,504}
+
+class HostDown(requests.exceptions.RequestException):
+    'Raised for every request to a host the circuit breaker has given up on'
+
+def parse_retry_after(value):
+    'Seconds to wait from a Retry-After header, either delta seconds or an HTTP date'
+    if not value:
+        return None
+    value=value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when=email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0,when.timestamp()-time.time())
+
+def response_of(result):
+    'The response behind a result or an HTTPError, if there is one'
+    if isinstance(result,requests.Response):
+        return result
+    return getattr(result,'response',None)
+
+def is_transient(error):
+    'True for failures worth trying again'
+    if isinstance(error,HostDown):
+        return False
+    if isinstance(error,requests.exceptions.HTTPError):
+        response=response_of(error)
+        return response is not None and response.status_code in RETRY_STATUSES
+    from harvest.fetch import IncompleteDownload # here, fetch imports session which imports this module
+    return isinstance(error,(requests.exceptions.ConnectionError,requests.exceptions.Timeout,
+                             requests.exceptions.ChunkedEncodingError,IncompleteDownload))
+
+def backoff(attempt,retry_after=None):
+    'Seconds to wait before retry number attempt (1 for the first retry)'
+    delay=random.uniform(0,min(MAX_BACKOFF,BACKOFF*2**attempt))
+    if retry_after is not None:
+        delay=max(delay,min(retry_after,MAX_RETRY_AFTER))
+    return delay
+
+class CircuitBreaker:
+    'Closed, open (paused) or down for each host, shared by every thread in the run'
+    def __init__(self,threshold=THRESHOLD,cooldown=COOLDOWN,probes=PROBES):
+        self.threshold=threshold
+        self.cooldown=cooldown
+        self.probes=probes
+        self.hosts={} # host -> failures, pauses, paused until, probing thread, failed probes, down
+        self.cond=threading.Condition()
+
+    def state(self,host):
+        return self.hosts.setdefault(host,{'failures':0,'opened':0,'until':0.0,'probing':None,
+                                           'probes':0,'down':False,'paused':0.0})
+
+    def admit(self,host):
+        'Waits while host is paused; raises HostDown once it has been given up on'
+        with self.cond:
+            s=self.state(host)
+            while True:
+                if s['down']:
+                    raise HostDown('{} is down, skipped after {} failed probes'.format(host,s['probes']))
+                if not s['opened'] or s['probing']==threading.get_ident():
+                    return # closed, or a request made by the probe itself
+                wait=s['until']-time.monotonic()
+                if wait<=0 and s['probing'] is None:
+                    s['probing']=threading.get_ident()
+                    telemetry.emit('probe',host=host,probe=s['probes']+1)
+                    return
+                self.cond.wait(wait if wait>0 else None) # a probe is out, wait for its result
+
+    def success(self,host):
+        with self.cond:
+            s=self.state(host)
+            if s['opened']:
+                print('{} is back after {:,.0f} s paused'.format(host,s['paused']))
+                telemetry.emit('circuit_closed',host=host,paused=s['paused'])
+            s.update(failures=0,opened=0,probing=None,probes=0)
+            self.cond.notify_all()
+
+    def failure(self,host):
+        with self.cond:
+            s=self.state(host)
+            s['failures']=s['failures']+1
+            if s['probing']==threading.get_ident():
+                s['probing']=None
+                s['probes']=s['probes']+1
+                if s['probes']>=self.probes:
+                    s['down']=True
+                    print('Giving up on',host,'after',s['probes'],'failed probes')
+                    telemetry.emit('host_down',host=host,failures=s['failures'])
+                    self.cond.notify_all()
+                    return
+                self.pause(host,s,self.cooldown*2**s['probes'])
+            elif not s['opened'] and s['failures']>=self.threshold:
+                self.pause(host,s,self.cooldown)
+            self.cond.notify_all()
+
+    def abandon(self,host):
+        'A call ended with no verdict on the host; if it was the probe, the probe failed'
+        with self.cond:
+            probing=self.state(host)['probing']==threading.get_ident()
+        if probing:
+            self.failure(host)
+
+    def pause(self,host,s,seconds):
+        s['opened']=s['opened']+1
+        s['until']=time.monotonic()+seconds
+        s['paused']=s['paused']+seconds
+        print('Pausing requests to {} for {:,.0f} s after {} failures'.format(host,seconds,s['failures']))
+        telemetry.emit('circuit_open',host=host,seconds=seconds,failures=s['failures'])
+
+    def summary(self):
+        with self.cond:
+            down=sorted(h for h,s in self.hosts.items() if s['down'])
+            paused=sorted(h for h,s in self.hosts.items() if s['paused'] and not s['down'])
+        lines=[]
+        if paused:
+            lines.append('Paused and recovered: '+', '.join(paused))
+        if down:
+            lines.append('Given up on: '+', '.join(down))
+        return '\n'.join(lines)
+
+breaker=CircuitBreaker()
+
+def configure(attempts=None,backoff_base=None,max_backoff=None,threshold=None,cooldown=None,probes=None):
+    'Changes retry and breaker settings for the run'
+    global ATTEMPTS, BACKOFF, MAX_BACKOFF
+    if attempts is not None:
+        ATTEMPTS=attempts
+    if backoff_base is not None:
+        BACKOFF=backoff_base
+    if max_backoff is not None:
+        MAX_BACKOFF=max_backoff
+    if threshold is not None:
+        breaker.threshold=threshold
+    if cooldown is not None:
+        breaker.cooldown=cooldown
+    if probes is not None:
+        breaker.probes=probes
+
+def call(url,fn,attempts=None):
+    '''Runs fn(attempt) until it succeeds, fails permanently or runs out of attempts;
+    a response with a retryable status counts as a failure until the last attempt,
+    which returns it as is'''
+    attempts=attempts or ATTEMPTS
+    host=urlsplit(url).netloc
+    attempt=0
+    while True:
+        breaker.admit(host)
+        settled=False
+        try:
+            try:
+                result=fn(attempt)
+                error=None
+            except requests.exceptions.RequestException as e:
+                if not is_transient(e):
+                    if response_of(e) is not None:
+                        breaker.success(host) # the host answered, the url is what failed
+                        settled=True
+                    raise
+                result=None
+                error=e
+            response=response_of(error if error is not None else result)
+            if error is None and (response is None or response.status_code not in RETRY_STATUSES):
+                breaker.success(host)
+                settled=True
+                return result
+            breaker.failure(host)
+            settled=True
+        finally:
+            if not settled: # a local error or no answer either way, a probe must still report
+                breaker.abandon(host)
+        attempt=attempt+1
+        if attempt>=attempts:
+            if error is not None:
+                raise error
+            return result
+        retry_after=parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+        delay=backoff(attempt,retry_after)
+        telemetry.emit('retry',url=url,host=host,attempt=attempt,delay=delay,
+                       status=response.status_code if response is not None else None,
+                       error='{}: {}'.format(type(error).__name__,error) if error is not None else None)
+        if error is None:
+            response.close()
+        time.sleep(delay)
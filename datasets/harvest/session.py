@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Shared pooled HTTP session
+Brown University Library, GIS & Data Services
+
+Notes:
+1. One requests.Session per process, so pages, url lists and files reuse keep-alive
+connections instead of a new TCP+TLS handshake per request
+2. Each host gets its own connection pool, pool_maxsize should be at least the number
+of download workers so no worker opens a throwaway connection
+3. Every request gets a default (connect, read) timeout unless the caller passes one
+4. Pages ask for gzip; file downloads override this with identity encoding
+5. Requests and new connections are counted per host, report() prints the reuse rate
+6. An optional record/replay cache (httpcache.py) sits in the adapter, so every page and
+API call made through the session can be served from disk
+7. redirect() sends every url under a prefix to another base, which is how the
+benchmark (bench.py) points the scripts at its local stand-in server
+8. Every request is timed and, when telemetry is on, recorded as an event with its
+host, status, time to first byte and duration (see telemetry.py)
+9. GET and HEAD requests that are not streamed are retried with backoff on connection
+errors and retryable statuses, behind the per-host circuit breaker (see retry.py);
+the last response is returned as is, so callers still raise_for_status
+10. Bodies the session reads itself are watched for stalls (see watchdog.py); one that
+trickles in below the floor is dropped and raised as Stalled, which is retried
+"""
+
+import requests, time, threading
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from harvest import httpcache, retry, telemetry, watchdog
+
+USER_AGENT='usgovdata-backup/1.0 (Brown University Library; +https://github.com/Brown-University-Library/geodata_usgovt_backup)'
+TIMEOUT=(15,120) # seconds to connect, seconds between bytes
+POOL_HOSTS=32
+POOL_MAXSIZE=16
+CACHE=httpcache.from_environment()
+REDIRECTS={}
+
+stats={}
+statslock=threading.Lock()
+
+def count(host,field):
+    with statslock:
+        hoststats=stats.setdefault(host,{'requests':0,'connections':0})
+        hoststats[field]=hoststats[field]+1
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        count(self.host,'connections')
+        return super()._new_conn()
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        count(self.host,'connections')
+        return super()._new_conn()
+
+class PooledAdapter(HTTPAdapter):
+    'HTTPAdapter that counts requests and fresh connections per host'
+    def __init__(self,*args,cache=None,**kwargs):
+        self.cache=cache
+        super().__init__(*args,**kwargs)
+
+    def init_poolmanager(self,*args,**kwargs):
+        super().init_poolmanager(*args,**kwargs)
+        self.poolmanager.pool_classes_by_scheme={'http':CountingHTTPConnectionPool,
+                                                 'https':CountingHTTPSConnectionPool}
+
+    def send(self,request,**kwargs):
+        url=request.url
+        for prefix,base in REDIRECTS.items():
+            if request.url.startswith(prefix):
+                request.url=base+request.url[len(prefix):]
+                break
+        cache=self.cache
+        cacheable=cache is not None and cache.cacheable(request,kwargs.get('stream',False))
+        if cacheable:
+            response=cache.lookup(request)
+            if response is not None:
+                return response
+        if cache is not None and cache.mode=='replay':
+            raise httpcache.CacheMiss('not recorded: {} {}'.format(request.method,request.url))
+        count(requests.utils.urlparse(request.url).hostname,'requests')
+        response=super().send(request,**kwargs)
+        if not kwargs.get('stream',False):
+            watchdog.watch_session_body(response,url)
+        if cacheable:
+            cache.store(request,response)
+        return response
+
+_session=None
+_lock=threading.Lock()
+
+def build_session(pool_maxsize=POOL_MAXSIZE,user_agent=USER_AGENT,cache=None):
+    'New session with pooled adapters and the project headers'
+    s=requests.Session()
+    adapter=PooledAdapter(pool_connections=POOL_HOSTS,pool_maxsize=pool_maxsize,cache=cache)
+    s.mount('http://',adapter)
+    s.mount('https://',adapter)
+    s.headers.update({'User-Agent':user_agent,
+                      'Accept-Encoding':'gzip, deflate'})
+    return s
+
+def get_session():
+    'The shared session, built on first use'
+    global _session
+    with _lock:
+        if _session is None:
+            _session=build_session(POOL_MAXSIZE,USER_AGENT,CACHE)
+        return _session
+
+def configure(timeout=None,pool_maxsize=None,user_agent=None,cache=None,cache_dir=None,cache_ttl=None):
+    'Changes defaults before the first request, e.g. pool_maxsize to match the worker count'
+    global TIMEOUT, POOL_MAXSIZE, USER_AGENT, CACHE, _session
+    with _lock:
+        if cache is not None: # 'record', 'replay', or False to turn the cache off
+            CACHE=httpcache.HttpCache(cache,cache_dir,cache_ttl) if cache else None
+        if timeout is not None:
+            TIMEOUT=timeout
+        if pool_maxsize is not None:
+            POOL_MAXSIZE=pool_maxsize
+        if user_agent is not None:
+            USER_AGENT=user_agent
+        _session=None
+
+def redirect(prefix,base):
+    'Sends requests for urls starting with prefix to base instead'
+    REDIRECTS[prefix]=base
+
+def request(method,url,**kwargs):
+    kwargs.setdefault('timeout',TIMEOUT)
+    if method in ('GET','HEAD') and not kwargs.get('stream',False):
+        return retry.call(url,lambda attempt: send(method,url,**kwargs))
+    return send(method,url,**kwargs)
+
+def send(method,url,**kwargs):
+    'One timed request through the shared session'
+    start=time.monotonic()
+    error=None
+    try:
+        response=get_session().request(method,url,**kwargs)
+    except requests.exceptions.RequestException as e:
+        error=e
+    finally:
+        watched=watchdog.take_session_watch()
+    if watched is not None and watched.stalled: # however the cut-off read ended
+        error=watchdog.Stalled('stalled below {:,} bytes/s: {}'.format(watchdog.dog.floor,url))
+    duration=time.monotonic()-start
+    if error is not None:
+        telemetry.request_event(method,url,duration=duration,error=error)
+        raise error
+    telemetry.request_event(method,url,response,duration,stream=kwargs.get('stream',False))
+    return response
+
+def get(url,**kwargs):
+    'Drop-in for requests.get that uses the shared session'
+    return request('GET',url,**kwargs)
+
+def head(url,**kwargs):
+    kwargs.setdefault('allow_redirects',True)
+    return request('HEAD',url,**kwargs)
+
+def post(url,**kwargs):
+    return request('POST',url,**kwargs)
+
+def report():
+    'Prints requests versus new connections for each host'
+    if CACHE is not None:
+        print(CACHE.summary())
+    breakers=retry.breaker.summary()
+    if breakers:
+        print(breakers)
+    if watchdog.dog.stalls:
+        print(watchdog.dog.summary())
+    with statslock:
+        for host,hoststats in sorted(stats.items()):
+            reqs=hoststats['requests']
+            conns=hoststats['connections']
+            reuse=100*(reqs-conns)/reqs if reqs>0 else 0.0
+            print('{}: {} requests over {} connections ({:.0f}% reused)'.format(host,reqs,conns,reuse))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental re-archiving against the previous downloaded-YYYY-MM-DD snapshot
+Brown University Library, GIS & Data Services
+
+Notes:
+1. The most recent earlier downloaded-* folder next to the current one is the baseline
+2. Each snapshot keeps _VALIDATORS.json: relative path, url, size, ETag, Last-Modified
+3. When the baseline has validators, fetch sends If-None-Match / If-Modified-Since,
+and a 304 means the file is carried forward instead of transferred
+4. Older snapshots without _VALIDATORS.json get a HEAD size check first; same size
+and a Last-Modified no newer than the old copy counts as unchanged
+5. Unchanged files are hardlinked from the baseline (copied if links aren't possible),
+so the new folder is still a complete snapshot on its own
+"""
+
+import requests, os, re, json, shutil, threading
+from harvest import session
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+VALIDATORS='_VALIDATORS.json'
+SNAPSHOT=re.compile(r'^downloaded-(\d{4}-\d{2}-\d{2})$')
+
+def previous_snapshot(outfolder):
+    'Returns the path of the newest downloaded-* folder dated before outfolder, or None'
+    outfolder=os.path.abspath(outfolder)
+    parent,current=os.path.split(outfolder)
+    earlier=[]
+    for name in os.listdir(parent):
+        if SNAPSHOT.match(name) and name<current and os.path.isdir(os.path.join(parent,name)):
+            earlier.append(name)
+    if len(earlier)==0:
+        return None
+    return os.path.join(parent,max(earlier))
+
+def load_validators(snapshot):
+    'Reads _VALIDATORS.json from a snapshot folder, empty dict if missing'
+    if snapshot is None:
+        return {}
+    vpath=os.path.join(snapshot,VALIDATORS)
+    if not os.path.exists(vpath):
+        return {}
+    with open(vpath) as readfile:
+        return json.load(readfile)
+
+def link_or_copy(src,dst):
+    'Hardlinks src to dst, falls back to a copy across filesystems'
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src,dst)
+    except OSError:
+        shutil.copy2(src,dst)
+
+class Incremental:
+    'Tracks the baseline snapshot and the validators of the one being written'
+    def __init__(self,outfolder):
+        self.outfolder=os.path.abspath(outfolder)
+        self.previous=previous_snapshot(outfolder)
+        self.old=load_validators(self.previous)
+        self.new=load_validators(self.outfolder) # keep entries from earlier runs today
+        self.lock=threading.Lock()
+        self.carried=0
+        self.carried_bytes=0
+        if self.previous is not None:
+            print('Incremental mode, comparing against',os.path.basename(self.previous))
+
+    def relpath(self,filepath):
+        return os.path.relpath(os.path.abspath(filepath),self.outfolder).replace(os.sep,'/')
+
+    def prior(self,filepath):
+        'Returns (path in baseline, validators) for a file, or (None, {}) if it is new'
+        if self.previous is None:
+            return None,{}
+        rel=self.relpath(filepath)
+        prevpath=os.path.join(self.previous,rel)
+        if not os.path.isfile(prevpath):
+            return None,{}
+        return prevpath,self.old.get(rel,{})
+
+    def conditional_headers(self,old):
+        'Request headers that let the server answer 304 Not Modified'
+        headers={}
+        if old.get('etag'):
+            headers['If-None-Match']=old['etag']
+        if old.get('last_modified'):
+            headers['If-Modified-Since']=old['last_modified']
+        return headers
+
+    def same_size(self,url,prevpath):
+        'HEAD check for baselines without validators, returns the HEAD headers if unchanged'
+        try:
+            response=session.head(url, headers={'Accept-Encoding':'identity'})
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            return None
+        clen=response.headers.get('Content-Length')
+        if clen is None or int(clen)!=os.path.getsize(prevpath):
+            return None
+        lmod=response.headers.get('Last-Modified')
+        if lmod is not None:
+            try:
+                changed=parsedate_to_datetime(lmod)
+            except (TypeError, ValueError):
+                return None
+            saved=datetime.fromtimestamp(os.path.getmtime(prevpath),timezone.utc)
+            if changed>saved:
+                return None
+        return response.headers
+
+    def carry_forward(self,prevpath,filepath,url,old,headers=None):
+        'Links an unchanged file from the baseline into the current snapshot'
+        link_or_copy(prevpath,filepath)
+        entry={'url':url,'length':os.path.getsize(filepath),
+               'etag':old.get('etag'),'last_modified':old.get('last_modified')}
+        if headers is not None: # a 304 may carry fresher validators
+            entry['etag']=headers.get('ETag') or entry['etag']
+            entry['last_modified']=headers.get('Last-Modified') or entry['last_modified']
+        with self.lock:
+            self.new[self.relpath(filepath)]=entry
+            self.carried=self.carried+1
+            self.carried_bytes=self.carried_bytes+entry['length']
+        return entry
+
+    def record(self,filepath,url,meta):
+        'Saves validators for a file that was actually downloaded'
+        entry={'url':url,'length':os.path.getsize(filepath),
+               'etag':meta.get('etag'),'last_modified':meta.get('last_modified')}
+        with self.lock:
+            self.new[self.relpath(filepath)]=entry
+
+    def forget(self,filepath):
+        'Drops a file that turned out to be bad, so the next run does not trust it'
+        with self.lock:
+            self.new.pop(self.relpath(filepath),None)
+
+    def save(self):
+        'Writes _VALIDATORS.json for the current snapshot'
+        with self.lock:
+            tmp=os.path.join(self.outfolder,VALIDATORS+'.tmp')
+            with open(tmp,'w') as writefile:
+                json.dump(self.new,writefile,indent=1,sort_keys=True)
+            os.replace(tmp,os.path.join(self.outfolder,VALIDATORS))
+
+    def summary(self):
+        return '{} unchanged files ({:,.1f} MB) carried forward from {}'.format(
+            self.carried,self.carried_bytes/1000000,
+            os.path.basename(self.previous) if self.previous else 'no previous snapshot')
+
+def latest_snapshot(parent):
+    'Returns the newest downloaded-* folder in parent, or None'
+    names=[n for n in os.listdir(parent) if SNAPSHOT.match(n) and os.path.isdir(os.path.join(parent,n))]
+    if len(names)==0:
+        return None
+    return os.path.join(parent,max(names))
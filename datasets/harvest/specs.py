@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative specs for the single-page dataset harvesters
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Each spec describes one scrape -> filter links -> download -> metadata job for engine.py
+2. Specs are keyed by the dataset folder their downloaded-* snapshots go in
+3. container: (tag, attrs) handed to soup.find, all <a> inside it are candidates
+4. extensions: keep hrefs ending with one of these, None keeps every href
+5. skip: hrefs starting with any of these prefixes are ignored
+6. rebase: href prefix -> string put in front of it, checked in order; an href that
+matches none is already absolute. An empty prefix matches everything
+7. subpages: optional crawl of pages linked from the main page (IMLS publications),
+every link in the sub-page container is downloaded, rebased the same way
+8. The IMLS scripts used to call soup.find(('div', {...})), which bs4 treats as a list
+of tag names, so it matched the first div on the page. The usa-main-container div
+no longer exists, so the specs keep the first-div behavior explicitly
+"""
+
+IMLS='https://www.imls.gov' # root location where IMLS files are stored
+
+IMLS_PUBLICATIONS={'prefix':'/publications/',
+                   'rebase':{'':IMLS},
+                   'container':('table',{}),
+                   'link_rebase':{'':IMLS}}
+
+SPECS={
+    'imls_mdf':{'dataset':'IMLS Museum Data Files',
+                'url':'https://www.imls.gov/research-evaluation/data/museum-data-files',
+                'container':('div',{}),
+                'extensions':('.pdf','.zip'),
+                'skip':(),
+                'rebase':{'':IMLS}},
+    'imls_pls':{'dataset':'IMLS Public Library Survey',
+                'url':'https://www.imls.gov/research-evaluation/surveys/public-libraries-survey-pls',
+                'container':('div',{}),
+                'extensions':('.pdf','.zip','.xlsx'),
+                'skip':(),
+                'rebase':{'/sites/':IMLS},
+                'subpages':IMLS_PUBLICATIONS},
+    'imls_slaa':{'dataset':'IMLS State Library Administrative Agency Survey',
+                 'url':'https://www.imls.gov/research-evaluation/surveys/state-library-administrative-agency-survey-slaa',
+                 'container':('div',{}),
+                 'extensions':('.csv','.pdf','.zip','.xlsx'),
+                 'skip':(),
+                 'rebase':{'/sites/':IMLS},
+                 'subpages':IMLS_PUBLICATIONS},
+    'irs_soi_eobmf':{'dataset':'IRS SOI Exempt Organizations Business Master File Extract',
+                     'url':'https://www.irs.gov/charities-non-profits/exempt-organizations-business-master-file-extract-eo-bmf',
+                     'container':('div',{'class':'pup-header-content-rt no-gutter col-sm-12 col-md-9'}),
+                     'extensions':('.pdf','.csv','.zip'),
+                     'skip':(),
+                     'rebase':{}},
+    'noaa_ncei_climate_glance':{'dataset':'NOAA NCEI Climate at a Glance',
+                                'url':'https://www.ncei.noaa.gov/pub/data/cirs/climdiv/',
+                                'container':('table',{}),
+                                'extensions':None,
+                                'skip':('?','/'),
+                                'rebase':{'':'https://www.ncei.noaa.gov/pub/data/cirs/climdiv/'}},
+    }
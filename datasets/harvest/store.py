@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed object store shared by all dataset snapshots
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Opt-in: run after a harvest finishes, nothing else depends on the store
+2. Objects live in <store>/objects/ab/abcdef... named by the sha256 of their bytes
+3. Ingest walks every datasets/*/downloaded-* tree and replaces each payload file with
+a hardlink (or a reflink with --reflink) to its object, so identical payloads are
+stored once no matter how many snapshots contain them
+4. Objects are made read-only, since every snapshot shares the same inode; for that
+reason the tag files a rerun rewrites (_METADATA, manifests, _VALIDATORS, _DISCOVERY
+and the rest of manifest.TAGFILES) and .part files are never ingested, and entries for
+tag files ingested by older versions are dropped so gc can free them; saved
+_WEBPAGE-*.html pages are payload and are deduplicated, since every writer replaces a
+file with os.replace rather than writing into it
+5. index.json remembers path, size, mtime, and hash so unchanged files are not re-hashed
+6. gc removes objects no snapshot points to any more, report prints dedup savings
+7. The store must be on the same filesystem as the datasets for hardlinks to work
+
+Usage, from the datasets folder:
+python -m harvest.store ingest [dataset folders...]
+python -m harvest.store report
+python -m harvest.store gc
+"""
+
+import os, sys, json, hashlib, argparse, tempfile, stat, shutil
+from harvest.manifest import is_payload
+
+DATASETS=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORE=os.path.join(DATASETS,'_objectstore')
+FICLONE=0x40049409 # linux ioctl for copy-on-write clones (btrfs, xfs)
+
+def file_sha256(path,blocksize=8388608):
+    'Hashes a file in large sequential reads'
+    h=hashlib.sha256()
+    with open(path,'rb') as readfile:
+        while True:
+            block=readfile.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def storable(fname):
+    'True for payload files, including saved pages; tag files are rewritten by reruns'
+    return is_payload(fname)
+
+def snapshot_files(roots):
+    'Yields every payload file under the downloaded-* folders of the given dataset folders'
+    for root in roots:
+        for name in sorted(os.listdir(root)):
+            snap=os.path.join(root,name)
+            if not (name.startswith('downloaded-') and os.path.isdir(snap)):
+                continue
+            for path,folders,files in os.walk(snap):
+                for fname in files:
+                    if storable(fname):
+                        yield os.path.join(path,fname)
+
+def dataset_folders():
+    'All dataset folders next to the harvest package'
+    folders=[]
+    for name in sorted(os.listdir(DATASETS)):
+        path=os.path.join(DATASETS,name)
+        if os.path.isdir(path) and not name.startswith(('_','.')) and name!='harvest':
+            folders.append(path)
+    return folders
+
+def reflink(src,dst):
+    'Copy-on-write clone of src at dst, raises OSError where unsupported'
+    import fcntl
+    with open(src,'rb') as s, open(dst,'wb') as d:
+        fcntl.ioctl(d.fileno(),FICLONE,s.fileno())
+
+class ObjectStore:
+    'A folder of sha256-named objects plus an index of the snapshot files that use them'
+    def __init__(self,root=STORE,use_reflink=False):
+        self.root=root
+        self.objects=os.path.join(root,'objects')
+        self.indexpath=os.path.join(root,'index.json')
+        self.use_reflink=use_reflink
+        os.makedirs(self.objects,exist_ok=True)
+        if os.path.exists(self.indexpath):
+            with open(self.indexpath) as readfile:
+                self.index=json.load(readfile)
+        else:
+            self.index={}
+
+    def save(self):
+        tmp=self.indexpath+'.tmp'
+        with open(tmp,'w') as writefile:
+            json.dump(self.index,writefile)
+        os.replace(tmp,self.indexpath)
+
+    def object_path(self,digest):
+        return os.path.join(self.objects,digest[:2],digest)
+
+    def known(self,path,st):
+        'Returns the recorded hash if the file has not changed since it was indexed'
+        entry=self.index.get(os.path.abspath(path))
+        if entry and entry['size']==st.st_size and entry['mtime_ns']==st.st_mtime_ns:
+            return entry['sha256']
+        return None
+
+    def place(self,objpath,path):
+        'Swaps the file at path for a link to objpath without a moment where path is missing'
+        folder=os.path.dirname(path)
+        fd,tmp=tempfile.mkstemp(dir=folder,prefix='.cas-')
+        os.close(fd)
+        os.remove(tmp)
+        try:
+            if self.use_reflink:
+                reflink(objpath,tmp)
+                shutil.copystat(objpath,tmp)
+            else:
+                os.link(objpath,tmp)
+            os.replace(tmp,path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def ingest_file(self,path):
+        'Moves one file into the store, returns (digest, size, deduplicated)'
+        st=os.stat(path)
+        digest=self.known(path,st)
+        indexed=digest is not None
+        if not indexed:
+            digest=file_sha256(path)
+        objpath=self.object_path(digest)
+        dedup=False
+        if not os.path.exists(objpath):
+            os.makedirs(os.path.dirname(objpath),exist_ok=True)
+            if self.use_reflink:
+                reflink(path,objpath)
+            else:
+                os.link(path,objpath) # first copy seen becomes the object
+            os.chmod(objpath,stat.S_IRUSR|stat.S_IRGRP|stat.S_IROTH)
+        elif self.use_reflink:
+            if not indexed: # clones never share an inode, so the index is the only record
+                self.place(objpath,path)
+                dedup=True
+        elif not os.path.samefile(objpath,path):
+            self.place(objpath,path)
+            dedup=True
+        st=os.stat(path)
+        self.index[os.path.abspath(path)]={'sha256':digest,'size':st.st_size,'mtime_ns':st.st_mtime_ns}
+        return digest,st.st_size,dedup
+
+    def ingest(self,roots):
+        'Ingests every snapshot file under roots, prints how much was deduplicated'
+        files=0
+        saved=0
+        for path in snapshot_files(roots):
+            digest,size,dedup=self.ingest_file(path)
+            files=files+1
+            if dedup:
+                saved=saved+size
+                print('Linked',os.path.relpath(path,DATASETS),'to',digest[:12])
+            if files%500==0:
+                self.save()
+        self.save()
+        print('Ingested',files,'files, {:,.1f} MB newly deduplicated'.format(saved/1000000))
+
+    def referenced(self):
+        'Hashes still used by an indexed file, dropping entries for deleted files and tag files'
+        live=set()
+        for path in list(self.index):
+            entry=self.index[path]
+            if storable(os.path.basename(path)) and os.path.exists(path) and os.path.getsize(path)==entry['size']:
+                live.add(entry['sha256'])
+            else:
+                del self.index[path]
+        return live
+
+    def gc(self):
+        'Removes objects no snapshot file points to'
+        live=self.referenced()
+        removed=0
+        freed=0
+        for path,folders,files in os.walk(self.objects):
+            for digest in files:
+                objpath=os.path.join(path,digest)
+                st=os.stat(objpath)
+                if digest in live and (self.use_reflink or st.st_nlink>1):
+                    continue
+                os.remove(objpath)
+                removed=removed+1
+                freed=freed+st.st_size
+        self.save()
+        print('Removed',removed,'unreferenced objects, freed {:,.1f} MB'.format(freed/1000000))
+
+    def report(self):
+        'Logical bytes across all snapshots versus bytes actually stored'
+        live=self.referenced()
+        logical=0
+        for entry in self.index.values():
+            logical=logical+entry['size']
+        physical=0
+        for digest in live:
+            objpath=self.object_path(digest)
+            if os.path.exists(objpath):
+                physical=physical+os.path.getsize(objpath)
+        print('{} snapshot files, {} unique objects'.format(len(self.index),len(live)))
+        print('Logical size: {:,.1f} MB'.format(logical/1000000))
+        print('Stored size: {:,.1f} MB'.format(physical/1000000))
+        print('Deduplicated: {:,.1f} MB'.format((logical-physical)/1000000))
+        return logical,physical
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Content-addressed store for downloaded-* snapshots')
+    parser.add_argument('command',choices=['ingest','gc','report'])
+    parser.add_argument('folders',nargs='*',help='dataset folders to ingest, default is all of them')
+    parser.add_argument('--store',default=STORE,help='object store location')
+    parser.add_argument('--reflink',action='store_true',help='use copy-on-write clones instead of hardlinks')
+    args=parser.parse_args(argv)
+    store=ObjectStore(args.store,use_reflink=args.reflink)
+    if args.command=='ingest':
+        store.ingest([os.path.abspath(f) for f in args.folders] or dataset_folders())
+    elif args.command=='gc':
+        store.gc()
+    else:
+        store.report()
+
+if __name__=='__main__':
+    sys.exit(main())
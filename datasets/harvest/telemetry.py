@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Structured per-request and per-file telemetry
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Every request made through the shared session emits a 'request' event (method, url,
+host, status, time to first byte, duration, bytes for non-streamed bodies, cache hit),
+and every fetch_file emits a 'file' event (url, host, path, bytes, time to first byte,
+duration, status, outcome and retries)
+2. Events are appended to a JSONL log, one JSON object per line with a UTC timestamp
+3. The same events roll up into a Prometheus textfile (requests, errors, bytes and
+files per host, plus per-host histograms of time to first byte and file throughput),
+rewritten atomically every interval seconds and at exit, for node exporter's textfile
+collector to graph long harvests while they run
+4. Nothing is recorded until start() is called, or the HARVEST_TELEMETRY environment
+variable names a folder for the log; HARVEST_PROM_DIR names the textfile collector
+folder (default: the same folder)
+5. Other modules record extra events with emit(), e.g. stalls and retries
+"""
+
+import os, sys, json, time, atexit, threading
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+TTFB_BUCKETS=(0.05,0.1,0.25,0.5,1,2.5,5,10,30,60)
+THROUGHPUT_BUCKETS=(1e4,1e5,5e5,1e6,5e6,1e7,5e7,1e8,5e8)
+INTERVAL=15
+
+class Histogram:
+    'Cumulative bucket counts, sum and count, as Prometheus expects'
+    def __init__(self,buckets):
+        self.buckets=buckets
+        self.counts=[0]*len(buckets)
+        self.sum=0.0
+        self.count=0
+
+    def observe(self,value):
+        for i,edge in enumerate(self.buckets):
+            if value<=edge:
+                self.counts[i]=self.counts[i]+1
+        self.sum=self.sum+value
+        self.count=self.count+1
+
+    def lines(self,name,labels):
+        out=[]
+        for edge,n in zip(self.buckets,self.counts):
+            out.append('{}_bucket{{{},le="{:g}"}} {}'.format(name,labels,edge,n))
+        out.append('{}_bucket{{{},le="+Inf"}} {}'.format(name,labels,self.count))
+        out.append('{}_sum{{{}}} {:.6f}'.format(name,labels,self.sum))
+        out.append('{}_count{{{}}} {}'.format(name,labels,self.count))
+        return out
+
+class Telemetry:
+    'JSONL event log plus Prometheus roll-up for one harvest process'
+    def __init__(self,log_path,prom_path=None,name=None,interval=INTERVAL):
+        self.name=name or default_name()
+        self.log_path=log_path
+        self.prom_path=prom_path
+        self.interval=interval
+        self.lock=threading.Lock()
+        self.logfile=open(log_path,'a',buffering=1)
+        self.counters={} # (metric, host, extra label) -> value
+        self.ttfb={}
+        self.throughput={}
+        self.written=0.0
+        self.last_event=0.0
+
+    def count(self,metric,host,value=1,**labels):
+        key=(metric,host,tuple(sorted(labels.items())))
+        self.counters[key]=self.counters.get(key,0)+value
+
+    def emit(self,kind,**fields):
+        now=time.time()
+        event={'ts':datetime.fromtimestamp(now,timezone.utc).isoformat(timespec='milliseconds'),
+               'event':kind}
+        event.update(fields)
+        line=json.dumps(event,default=str)
+        with self.lock:
+            self.logfile.write(line+'\n')
+            self.last_event=now
+            self.rollup(kind,fields)
+            due=self.prom_path is not None and now-self.written>=self.interval
+        if due:
+            self.write_prom()
+
+    def rollup(self,kind,fields):
+        host=fields.get('host') or ''
+        if kind=='request':
+            self.count('harvest_requests_total',host,status=str(fields.get('status') or 'error'))
+            if fields.get('error'):
+                self.count('harvest_request_errors_total',host)
+            if fields.get('bytes'):
+                self.count('harvest_bytes_total',host,fields['bytes'])
+            if fields.get('ttfb') is not None and not fields.get('cached'):
+                self.ttfb.setdefault(host,Histogram(TTFB_BUCKETS)).observe(fields['ttfb'])
+        elif kind=='file':
+            self.count('harvest_files_total',host,outcome=fields.get('outcome','downloaded'))
+            nbytes=fields.get('bytes') or 0
+            if nbytes:
+                self.count('harvest_bytes_total',host,nbytes)
+            duration=fields.get('duration') or 0
+            if fields.get('outcome') in ('downloaded','resumed') and nbytes and duration>0:
+                self.throughput.setdefault(host,Histogram(THROUGHPUT_BUCKETS)).observe(nbytes/duration)
+        else:
+            self.count('harvest_events_total',host,event=kind)
+
+    def write_prom(self):
+        'Rewrites the textfile in one rename so the collector never reads half of it'
+        with self.lock:
+            lines=[]
+            base='harvest="{}"'.format(self.name)
+            seen=set()
+            for (metric,host,extra),value in sorted(self.counters.items()):
+                if metric not in seen:
+                    lines.append('# TYPE {} counter'.format(metric))
+                    seen.add(metric)
+                labels=base+',host="{}"'.format(host)+''.join(',{}="{}"'.format(k,v) for k,v in extra)
+                lines.append('{}{{{}}} {}'.format(metric,labels,value))
+            for metric,hists in (('harvest_ttfb_seconds',self.ttfb),
+                                 ('harvest_file_throughput_bytes_per_second',self.throughput)):
+                if hists:
+                    lines.append('# TYPE {} histogram'.format(metric))
+                for host,hist in sorted(hists.items()):
+                    lines.extend(hist.lines(metric,base+',host="{}"'.format(host)))
+            lines.append('# TYPE harvest_last_event_timestamp_seconds gauge')
+            lines.append('harvest_last_event_timestamp_seconds{{{}}} {:.3f}'.format(base,self.last_event))
+            self.written=time.time()
+        tmp=self.prom_path+'.{}.tmp'.format(os.getpid())
+        with open(tmp,'w') as writefile:
+            writefile.write('\n'.join(lines)+'\n')
+        os.replace(tmp,self.prom_path)
+
+    def close(self):
+        if self.prom_path is not None:
+            self.write_prom()
+        with self.lock:
+            self.logfile.close()
+
+_active=None
+
+def default_name():
+    'The running script or module, e.g. downloader_noaa_slr or engine'
+    return os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'harvest'
+
+def start(folder,prom_dir=None,name=None,interval=INTERVAL):
+    'Starts recording to folder/<name>-<timestamp>.jsonl and prom_dir/harvest_<name>.prom'
+    global _active
+    stop()
+    name=name or default_name()
+    prom_dir=prom_dir or folder
+    os.makedirs(folder,exist_ok=True)
+    os.makedirs(prom_dir,exist_ok=True)
+    stamp=datetime.now().strftime('%Y%m%d-%H%M%S')
+    _active=Telemetry(os.path.join(folder,'{}-{}.jsonl'.format(name,stamp)),
+                      os.path.join(prom_dir,'harvest_{}.prom'.format(name)),name,interval)
+    return _active
+
+def stop():
+    'Writes the final textfile and closes the log'
+    global _active
+    if _active is not None:
+        _active.close()
+        _active=None
+
+def emit(kind,**fields):
+    'Records one event if telemetry is on'
+    if _active is not None:
+        _active.emit(kind,**fields)
+
+def host_of(url):
+    return urlsplit(url).netloc
+
+def request_event(method,url,response=None,duration=None,error=None,stream=False):
+    'Event for one session request'
+    if _active is None:
+        return
+    fields={'method':method,'url':url,'host':host_of(url),'duration':duration}
+    if response is not None:
+        fields['status']=response.status_code
+        fields['ttfb']=response.elapsed.total_seconds() if response.elapsed else None
+        fields['cached']=response.headers.get('X-Harvest-Cache')=='hit'
+        fields['bytes']=None if stream else len(response.content)
+    if error is not None:
+        fields['error']='{}: {}'.format(type(error).__name__,error)
+    _active.emit('request',**fields)
+
+def from_environment():
+    folder=os.environ.get('HARVEST_TELEMETRY')
+    if folder:
+        start(folder,os.environ.get('HARVEST_PROM_DIR'))
+
+atexit.register(stop)
+from_environment()
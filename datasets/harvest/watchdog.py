@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Stall watchdog for response bodies
+Brown University Library, GIS & Data Services
+
+Notes:
+1. The session's (connect, read) timeout only fires when a server goes completely
+silent; a stream that trickles a few bytes a minute never trips it and can hold a
+worker for days
+2. One background thread checks every watched body every INTERVAL seconds; a body that
+receives less than FLOOR bytes per second over WINDOW seconds is aborted by shutting
+down its socket, which ends the blocked read in the worker
+3. The worker then raises Stalled, a ConnectionError, so retry.py tries again after a
+backoff and fetch_file resumes from the .part where the server allows it
+4. File downloads report progress as they write (fetch.stream_into); page and API
+bodies read by the session are measured with urllib3's byte count
+5. Each stall is printed and recorded as a telemetry 'stall' event with the url,
+bytes received and rate; configure(floor=0) turns the watchdog off
+"""
+
+import time, socket, threading
+import requests
+from urllib.parse import urlsplit
+from harvest import telemetry
+
+FLOOR=10000 # bytes per second
+WINDOW=120 # seconds a body may stay below FLOOR
+INTERVAL=5
+
+class Stalled(requests.exceptions.ConnectionError):
+    'Raised when a body was aborted for staying below the bytes per second floor'
+
+class Watch:
+    'One body being read, with its byte count at the start of the current window'
+    def __init__(self,response,url):
+        self.response=response
+        self.url=url
+        self.bytes=0
+        self.stalled=False
+        self.since=time.monotonic()
+        self.mark=0
+
+    def progress(self,n):
+        self.bytes=self.bytes+n
+
+    def seen(self):
+        'Bytes so far, from progress() or from urllib3 for bodies the session reads'
+        try:
+            return max(self.bytes,self.response.raw.tell())
+        except (AttributeError, ValueError, TypeError):
+            return self.bytes
+
+    def abort(self):
+        'Shuts the socket under the response so a blocked read returns at once'
+        raw=self.response.raw
+        sock=getattr(getattr(raw,'_connection',None),'sock',None)
+        if sock is None: # http.client response, reading from socket.makefile()
+            sockio=getattr(getattr(getattr(raw,'_fp',None),'fp',None),'raw',None)
+            sock=getattr(sockio,'_sock',None)
+        if sock is None:
+            return
+        try:
+            # the plain socket call, SSLSocket.shutdown would tear down TLS state under the reader
+            socket.socket.shutdown(sock,socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class Watchdog:
+    'Checks every watched body from one daemon thread'
+    def __init__(self,floor=FLOOR,window=WINDOW,interval=INTERVAL):
+        self.floor=floor
+        self.window=window
+        self.interval=interval
+        self.watches=set()
+        self.lock=threading.Lock()
+        self.thread=None
+        self.stalls=0
+
+    def watch(self,response,url=None):
+        'Starts watching a response whose body is about to be read, returns its Watch'
+        w=Watch(response,url or response.url)
+        if not self.floor:
+            return w
+        with self.lock:
+            self.watches.add(w)
+            if self.thread is None:
+                self.thread=threading.Thread(target=self.run,daemon=True)
+                self.thread.start()
+        return w
+
+    def release(self,w):
+        with self.lock:
+            self.watches.discard(w)
+
+    def step(self,bufsize):
+        'Largest read that a body at the floor still completes twice per window'
+        if not self.floor:
+            return bufsize
+        return max(65536,min(bufsize,int(self.floor*self.window/2)))
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.check(time.monotonic())
+
+    def check(self,now):
+        with self.lock:
+            watches=list(self.watches)
+        for w in watches:
+            elapsed=now-w.since
+            if w.stalled or elapsed<self.window:
+                continue
+            seen=w.seen()
+            rate=(seen-w.mark)/elapsed
+            if rate>=self.floor:
+                w.since=now
+                w.mark=seen
+                continue
+            w.stalled=True
+            with self.lock:
+                self.stalls=self.stalls+1
+            print('Stalled at {:,.0f} bytes/s for {:,.0f} s, dropping {}'.format(rate,elapsed,w.url))
+            telemetry.emit('stall',url=w.url,host=urlsplit(w.url).netloc,bytes=seen,
+                           rate=rate,seconds=elapsed,floor=self.floor)
+            w.abort()
+
+    def summary(self):
+        return 'Dropped {} stalled streams below {:,} bytes/s'.format(self.stalls,self.floor)
+
+dog=Watchdog()
+_current=threading.local()
+
+def configure(floor=None,window=None,interval=None):
+    'Changes the floor (0 turns the watchdog off), window and check interval'
+    if floor is not None:
+        dog.floor=floor
+    if window is not None:
+        dog.window=window
+    if interval is not None:
+        dog.interval=interval
+
+def watch(response,url=None):
+    return dog.watch(response,url)
+
+def release(w):
+    dog.release(w)
+
+def watch_session_body(response,url=None):
+    'Watches a body the session will read before returning, see take_session_watch'
+    take_session_watch() # a redirect's body, already read
+    _current.watch=dog.watch(response,url)
+
+def take_session_watch():
+    'Stops watching the body read for the last session request on this thread, returns its Watch'
+    w=getattr(_current,'watch',None)
+    _current.watch=None
+    if w is not None:
+        dog.release(w)
+    return w
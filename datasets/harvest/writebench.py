@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark for the download write path
+Brown University Library, GIS & Data Services
+
+Notes:
+1. Serves one large synthetic file from a local server and downloads it twice: with
+the old iter_content(chunk_size=10000000) loop and with fetch.stream_into
+2. Each method runs in its own child process so peak RSS (ru_maxrss) is not shared;
+a second run of each under tracemalloc gives the peak of Python allocations
+3. Output goes to a temporary folder (or --dir) and is deleted afterwards
+
+Usage, from the datasets folder:
+python -m harvest.writebench --size 4096 --bufsize 1048576
+"""
+
+import os, sys, json, time, argparse, resource, subprocess, tempfile, threading, tracemalloc
+import http.server
+
+BLOCK=bytes(range(256))*4096 # 1 MB of non-zero bytes
+OLD_CHUNK=10000000
+
+class BodyHandler(http.server.BaseHTTPRequestHandler):
+    'Sends size bytes of BLOCK repeated'
+    size=0
+    protocol_version='HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length',str(self.size))
+        self.end_headers()
+        left=self.size
+        view=memoryview(BLOCK)
+        while left>0:
+            n=min(left,len(BLOCK))
+            self.wfile.write(view[:n])
+            left=left-n
+
+    def log_message(self,*args):
+        pass
+
+def serve(size):
+    'Starts the local server in a thread, returns (server, url)'
+    handler=type('Handler',(BodyHandler,),{'size':size})
+    server=http.server.ThreadingHTTPServer(('127.0.0.1',0),handler)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server,'http://127.0.0.1:{}/big.bin'.format(server.server_address[1])
+
+def child(method,url,path,bufsize,trace):
+    'Downloads url to path one way and prints its measurements as JSON'
+    from harvest import fetch, session
+    if trace:
+        tracemalloc.start()
+    start=time.monotonic()
+    with session.get(url,stream=True,headers={'Accept-Encoding':'identity'}) as response:
+        with open(path,'wb') as writefile:
+            if method=='chunks':
+                nbytes=0
+                for chunk in response.iter_content(chunk_size=OLD_CHUNK):
+                    writefile.write(chunk)
+                    nbytes=nbytes+len(chunk)
+            else:
+                nbytes=fetch.stream_into(response,writefile,bufsize)
+    elapsed=time.monotonic()-start
+    result={'method':method,'bytes':nbytes,'seconds':elapsed,
+            'maxrss_mb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024}
+    if trace:
+        result['alloc_peak_mb']=tracemalloc.get_traced_memory()[1]/1048576
+    os.remove(path)
+    print(json.dumps(result))
+
+def run(method,url,path,bufsize,trace):
+    cmd=[sys.executable,'-m','harvest.writebench','--child',method,'--url',url,
+         '--out',path,'--bufsize',str(bufsize)]+(['--trace'] if trace else [])
+    out=subprocess.run(cmd,check=True,capture_output=True,text=True,
+                       cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Compare chunked and reused-buffer download writes')
+    parser.add_argument('--size',type=int,default=2048,help='file size in MB')
+    parser.add_argument('--bufsize',type=int,default=1048576)
+    parser.add_argument('--dir',default=None,help='where to write, default a temporary folder')
+    parser.add_argument('--child',choices=['chunks','buffer'],help=argparse.SUPPRESS)
+    parser.add_argument('--url',help=argparse.SUPPRESS)
+    parser.add_argument('--out',help=argparse.SUPPRESS)
+    parser.add_argument('--trace',action='store_true',help=argparse.SUPPRESS)
+    args=parser.parse_args(argv)
+    if args.child:
+        child(args.child,args.url,args.out,args.bufsize,args.trace)
+        return 0
+
+    server,url=serve(args.size*1048576)
+    folder=tempfile.mkdtemp(dir=args.dir)
+    path=os.path.join(folder,'big.bin')
+    print('Downloading {:,} MB, buffer {:,} bytes'.format(args.size,args.bufsize))
+    print('{:<8} {:>10} {:>10} {:>13} {:>15}'.format('method','seconds','MB/s','peak RSS MB','alloc peak MB'))
+    for method in ('chunks','buffer'):
+        timed=run(method,url,path,args.bufsize,False)
+        traced=run(method,url,path,args.bufsize,True)
+        print('{:<8} {:>10,.2f} {:>10,.1f} {:>13,.1f} {:>15,.1f}'.format(
+            method,timed['seconds'],timed['bytes']/1000000/timed['seconds'],
+            timed['maxrss_mb'],traced['alloc_peak_mb']))
+    os.rmdir(folder)
+    server.shutdown()
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -9,14 +9,30 @@ Notes:
 3. Assumes you ran the Print script first which created all the state folders
 4. On each pass, cycle through drop down list and download reports to state folder
 5. Reports for most recent years were not available, drop down yielded nothing
+6. States are worked by a pool of headless browsers that stay open for the whole run
+(harvest/browsers.py), workers at a time; each browser's download folder is switched
+to the state folder before the state starts
+7. Waits for the drop down, the download button and each finished file instead of
+fixed sleeps; the page is still reloaded after each download before the next selection
+8. Seconds spent loading, selecting and downloading for each state are printed and saved
+to _TIMINGS-<date>.json in the output folder; states that failed are listed there too,
+and years that gave no file are listed under the state's skipped
+9. The drop down and download button are an ordinary ASP.NET form postback, so by
+default no browser is used: each state's page is read once for its __VIEWSTATE and
+__EVENTVALIDATION, every year in the drop down is posted back with the download button
+and the file that comes back is streamed to the state folder (harvest/aspnet.py);
+years with no report answer with the page instead and are skipped
+10. Set browserless=False to drive Firefox as before, e.g. if the site starts to need
+JavaScript for the download
+11. Both ways try every option in the drop down after the blank first one (the
+original script also left out the last option); years that give no file are skipped
+and listed under the state's skipped in _TIMINGS, so both fetch the same years
 """
 
-import os
-from selenium import webdriver
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.common.by import By
-from selenium.webdriver.firefox.options import Options
-from time import sleep
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from harvest import aspnet, browsers, session
 
 url='https://profiles.nche.seiservices.com/StateProfile.aspx?StateID={}'
 
@@ -38,40 +54,61 @@ states={1: 'alaska', 2: 'alabama', 3: 'arkansas', 5: 'arizona',
         59: 'wyoming', 60: 'bureau_of_indian_education'}
 
 outfolder='downloaded-2025-03-29'
+browserless=True # post the form over plain HTTP instead of driving Firefox
+workers=4
+headless=True
+FIRST=1 # drop down option 0 is blank, every option after it is a year
+
+def post_state(state,sid,timing):
+    statepath=os.path.join(outfolder,state)
+    if not os.path.exists(statepath):
+        os.makedirs(statepath)
+    with browsers.stage(timing,'load'):
+        form=aspnet.Form.load(url.format(sid))
+    timing['files']=0
+    with browsers.stage(timing,'download'):
+        for value,text in form.values('MainContent_ddlConsolidatedSPR')[FIRST:]:
+            got=aspnet.download(form,{'MainContent_ddlConsolidatedSPR':value},'MainContent_btndownload',statepath)
+            if got is not None:
+                timing['files']=timing['files']+1
+            else:
+                timing.setdefault('skipped',[]).append(text)
 
-for k,v in states.items():
-    statepath=os.path.join(outfolder,v)
-    abspath=os.path.abspath(statepath)
-    options = Options()
-    options.set_preference("browser.download.folderList", 2)
-    options.set_preference("browser.download.manager.showWhenStarting", False)
-    options.set_preference("browser.download.dir",r"{}".format(abspath)) # INSERT PATH HERE
-    options.set_preference("browser.helperApps.neverAsk.saveToDisk", "application/x-gzip")
-    browser=webdriver.Firefox(options=options)
-    page=url.format(k)
-    browser.get(page) # Load page, wait to render
-    browser.implicitly_wait(10)
-    sleep(10)      
-    dropdown = Select(browser.find_element(By.ID, "MainContent_ddlConsolidatedSPR"))
-    options = dropdown.options # Get dropdown menu and list of options
-    
-    for index in range(1, len(options) - 1): # cycle through options, first one at 0 is blank      
-        dropdown.select_by_index(index) # select option by index / order in options list
-        sleep(5)
-        # Find download button and hit it
-        download = browser.find_element(By.ID, "MainContent_btndownload")
-        browser.execute_script("arguments[0].click();", download)
-        sleep(5)
-        if len(browser.window_handles)>1: # Return to previous tab
-            browser.switch_to.window(browser.window_handles[1])
-        else: # Unless there is only one tab
-            pass
+def download_state(browser,state,sid,timing):
+    from selenium.webdriver.support.ui import Select
+    statepath=os.path.abspath(os.path.join(outfolder,state))
+    if not os.path.exists(statepath):
+        os.makedirs(statepath)
+    browsers.set_download_dir(browser,statepath)
+    page=url.format(sid)
+    with browsers.stage(timing,'load'):
         browser.get(page)
-        browser.implicitly_wait(10)
-        # Find the dropdown again for the next iteration
-        dropdown = Select(browser.find_element(By.ID, "MainContent_ddlConsolidatedSPR"))
-        sleep(5)
-    print('Downloaded files for',v)
-    browser.quit()
-    
+        options=Select(browsers.wait_for(browser,'MainContent_ddlConsolidatedSPR')).options
+    timing['files']=0
+    for index in range(FIRST, len(options)): # cycle through options, see note 11
+        with browsers.stage(timing,'select'):
+            dropdown=Select(browsers.wait_for(browser,'MainContent_ddlConsolidatedSPR'))
+            dropdown.select_by_index(index) # select option by index / order in options list
+            year=dropdown.options[index].text
+            download=browsers.wait_for(browser,'MainContent_btndownload',clickable=True)
+        before=browsers.listing(statepath)
+        try:
+            with browsers.stage(timing,'download'):
+                browser.execute_script("arguments[0].click();", download)
+                timing['files']=timing['files']+len(browsers.wait_for_download(statepath,before))
+        except browsers.DownloadTimeout: # no report for this year, see note 5, go on to the next
+            timing.setdefault('skipped',[]).append(year)
+        browsers.close_extra_windows(browser) # Return to the page if a tab opened
+        with browsers.stage(timing,'load'):
+            browser.get(page)
+            browsers.wait_for(browser,'MainContent_ddlConsolidatedSPR')
 
+tasks=[(v,k) for k,v in states.items()]
+if browserless:
+    session.configure(pool_maxsize=workers)
+    timings,errors=browsers.run_timed(tasks,post_state,workers)
+else:
+    timings,errors=browsers.run(tasks,download_state,workers,headless)
+browsers.write_timings(outfolder,timings,errors)
+print('Downloaded {} files for {} states'.format(sum(t.get('files',0) for t in timings.values()),
+                                                 len(timings)-len(errors)))
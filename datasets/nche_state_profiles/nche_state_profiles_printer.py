@@ -14,16 +14,22 @@ Notes:
 8. Dictionary of IDs and state names was carried over into downloader script
 9. The national page and funding allocation sheets were downloaded manually
 10. Number of records in the metadata file was added manually
+11. Pages are now printed by a pool of headless browsers that stay open for the whole
+run (harvest/browsers.py), workers at a time; a headless browser has no print dialog,
+so each page is saved with WebDriver's print to PDF under the same default name the
+dialog used (the page title), which the renamer script still expects
+12. Waits for the print button to be on the page instead of fixed sleeps; seconds spent
+loading and printing each state are printed and saved to _TIMINGS-<date>.json, and the
+number of PDFs saved goes in the metadata file
 """
 
-import requests, os
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.firefox.options import Options
+import requests, os, sys, base64
 from datetime import date
-from time import sleep
 from bs4 import BeautifulSoup as soup
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from harvest import session, browsers
+
 url='https://profiles.nche.seiservices.com/StateProfile.aspx?StateID={}'
 dataurl='https://profiles.nche.seiservices.com/ConsolidatedStateProfile.aspx'
 dataset='NCHE State Profiles'
@@ -31,6 +37,8 @@ person='Frank Donnelly, Head of GIS & Data Services, Brown University Library'
 
 today = str(date.today())
 outfolder='downloaded-'+today
+workers=4
+headless=True
 if not os.path.exists(outfolder):
     os.makedirs(outfolder)
 
@@ -53,7 +61,7 @@ pids=[1, 2, 3, 5, 6, 7, 8, 9, 10, 11, 13, 15, 16, 17, 18, 19, 20,
 states={}
 for p in pids:
     try: # Soup to get name of state from h1 to create folder
-        webpage=requests.get(url.format(p)).content
+        webpage=session.get(url.format(p)).content
         soup_page=soup(webpage,'html.parser')
         page_title = soup_page.title.text
         container=soup_page.find('div', class_='col-1-1') # has header with state name
@@ -63,30 +71,30 @@ for p in pids:
         statepath=os.path.join(outfolder,state)
         if not os.path.exists(statepath):
             os.makedirs(statepath)
-        abspath=os.path.abspath(statepath)
-   
-        options = Options()
-        options.set_preference("browser.download.folderList", 2)
-        options.set_preference("browser.download.manager.showWhenStarting", False)
-        options.set_preference("browser.download.dir",r"{}".format(abspath))
-        options.set_preference("browser.helperApps.neverAsk.saveToDisk", "application/x-gzip")
-        browser=webdriver.Firefox(options=options)
-        page=url.format(p)
-        browser.get(page)
-        browser.implicitly_wait(10)
-        sleep(10)
-        # Find the print button and click it
-        pbutton = browser.find_element(By.ID, "MainContent_btnConvertToPDF1")
-        browser.execute_script("arguments[0].click();", pbutton) 
-        browser.implicitly_wait(10)
-        browser.close()
     except requests.exceptions.RequestException as e:
         print('Could not retrieve page',p,'because of',e)
-        
+
+def print_state(browser,state,pid,timing):
+    statepath=os.path.join(outfolder,state)
+    with browsers.stage(timing,'load'):
+        browser.get(url.format(pid))
+        browsers.wait_for(browser,'MainContent_btnConvertToPDF1') # page has rendered
+    with browsers.stage(timing,'print'):
+        pdf=base64.b64decode(browser.print_page())
+        pdfpath=os.path.join(statepath,browser.title+'.pdf')
+        with open(pdfpath+'.tmp','wb') as writefile:
+            writefile.write(pdf)
+        os.replace(pdfpath+'.tmp',pdfpath)
+    timing['files']=1
+
+timings,errors=browsers.run([(v,k) for k,v in states.items()],print_state,workers,headless)
+browsers.write_timings(outfolder,timings,errors)
+printed=sum(t.get('files',0) for t in timings.values())
+
 metafile = "_METADATA-{}.txt".format(today)
 writefile=open(os.path.join(outfolder,metafile),'w')
 writefile.write(dataset+'\n') 
-writefile.write('X files archived on {}\n'.format(today))
+writefile.write('{} files archived on {}\n'.format(printed,today))
 writefile.write('From webpage {}\n'.format(page_title)) 
 writefile.write('At {}\n'.format(dataurl))  
 writefile.write('By {}'.format(person))  
@@ -9,11 +9,19 @@ NIEHS Climate Change and Human Health Literature Portal
 Bibliographic database
 
 March 11, 2025
+
+Also writes niehs_cchhlp.parquet if pyarrow is installed: typed columns, dictionary
+encoded strings, zstd compression, sorted by year_published so row-group statistics
+let filtered reads skip most of the file
 """
 
+import os, sys
 import pandas as pd
 import sqlite3
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from harvest import columnar
+
 cols={'reference_id':'reference_id',
       'reference_type':'reference_type',
       'reference_title':'title',
@@ -56,4 +64,11 @@ df_new.to_csv('niehs_cchhlp.csv',sep=',',na_rep='',index=False)
 
 conn = sqlite3.connect('niehs_cchhlp.sqlite')
 df_new.to_sql('bibliography',conn,index=False)
-conn.close()
\ No newline at end of file
+conn.close()
+
+if columnar.have_pyarrow():
+    df_pq=df_new.copy()
+    df_pq['year_published']=pd.to_numeric(df_pq['year_published'],errors='coerce').astype('Int64')
+    columnar.write_dataframe(df_pq,'niehs_cchhlp.parquet',sort_by=['year_published'],row_group_size=5000)
+else:
+    print('pyarrow is not installed, skipped niehs_cchhlp.parquet')
\ No newline at end of file
@@ -13,25 +13,62 @@ Notes:
 5. A page with dataset updates must be captured separately
 6. Subfolders are created to store data for each page (but not subdivided by state)
 7. Metadata with item counts, webpages, and errors are stored in the subfolders
+(page_scrape, save_page and write_metadata are shared, see harvest/pages.py)
 8. Wetlands page has no text file listing, uses relative links to zips stored in the page
 9. Metadata from the home page not created from function as there is no data or file count
 10. One of the state pages uses different abbreviations and is treated as exception
 11. Select documentation is downloaded separately from a list of urls
-12. TEMPCOUNT variable lines in the downloads function can be uncommented for debugging
+12. Files are downloaded in parallel by the harvest pool; workers sets the overall
+number of connections, per_host the limit for any one server (workers=1 is serial)
+13. Set testcount to a number to only grab that many files per subfolder when debugging
+14. Files are written as .part and renamed when complete; rerunning on the same day
+resumes any .part left by an interrupted run with a Range request
+15. With incremental=True, files unchanged since the previous downloaded-* folder
+are hardlinked from it instead of downloaded again (see harvest/snapshots.py)
+16. Every file is hashed as it downloads; manifest-sha256.txt and _MANIFEST.tsv in the
+download folder list path, size, sha256, source url and validators for all subfolders
+17. ZIPs are checked (central directory and CRCs) in the background as they land;
+failures are fetched again, results go in _ARCHIVES.json and each _METADATA file
+18. With preflight=True every list is resolved first and each file gets a HEAD request:
+total and per-product bytes are printed and checked against free disk space, and the
+largest files are downloaded first (see harvest/plan.py); plan_only=True stops there
+19. All URLlist_*.txt files are fetched concurrently and saved with their validators
+in _DISCOVERY.json; a rerun the same day reuses them and a new snapshot only refetches
+lists that changed (see harvest/discovery.py)
+20. Pages are scraped first to set up each subfolder; then, unless preflight is on,
+files go onto a bounded download queue as soon as their list arrives, so downloading
+starts while discovery is still running (see harvest/products.py)
 """
 
-import requests, os
-from bs4 import BeautifulSoup as soup
+import os, sys
 from datetime import date
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from harvest import session, snapshots
+from harvest.archives import ArchiveChecker
+from harvest.manifest import Manifest
+from harvest.pages import page_scrape, save_page, write_metadata
+from harvest.products import harvest_products
+
 url='https://coast.noaa.gov/slrdata/index.html'
 dataset='NOAA Coast Sea Level Rise Viewer'
 person='Frank Donnelly, Head of GIS & Data Services, Brown University Library'
 today = str(date.today())
 
+workers=8 # total simultaneous downloads
+per_host=4 # simultaneous downloads from any one server
+testcount=None # stop after this many files per subfolder (shared by the lists saved there), for debugging
+incremental=True # link files unchanged since the last snapshot instead of downloading
+preflight=False # HEAD every file first to size the run and download largest first
+plan_only=False # print the plan and stop
+
 outfolder='downloaded-'+today
 if not os.path.exists(outfolder):
     os.makedirs(outfolder)
+tracker=snapshots.Incremental(outfolder) if incremental else None
+manifest=Manifest(outfolder,snapshots.previous_snapshot(outfolder))
+archives=ArchiveChecker(outfolder)
+session.configure(pool_maxsize=workers)
     
 
 url_update='https://coast.noaa.gov/slr/#/updates/data/'
@@ -73,14 +110,6 @@ states_alt=['AK','AL','AS','CA','CT','DC','DE','FL','GA','Guam','HI','LA','MA','
   
 # SCRAPE
 
-def create_filelist(filepage):
-    'Takes list of files in text file pages and saves them in a list'
-    response = requests.get(filepage)
-    filelist = response.text.split('\n')
-    if filelist[-1]=="":
-        del filelist[-1]
-    return filelist
-
 def get_other_links(extra_links,fileformat): 
     'Grabs other files on a page outside the text file listing'
     other_links=[]
@@ -90,32 +119,6 @@ def get_other_links(extra_links,fileformat):
                 other_links.append(lnk.attrs['href'])
     return other_links
     
-def download_data(datalinks,outpath,page_title):
-    'Downloads data'
-    # TESTCOUNT=0
-    i = 0 
-    errors={}
-    for d in datalinks:
-        try:
-            with requests.get(d, stream=True) as response:
-                response.raise_for_status()
-                fname=os.path.split(d)[1]
-                filepath=os.path.join(outpath,fname)
-                with open(filepath, 'wb') as writefile:
-                    for chunk in response.iter_content(chunk_size=10000000):
-                        writefile.write(chunk)
-            i=i+1
-            # TESTCOUNT=TESTCOUNT+1
-            print('Downloaded',fname)
-        except requests.exceptions.RequestException as e:
-            print('Could not retrieve',d,'because of',e)
-            errors[d]=e
-        # finally:
-        #     if TESTCOUNT==2:
-        #         break
-    print('Finished downloading',i,'files from',page_title)
-    return i, errors
-
 def make_subfolder(url,downfolder):
     'Creates subfolders to mirror whats on the website'
     subfolder=url.split('/')[-2]
@@ -124,48 +127,10 @@ def make_subfolder(url,downfolder):
         os.makedirs(newpath)
     return newpath
     
-def page_scrape(url):
-    'Initial page scrape, to save the page and non-text file links'
-    webpage=requests.get(url).content
-    soup_page=soup(webpage,'html.parser')
-    page_title = soup_page.title.text
-    container=soup_page.find('body')
-    links=container.findAll('a')
-    return webpage,page_title,links
-
-def save_page(url,path,webpage):
-    'Saves the page as plain html'
-    webfile = '_WEBPAGE-{}.html'.format(today)
-    writefile=open(os.path.join(path,webfile),'wb')
-    writefile.write(webpage)
-    writefile.close()
-    
-def write_metadata(dataset,person,page_title,url,counter,errors,outpath):
-    'Writes metadata files and error lists'
-    metafile = "_METADATA-{}.txt".format(today)
-    writefile=open(os.path.join(outpath,metafile),'w')
-    writefile.write(dataset+'\n') 
-    writefile.write('{} files archived on {}\n'.format(counter,today))
-    writefile.write('From webpage {}\n'.format(page_title)) 
-    writefile.write('At {}\n'.format(url))  
-    writefile.write('By {}'.format(person))  
-    writefile.close() 
-
-    efile = "_ERRORS-{}.txt".format(today)
-    epath=os.path.join(outfolder,efile)
-    if os.path.exists(efile):
-        os.remove(efile)
-    if len(errors)>0:
-        writefile=open(epath,'w')
-        writefile.write('Download Errors for {}\n'.format(page_title))
-        for ek,ev in errors.items():
-            writefile.write('{}: {}\n'.format(ek,ev))
-        writefile.close()
-    
 # SAVE HOME PAGE
 
 webpage,home_title,links=page_scrape(url)
-save_page(url,outfolder,webpage)
+save_page(url,outfolder,webpage,manifest=manifest)
 
 metafile = "_METADATA-{}.txt".format(today)
 writefile=open(os.path.join(outfolder,metafile),'w')
@@ -180,89 +145,76 @@ writefile.close()
 
 webpage,page_title,links=page_scrape(url_update)
 subpath=make_subfolder(os.path.split(url_update)[0],outfolder)
-save_page(url,subpath,webpage)
+save_page(url,subpath,webpage,manifest=manifest)
 
-all_links=[]
+products=[] # (page url, subfolder, page title, URLlist urls, other file urls)
 
 # SAVE DOCUMENTS
 
 subpath=make_subfolder('documentation/documentation',outfolder)
-counter,errors=download_data(url_docs,subpath,'SLR Documentation')
-write_metadata(dataset,person,'SLR Documentation','https://coast.noaa.gov/slr/#/layer/slr',counter,errors,subpath)
-
-all_links.extend(url_docs)
+products.append(('https://coast.noaa.gov/slr/#/layer/slr',subpath,'SLR Documentation',[],url_docs))
     
 # SAVE DATA NOT SUBDIVIDED BY STATE
 
 for k,v in urls_no_states.items():
     webpage,page_title,links=page_scrape(k)
     subpath=make_subfolder(k,outfolder)
-    save_page(k,subpath,webpage)
-    datalinks=create_filelist(v)
+    save_page(k,subpath,webpage,manifest=manifest)
     extralinks=get_other_links(links,'.pdf')
-    if len(extralinks) > 1:
-        datalinks.extend(extralinks)
-    counter,errors=download_data(datalinks,subpath,page_title)
-    write_metadata(dataset,person,page_title,k,counter,errors,subpath)
-
-    all_links.extend(datalinks)
+    if len(extralinks) <= 1:
+        extralinks=[]
+    products.append((k,subpath,page_title,[v],extralinks))
 
 # SAVE DATA SUBDIVIDED BY TIDES
 
 for k,v in url_high_tide.items():
     webpage,page_title,links=page_scrape(k)
     subpath=make_subfolder(k,outfolder)
-    save_page(k,subpath,webpage)
-    tidelinks=[]
-    for t in tides:
-        tlink=v.format(t,t)
-        datalinks=create_filelist(tlink)
-        tidelinks.extend(datalinks)
+    save_page(k,subpath,webpage,manifest=manifest)
+    tidelists=[v.format(t,t) for t in tides]
     extralinks=get_other_links(links,'.pdf')
-    if len(extralinks)>0:
-        tidelinks.extend(extralinks)   
-    counter,errors=download_data(tidelinks,subpath,page_title)
-    write_metadata(dataset,person,page_title,k,counter,errors,subpath)
-
-    all_links.extend(tidelinks) 
+    products.append((k,subpath,page_title,tidelists,extralinks))
 
 # SAVE DATA SUBDIVIDED BY STATE
 
 for k,v in urls_states.items():
     webpage,page_title,links=page_scrape(k)
     subpath=make_subfolder(k,outfolder)
-    save_page(k,subpath,webpage)
+    save_page(k,subpath,webpage,manifest=manifest)
     if k=='https://coast.noaa.gov/slrdata/Mapping_Confidence/index.html':
         slist=states_alt
     else:
         slist=states
-    statelinks=[]
-    for s in slist:
-        slink=v.format(s,s)
-        datalinks=create_filelist(slink)
-        statelinks.extend(datalinks)
+    statelists=[v.format(s,s) for s in slist]
     extralinks=get_other_links(links,'.pdf')
-    if len(extralinks)>0:
-        statelinks.extend(extralinks)   
-    counter,errors=download_data(statelinks,subpath,page_title)
-    write_metadata(dataset,person,page_title,k,counter,errors,subpath)
-
-    all_links.extend(statelinks)  
+    products.append((k,subpath,page_title,statelists,extralinks))
 
 # SAVE DATA FOR WETLANDS
 
 webpage,page_title,links=page_scrape(url_wetland)
 subpath=make_subfolder(url_wetland,outfolder)
-save_page(url_wetland,subpath,webpage)
+save_page(url_wetland,subpath,webpage,manifest=manifest)
 relativelinks=get_other_links(links,'.zip')
 rootpath=os.path.split(url_wetland)[0]
 datalinks=[]
 for r in relativelinks:
     abslink=os.path.join(rootpath,r)
     datalinks.append(abslink)
-counter,errors=download_data(datalinks,subpath,page_title)
-write_metadata(dataset,person,page_title,url_wetland,counter,errors,subpath)
-
-all_links.extend(datalinks)
-
+products.append((url_wetland,subpath,page_title,[],datalinks))
+
+# DISCOVER AND DOWNLOAD
+
+results=harvest_products(products,outfolder,workers,per_host,testcount,tracker,manifest,archives,
+                         preflight,plan_only)
+if results is None:
+    sys.exit()
+for k,subpath,page_title,lists,extras in products:
+    counter,errors=results[subpath]
+    write_metadata(dataset,person,page_title,k,counter,errors,subpath,archives=archives.summary(subpath))
+
+archives.close()
+print(archives.summary())
+if tracker is not None:
+    print(tracker.summary())
+session.report()
 print('FINISHED DOWNLOADING DATA FOR',dataset)
\ No newline at end of file
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for harvest/columnar.py
+Brown University Library, GIS & Data Services
+
+Usage, from the datasets folder:
+python -m pytest tests
+"""
+
+import os, random
+import pytest
+from harvest import columnar
+
+pq=pytest.importorskip('pyarrow.parquet')
+
+def test_batches_sorted_across_the_file(tmp_path):
+    path=str(tmp_path/'indicators.parquet')
+    ids=['IND{:03d}'.format(i) for i in range(100)]*5
+    random.Random(1).shuffle(ids)
+    writer=columnar.BatchWriter(path,['SurveyId','IndicatorId'],row_group_size=50)
+    for start in range(0,len(ids),70): # batches cut across the row groups
+        writer.write([{'IndicatorId':i,'Value':float(n)} for n,i in enumerate(ids[start:start+70],start)])
+    writer.close()
+    table=pq.read_table(path)
+    assert table.column('IndicatorId').to_pylist()==sorted(ids)
+    assert sorted(table.column('Value').to_pylist())==[float(n) for n in range(len(ids))]
+    meta=pq.ParquetFile(path).metadata
+    assert meta.num_row_groups==10
+    ranges=[(meta.row_group(g).column(0).statistics.min,meta.row_group(g).column(0).statistics.max)
+            for g in range(meta.num_row_groups)]
+    assert all(a[1]<=b[0] for a,b in zip(ranges,ranges[1:])) # no two groups overlap
+    assert os.listdir(tmp_path)==['indicators.parquet']
+
+def test_abort_leaves_nothing(tmp_path):
+    path=str(tmp_path/'indicators.parquet')
+    writer=columnar.BatchWriter(path,['IndicatorId'])
+    writer.write([{'IndicatorId':'A','Value':1.0}])
+    writer.abort()
+    assert os.listdir(tmp_path)==[]
+
+def test_unknown_key_in_later_batch_raises(tmp_path):
+    path=str(tmp_path/'indicators.parquet')
+    writer=columnar.BatchWriter(path,['IndicatorId'])
+    writer.write([{'IndicatorId':'A','Value':1.0}])
+    with pytest.raises(ValueError):
+        writer.write([{'IndicatorId':'B','Value':2.0,'Note':'revised'}])
+    writer.abort()
+    assert os.listdir(tmp_path)==[]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for harvest/fetch.py
+Brown University Library, GIS & Data Services
+
+Usage, from the datasets folder:
+python -m pytest tests
+"""
+
+import io, errno
+import pytest
+import requests
+from harvest import fetch
+
+class Raw:
+    'Stands in for a urllib3 response whose body comes from fp'
+    def __init__(self,fp):
+        self._fp=fp
+
+class Response:
+    def __init__(self,fp):
+        self.raw=Raw(fp)
+        self.headers={}
+        self.url='http://files.example/data.zip'
+
+class Dropped(io.BytesIO):
+    'A body whose connection drops after the first read'
+    def __init__(self):
+        super().__init__(b'x'*100)
+        self.reads=0
+    def readinto(self,buffer):
+        self.reads=self.reads+1
+        if self.reads>1:
+            raise ConnectionResetError(errno.ECONNRESET,'reset by peer')
+        return super().readinto(buffer)
+    def isclosed(self):
+        return False
+
+class FullDisk:
+    def write(self,data):
+        raise OSError(errno.ENOSPC,'No space left on device')
+
+def test_write_error_is_not_a_network_error():
+    with pytest.raises(OSError) as raised:
+        fetch.stream_into(Response(io.BytesIO(b'x'*100)),FullDisk())
+    assert not isinstance(raised.value,requests.exceptions.RequestException)
+    assert raised.value.errno==errno.ENOSPC
+
+def test_read_error_is_a_network_error():
+    writefile=io.BytesIO()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        fetch.stream_into(Response(Dropped()),writefile)
+    assert writefile.getvalue()==b'x'*100
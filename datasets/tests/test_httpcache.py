@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for harvest/httpcache.py
+Brown University Library, GIS & Data Services
+
+Usage, from the datasets folder:
+python -m pytest tests
+"""
+
+import threading, http.server
+import pytest
+from harvest import httpcache, session
+
+class RedirectHandler(http.server.BaseHTTPRequestHandler):
+    'Sends /old to /new, which answers with a page'
+    protocol_version='HTTP/1.1'
+    hits=[]
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        if self.path=='/old':
+            self.send_response(302)
+            self.send_header('Location','/new')
+            self.send_header('Content-Length','0')
+            self.end_headers()
+        else:
+            body=b'<html>moved here</html>'
+            self.send_response(200)
+            self.send_header('Content-Type','text/html')
+            self.send_header('Content-Length',str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self,*args):
+        pass
+
+@pytest.fixture
+def server():
+    RedirectHandler.hits=[]
+    httpd=http.server.ThreadingHTTPServer(('127.0.0.1',0),RedirectHandler)
+    threading.Thread(target=httpd.serve_forever,daemon=True).start()
+    yield 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_replay_follows_redirect(server,tmp_path):
+    recorder=session.build_session(cache=httpcache.HttpCache('record',str(tmp_path)))
+    live=recorder.get(server+'/old')
+    assert live.url==server+'/new' and live.status_code==200
+    assert RedirectHandler.hits==['/old','/new']
+
+    cache=httpcache.HttpCache('replay',str(tmp_path))
+    replayed=session.build_session(cache=cache).get(server+'/old')
+    assert replayed.status_code==200
+    assert replayed.url==server+'/new'
+    assert replayed.content==live.content
+    assert [r.status_code for r in replayed.history]==[302]
+    assert cache.hits==2
+    assert RedirectHandler.hits==['/old','/new'] # nothing went to the server
+
+def test_replay_miss_still_raises(server,tmp_path):
+    replayer=session.build_session(cache=httpcache.HttpCache('replay',str(tmp_path)))
+    with pytest.raises(httpcache.CacheMiss):
+        replayer.get(server+'/old')
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for harvest/jsonstream.py
+Brown University Library, GIS & Data Services
+
+Usage, from the datasets folder:
+python -m pytest tests
+"""
+
+import json
+import pytest
+from harvest import jsonstream
+
+ITEMS=[{'a':[1,2,{'b':'x, ]'}]},12345678901234,-1.5e10,3e-7,'s',None,True,[]]
+
+@pytest.mark.parametrize('indent',[None,4])
+def test_array_items_across_block_edges(tmp_path,indent):
+    path=str(tmp_path/'items.json')
+    with open(path,'w') as writefile:
+        writefile.write('  '+json.dumps(ITEMS,indent=indent)+'\n')
+    for blocksize in range(1,40): # every item and number cut at every point
+        assert list(jsonstream.iter_json_array(path,blocksize))==ITEMS
+
+def test_writer_reads_back(tmp_path):
+    path=str(tmp_path/'records.json')
+    writer=jsonstream.open_writer(path)
+    writer.write([{'Value':1.5},{'Value':7}])
+    writer.write([])
+    assert writer.close()==2
+    assert list(jsonstream.iter_records(path))==[{'Value':1.5},{'Value':7}]
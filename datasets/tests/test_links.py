@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for harvest/links.py
+Brown University Library, GIS & Data Services
+
+Usage, from the datasets folder:
+python -m pytest tests
+"""
+
+import pytest
+from harvest import links
+
+PAGE=b'''<html><head><title>Sea Level Rise Data</title></head><body>
+<div class="usa-main-container"><a href="a.zip">A</a><br><a href="b.zip">B</a></div>
+<a href="outside.zip">C</a></body></html>'''
+
+def extractors():
+    found=['stream']
+    for name,module in (('soup','bs4'),('lxml','lxml')):
+        try:
+            __import__(module)
+            found.append(name)
+        except ImportError:
+            pass
+    return found
+
+@pytest.mark.parametrize('extractor',extractors())
+def test_container_links(extractor):
+    title,found=links.extract(PAGE,('div',{'class':'usa-main-container'}),extractor)
+    assert title=='Sea Level Rise Data'
+    assert [a.get('href') for a in found]==['a.zip','b.zip']
+
+@pytest.mark.parametrize('extractor',extractors())
+def test_missing_container_raises(extractor):
+    with pytest.raises(links.ContainerNotFound):
+        links.extract(PAGE,('table',{}),extractor)
+
+@pytest.mark.parametrize('extractor',extractors())
+def test_no_title(extractor):
+    title,found=links.extract(b'<html><body><table><a href="x.csv">x</a></table></body></html>',('table',{}),extractor)
+    assert title is None
+    assert [a.get('href') for a in found]==['x.csv']
+
+def test_page_scrape_names_untitled_page_by_url(monkeypatch):
+    from harvest import pages
+    class Response:
+        content=b'<html><body><a href="x.csv">x</a></body></html>'
+    monkeypatch.setattr(pages.session,'get',lambda url: Response())
+    webpage,title,found=pages.page_scrape('https://www.example.gov/data/')
+    assert title=='https://www.example.gov/data/'
+    assert [a.get('href') for a in found]==['x.csv']
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for usaid_dhs_indicators/usaid_dhs_ind_makecsv.py
+Brown University Library, GIS & Data Services
+
+Usage, from the datasets folder:
+python -m pytest tests
+"""
+
+import os, json, importlib.util
+import pytest
+import pandas as pd
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+SCRIPT=os.path.join(HERE,os.pardir,'usaid_dhs_indicators','usaid_dhs_ind_makecsv.py')
+
+@pytest.fixture
+def makecsv(monkeypatch):
+    'The script as a module, streaming every file in small batches so a fixture spans several'
+    spec=importlib.util.spec_from_file_location('usaid_dhs_ind_makecsv',SCRIPT)
+    module=importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module,'BATCH',7)
+    monkeypatch.setattr(module,'WHOLE',0)
+    return module
+
+def records():
+    'DHS-like records whose column types only show across batches'
+    recs=[]
+    for i in range(30):
+        recs.append({'SurveyId':'AF2015DHS','IndicatorId':'FE_FRTR_W_TFR',
+                     'Value':7.0 if i<10 else i/4, # whole floats first, fractions later
+                     'DenominatorWeighted':float(11999+i), # whole numbers only
+                     'DenominatorUnweighted':None if i==20 else 11999+i, # ints with a null
+                     'CILow':'' if i%5 else None,
+                     'ByVariableId':str(i*1000), # numeric strings
+                     'CharacteristicLabel':'Total' if i%2 else str(i),
+                     'IsTotal':i%3==0,
+                     'Precision':1})
+    del recs[25]['Precision'] # a field some records leave out
+    return recs
+
+def baseline(jfile):
+    return pd.read_json(jfile,lines=jfile.endswith('.ndjson')).to_csv(index=False)
+
+@pytest.mark.parametrize('suffix',['.json','.ndjson'])
+def test_convert_matches_read_json(makecsv,tmp_path,suffix):
+    jfile=str(tmp_path/('indicators'+suffix))
+    with open(jfile,'w') as writefile:
+        if suffix=='.json':
+            json.dump(records(),writefile)
+        else:
+            writefile.writelines(json.dumps(r)+'\n' for r in records())
+    count,size=makecsv.convert(jfile)
+    assert count==30
+    with open(makecsv.csv_path(jfile)) as readfile:
+        assert readfile.read()==baseline(jfile)
+
+def test_empty_file(makecsv,tmp_path):
+    jfile=str(tmp_path/'empty.json')
+    with open(jfile,'w') as writefile:
+        writefile.write('[]')
+    assert makecsv.convert(jfile)[0]==0
+    with open(makecsv.csv_path(jfile)) as readfile:
+        assert readfile.read()==baseline(jfile)
+
+def test_parquet_keeps_late_columns(makecsv,tmp_path):
+    pq=pytest.importorskip('pyarrow.parquet')
+    jfile=str(tmp_path/'indicators.json')
+    recs=records()
+    recs[-1]['Note']='revised' # first seen in the last batch
+    with open(jfile,'w') as writefile:
+        json.dump(recs,writefile)
+    makecsv.convert(jfile,parquet=True)
+    table=pq.read_table(makecsv.csv_path(jfile,'.parquet'))
+    assert table.column_names==list(pd.read_csv(makecsv.csv_path(jfile)).columns)
+    assert table.column('Note').to_pylist().count('revised')==1
+    assert table.num_rows==30
+
+def test_empty_file_is_current_with_parquet(makecsv,tmp_path):
+    pytest.importorskip('pyarrow.parquet')
+    jfile=str(tmp_path/'empty.json')
+    with open(jfile,'w') as writefile:
+        writefile.write('[]')
+    makecsv.convert(jfile,parquet=True)
+    assert makecsv.is_current(jfile,parquet=True)
+
+def test_small_file_read_whole(makecsv,tmp_path,monkeypatch):
+    monkeypatch.setattr(makecsv,'WHOLE',1000000)
+    jfile=str(tmp_path/'indicators.json')
+    with open(jfile,'w') as writefile:
+        json.dump(records(),writefile)
+    assert makecsv.convert(jfile)[0]==30
+    with open(makecsv.csv_path(jfile)) as readfile:
+        assert readfile.read()==baseline(jfile)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for harvest/pool.py
+Brown University Library, GIS & Data Services
+
+Usage, from the datasets folder:
+python -m pytest tests
+"""
+
+import threading, errno
+from harvest import pool
+
+class Fetch:
+    'Stands in for fetch_file, counts the urls it is asked for'
+    def __init__(self):
+        self.urls=[]
+        self.lock=threading.Lock()
+
+    def __call__(self,url,outpath,incremental=None,manifest=None):
+        with self.lock:
+            self.urls.append(url)
+        return 10
+
+def test_pipeline_fetches_one_url_per_file_name(tmp_path):
+    fetch=Fetch()
+    pipe=pool.Pipeline(workers=4,fetch=fetch)
+    outpath=str(tmp_path)
+    pipe.add_group(outpath,'Test page')
+    for url in ['http://a.example/list/data.zip','http://a.example/extra/data.zip',
+                'http://a.example/list/data.zip','http://a.example/list/other.zip']:
+        pipe.put(url,outpath)
+    counts=pipe.join()
+    assert sorted(fetch.urls)==['http://a.example/list/data.zip','http://a.example/list/other.zip']
+    assert counts[outpath]==(2,{})
+
+def test_download_all_fetches_one_url_per_file_name(tmp_path):
+    fetch=Fetch()
+    count,errors=pool.download_all(['http://a.example/list/data.zip','http://a.example/extra/data.zip'],
+                                   str(tmp_path),'Test page',fetch=fetch)
+    assert fetch.urls==['http://a.example/list/data.zip']
+    assert (count,errors)==(1,{})
+
+def test_write_error_is_that_urls_error(tmp_path):
+    class Full(Fetch):
+        def __call__(self,url,outpath,incremental=None,manifest=None):
+            if url.endswith('full.zip'):
+                raise OSError(errno.ENOSPC,'No space left on device')
+            return super().__call__(url,outpath)
+    urls=['http://a.example/data.zip','http://a.example/full.zip','http://a.example/other.zip']
+    count,errors=pool.download_all(urls,str(tmp_path),'Test page',fetch=Full())
+    assert count==2
+    assert list(errors)==['http://a.example/full.zip']
+    assert errors['http://a.example/full.zip'].errno==errno.ENOSPC
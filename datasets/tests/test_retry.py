@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for harvest/retry.py
+Brown University Library, GIS & Data Services
+
+Usage, from the datasets folder:
+python -m pytest tests
+"""
+
+import time, threading
+import pytest
+import requests
+from harvest import retry
+
+URL='http://probe.example/file.zip'
+
+@pytest.fixture
+def breaker(monkeypatch):
+    'A fresh breaker that opens after one failure and probes after 0.2 s'
+    b=retry.CircuitBreaker(threshold=1,cooldown=0.2,probes=3)
+    monkeypatch.setattr(retry,'breaker',b)
+    monkeypatch.setattr(retry,'BACKOFF',0.01)
+    return b
+
+def open_circuit():
+    def refused(attempt):
+        raise requests.exceptions.ConnectionError('refused')
+    with pytest.raises(requests.exceptions.ConnectionError):
+        retry.call(URL,refused,attempts=1)
+
+def call_in_thread(fn):
+    'Runs retry.call in another thread, returns the thread and its result list'
+    result=[]
+    thread=threading.Thread(target=lambda: result.append(retry.call(URL,fn,attempts=1)),daemon=True)
+    thread.start()
+    return thread,result
+
+@pytest.mark.parametrize('error',[ValueError('local bug'),requests.exceptions.InvalidURL('bad url')])
+def test_probe_ending_in_other_error_releases_waiters(breaker,error):
+    open_circuit()
+    time.sleep(0.25) # past the cooldown, the next call is the probe
+    def broken(attempt):
+        raise error
+    with pytest.raises(type(error)):
+        retry.call(URL,broken,attempts=1)
+    assert breaker.state('probe.example')['probing'] is None
+    thread,result=call_in_thread(lambda attempt: 'ok')
+    thread.join(5)
+    assert not thread.is_alive()
+    assert result==['ok']
+
+def test_waiter_is_released_while_probe_fails(breaker):
+    open_circuit()
+    time.sleep(0.25)
+    started=threading.Event()
+    def slow_broken(attempt):
+        started.set()
+        time.sleep(0.2)
+        raise ValueError('local bug')
+    probe=threading.Thread(target=lambda: pytest.raises(ValueError,retry.call,URL,slow_broken,1),daemon=True)
+    probe.start()
+    started.wait(2)
+    thread,result=call_in_thread(lambda attempt: 'ok') # waits on the probe
+    probe.join(5)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert result==['ok']
+
+def test_permanent_error_outside_a_probe_leaves_breaker_closed(breaker):
+    def missing(attempt):
+        raise requests.exceptions.InvalidURL('bad url')
+    for i in range(3):
+        with pytest.raises(requests.exceptions.InvalidURL):
+            retry.call(URL,missing,attempts=1)
+    s=breaker.state('probe.example')
+    assert s['failures']==0 and not s['opened']
@@ -11,27 +11,53 @@ Notes:
 4. Max number of returned records is 5000 per page, have to cycle through each page
 5. The indicators data is SUMMARY data for countries and subdivisions; microdata is
 not publicly available
+6. In async mode page 1 of each survey breakdown is fetched to read TotalPages, then the
+remaining pages are fetched concurrently; a token bucket (rate requests per second)
+keeps the load on the API polite instead of sleeping 10-20 seconds after every survey
+7. Set async_mode=False for the original one-page-at-a-time loop
+8. Each page's records are appended to the survey file in page order as they arrive;
+a page counts against pages_held from the moment it is asked for until it is written,
+across all the breakdowns being fetched at once, so memory holds at most pages_held
+pages (16 x 5000 records by default) however many or large the surveys;
+json_format='ndjson' writes one record per line to .ndjson files instead of an
+indented JSON array
+9. Output is hashed as it is written; manifest-sha256.txt and _MANIFEST.tsv list the
+size, sha256 and source of every survey file
 """
 
-import requests, os, json, gc
+import requests, os, sys, asyncio
 from datetime import date
 from random import randint
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from harvest import session
+from harvest.ratelimit import TokenBucket
+from harvest.jsonstream import open_writer
+from harvest.manifest import Manifest
+from collections import deque
+
 dataset='USAID DHS Indicators'
 home_title='The DHS Program API'
 person='Frank Donnelly, Head of GIS & Data Services, Brown University Library'
 url='https://api.dhsprogram.com/'
 today = str(date.today())
 
+async_mode=True # fetch pages concurrently instead of one at a time
+rate=2 # requests per second to the API in async mode
+concurrency=8 # pages in flight at once in async mode
+pages_held=16 # pages requested but not yet written, across all breakdowns, in async mode
+json_format='array' # 'array' for indented JSON like before, 'ndjson' for one record per line
+
 outfolder='downloaded-'+today
 if not os.path.exists(outfolder):
     os.makedirs(outfolder)
+manifest=Manifest(outfolder)
 
 # GET LIST OF ALL SURVEYS
 surveys=[]    
 survey_url='http://api.dhsprogram.com/rest/dhs/surveys'
-response=requests.get(survey_url)
+response=session.get(survey_url)
 data=response.json()
 for record in data['Data']:
     surveys.append(record['SurveyId'])
@@ -41,50 +67,138 @@ surl='http://api.dhsprogram.com/rest/dhs/v8/data?surveyIds={}&breakdown={}&page=
 record_count={'Dataset':'Records'}
 
 # RETRIEVE AND DOWNLOAD DATA
-               
-i = 0 
-errors={}
-for s in surveys: # for every survey
-    for lev in levels: # for all three levels
-        sdata=[]
-        sfolder=os.path.join(outfolder,s)
-        if not os.path.exists(sfolder):
-            os.makedirs(sfolder)
-        try:
-            pnum=1
-            response = requests.get(surl.format(s,lev,pnum))
-            response.raise_for_status()
-            data=response.json()
-            data_flat=data['Data']
-            t_pages=data['TotalPages']
-            r_count=data['RecordCount']
-            sdata.extend(data_flat)
-            while t_pages>pnum: # Handles multiple pages
-                pnum=pnum+1
-                response = requests.get(surl.format(s,lev,pnum))
+
+def open_survey(s,lev):
+    'Starts the streamed output file for one survey breakdown'
+    sfolder=os.path.join(outfolder,s)
+    if not os.path.exists(sfolder):
+        os.makedirs(sfolder)
+    ext='ndjson' if json_format=='ndjson' else 'json'
+    sfile='{}_{}.{}'.format(s,lev,ext)
+    return open_writer(os.path.join(sfolder,sfile),json_format)
+
+def finish_survey(s,lev,writer,r_count):
+    'Closes the survey file and checks it against the API record count'
+    down_count=writer.close()
+    manifest.add(writer.path,writer.size,writer.sha256,surl.format(s,lev,'*'))
+    if down_count==r_count:    
+        print('Downloaded',down_count,'records from',s,lev)
+    else:
+        print('MISMATCH in downloaded',down_count,'versus retrieved',r_count,'record count for',s,lev)
+    return down_count
+
+def harvest_serial():
+    'Original loop, one page at a time with a pause after every survey'
+    i = 0 
+    errors={}
+    counts={}
+    for s in surveys: # for every survey
+        for lev in levels: # for all three levels
+            writer=open_survey(s,lev)
+            try:
+                pnum=1
+                response = session.get(surl.format(s,lev,pnum))
                 response.raise_for_status()
                 data=response.json()
-                data_flat=data['Data']
-                sdata.extend(data_flat)
-            sfile='{}_{}.json'.format(s,lev)
-            spath=os.path.join(sfolder,sfile)
-            with open(spath, 'w') as jfile:
-                json.dump(sdata, jfile, indent=4)
+                t_pages=data['TotalPages']
+                r_count=data['RecordCount']
+                writer.write(data['Data'])
+                while t_pages>pnum: # Handles multiple pages
+                    pnum=pnum+1
+                    response = session.get(surl.format(s,lev,pnum))
+                    response.raise_for_status()
+                    data=response.json()
+                    writer.write(data['Data'])
+                counts[s+' '+lev]=finish_survey(s,lev,writer,r_count)
+                i=i+1
+            except requests.exceptions.RequestException as e:
+                writer.abort()
+                print('Could not retrieve',s,lev,'because of',e)
+                errors[s+' '+lev]=e
+        time.sleep(randint(10,20))
+    return i, errors, counts
+
+async def get_page(s,lev,pnum,bucket,limit):
+    'One page of one survey breakdown, waits for a free slot and a token'
+    async with limit:
+        await bucket.wait()
+        response=await asyncio.to_thread(session.get,surl.format(s,lev,pnum))
+        response.raise_for_status()
+        return response.json()
+
+async def get_breakdown(s,lev,bucket,limit,active,held):
+    'Reads TotalPages from page 1, then fetches the rest concurrently, writing in page order'
+    async with active:
+        writer=open_survey(s,lev)
+        pending=deque()
+        holding=0 # pages of held taken by this breakdown
+        try:
+            await held.acquire()
+            holding=1
+            first=await get_page(s,lev,1,bucket,limit)
+            t_pages=first['TotalPages']
+            r_count=first['RecordCount']
+            await asyncio.to_thread(writer.write,first['Data'])
+            del first
+            held.release()
+            holding=0
+            pnum=2
+            while pnum<=t_pages or pending:
+                while pnum<=t_pages and len(pending)<concurrency:
+                    if pending and held.locked():
+                        break # write what is here rather than wait on other breakdowns
+                    await held.acquire()
+                    holding=holding+1
+                    pending.append(asyncio.create_task(get_page(s,lev,pnum,bucket,limit)))
+                    pnum=pnum+1
+                data=await pending.popleft()
+                await asyncio.to_thread(writer.write,data['Data'])
+                del data
+                held.release()
+                holding=holding-1
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            writer.abort()
+            raise
+        finally:
+            for n in range(holding):
+                held.release()
+        return await asyncio.to_thread(finish_survey,s,lev,writer,r_count)
+
+async def harvest_async():
+    'All surveys and breakdowns, bounded by concurrency, pages_held and the token bucket'
+    bucket=TokenBucket(rate)
+    limit=asyncio.Semaphore(concurrency)
+    active=asyncio.Semaphore(concurrency) # breakdowns being written at once
+    held=asyncio.Semaphore(pages_held) # pages in memory at once, see note 8
+    jobs=[(s,lev) for s in surveys for lev in levels]
+    results=await asyncio.gather(*[get_breakdown(s,lev,bucket,limit,active,held) for s,lev in jobs],
+                                 return_exceptions=True)
+    i = 0
+    errors={}
+    counts={}
+    for (s,lev),result in zip(jobs,results):
+        if isinstance(result,requests.exceptions.RequestException):
+            print('Could not retrieve',s,lev,'because of',result)
+            errors[s+' '+lev]=result
+        elif isinstance(result,BaseException):
+            raise result
+        else:
+            counts[s+' '+lev]=result
             i=i+1
-            down_count=len(sdata)
-            record_count[s+' '+lev]=down_count
-            if down_count==r_count:    
-                print('Downloaded',down_count,'records from',s,lev)
-            else:
-                print('MISMATCH in downloaded',down_count,'versus retrieved',r_count,'record count for',s,lev)
-            del(sdata)
-            gc.collect()           
-        except requests.exceptions.RequestException as e:
-            print('Could not retrieve',s,lev,'because of',e)
-            errors[s+' '+lev]=e
-    time.sleep(randint(10,20))
+    return i, errors, counts
+
+if async_mode:
+    session.configure(pool_maxsize=concurrency)
+    i,errors,counts=asyncio.run(harvest_async())
+else:
+    i,errors,counts=harvest_serial()
+record_count.update(counts)
+manifest.save()
 
 print('Finished downloading',i,'files from',url)
+session.report()
 
 # WRITE METADATA
 
@@ -12,19 +12,32 @@ Notes:
 6. Save the geometry data - more than 1 page is returned (max 5000 records), so must iterate
 7. The indicators data is SUMMARY data for countries and subdivisions; microdata is
 not publicly available
+8. Everything saved is hashed as it is written and added to the snapshot's
+manifest-sha256.txt and _MANIFEST.tsv
+9. Set cache to 'record' to keep API responses on disk between runs, or 'replay' to
+run offline from what was recorded (see harvest/httpcache.py)
 """
 
-import requests, os, json
+import requests, os, sys
 from datetime import date
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from harvest import fetch, session
+from harvest.jsonstream import open_writer
+from harvest.manifest import Manifest
+
 dataset='USAID DHS Indicators'
 home_title='The DHS Program API'
 person='Frank Donnelly, Head of GIS & Data Services, Brown University Library'
 today = str(date.today())
+cache=None # 'record' or 'replay'
 
 outfolder='downloaded-'+today
 if not os.path.exists(outfolder):
     os.makedirs(outfolder)
+manifest=Manifest(outfolder)
+if cache:
+    session.configure(cache=cache)
 
 intro_page='https://api.dhsprogram.com/'
 
@@ -50,10 +63,19 @@ pdfs=['https://www.dhsprogram.com/pubs/pdf/DHSG1/Guide_to_DHS_Statistics_DHS-8.p
 geo_url='http://api.dhsprogram.com/rest/dhs/geometry'
 
 def write_html(inpage,outfolder,outfile):
-    page=requests.get(inpage).content
-    writefile=open(os.path.join(outfolder,outfile),'wb')
-    writefile.write(page)
-    writefile.close()
+    page=session.get(inpage).content
+    tmp=os.path.join(outfolder,outfile+'.tmp') # never write through a store hardlink
+    with open(tmp,'wb') as writefile:
+        writefile.write(page)
+    os.replace(tmp,os.path.join(outfolder,outfile))
+    manifest.add_bytes(os.path.join(outfolder,outfile),page,inpage)
+
+def write_json(records,outpath,source):
+    'Writes records as indented JSON, hashing as it goes'
+    writer=open_writer(outpath)
+    writer.write(records)
+    writer.close()
+    manifest.add(outpath,writer.size,writer.sha256,source)
     
 docpath=os.path.join(outfolder,'_CODEBOOKS')
 if not os.path.exists(docpath):
@@ -64,41 +86,41 @@ write_html(citation_url+'?f=html',outfolder,'info_citation.html')
 write_html(fields_url,docpath,'data_fields.html')    
 
 for d in doc_urls:
-    response=requests.get(d)
+    response=session.get(d)
     metadata=response.json()
     data=metadata['Data']
     fname=d.split('/')[-1]+'.json'
     outpath=os.path.join(docpath,fname)
-    with open(outpath, 'w') as jfile:
-        json.dump(data, jfile, indent=4)
+    write_json(data,outpath,d)
     table=d.split('/')[-1]+'_fields.html'
     write_html(d+'/fields',docpath,table)
     
 for p in pdfs:
-    response = requests.get(p)
-    pname=p.split('/')[-1]
-    datafile = open(os.path.join(docpath,pname),'wb')
-    datafile.write(response.content)
-    datafile.close()
+    try:
+        fetch.fetch_file(p,docpath,manifest=manifest)
+    except requests.exceptions.RequestException as e:
+        print('Could not retrieve',p,'because of',e)
 
-gdata=[]
+gname=geo_url.split('/')[-1]+'.json'
+gfile=os.path.join(docpath,gname)
+gwriter=open_writer(gfile) # pages are appended as they arrive
 pnum=1    
-response=requests.get(geo_url+'?page={}'.format(pnum))
+response=session.get(geo_url+'?page={}'.format(pnum))
 geodata=response.json()
 geodata_flat=geodata['Data']
 t_pages=geodata['TotalPages']
-gdata.extend(geodata_flat)
+gwriter.write(geodata_flat)
 while t_pages>pnum: # Handles multiple pages
     pnum=pnum+1
-    response = requests.get(geo_url+'?page={}'.format(pnum))
+    response = session.get(geo_url+'?page={}'.format(pnum))
     geodata=response.json()
     geodata_flat=geodata['Data']
-    gdata.extend(geodata_flat)
-gname=geo_url.split('/')[-1]+'.json'
-gfile=os.path.join(docpath,gname)
-with open(gfile, 'w') as jfile:
-    json.dump(gdata, jfile, indent=4)
+    gwriter.write(geodata_flat)
+gwriter.close()
+manifest.add(gfile,gwriter.size,gwriter.sha256,geo_url)
 gtable=geo_url.split('/')[-1]+'_fields.html'
 write_html(geo_url+'/fields',docpath,gtable)
 
+manifest.save()
+session.report()
 print("Finished downloading documentation") 
\ No newline at end of file
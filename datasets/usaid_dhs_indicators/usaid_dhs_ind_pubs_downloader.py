@@ -9,20 +9,27 @@ Notes:
 2. Create a list of all publications from the survey API
 3. Match the survey ID number of a pub with the survey's folder ID (which contains its data)
 4. If there is no matching survey, put pubs in special folder
+5. Pubs are hashed as they download and added to the snapshot's manifest-sha256.txt
+and _MANIFEST.tsv
 """
 
-import requests, os
+import requests, os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from harvest import fetch, session
+from harvest.manifest import Manifest
 
 outfolder='downloaded-2025-03-24'
 
 nodatafolder=os.path.join(outfolder,'PUBS_NODATA')
 if not os.path.exists(outfolder):
     os.makedirs(outfolder)
+manifest=Manifest(outfolder)
 
 # GET LIST OF ALL SURVEYS
 pubs={}   
 pub_url='http://api.dhsprogram.com/rest/dhs/publications'
-response=requests.get(pub_url)
+response=session.get(pub_url)
 data=response.json()
 for record in data['Data']:
     pubs[record['PublicationURL']]=record['SurveyId']
@@ -31,14 +38,9 @@ i=0
 for k,v in pubs.items():
     spath=os.path.join(outfolder,v)
     if os.path.isdir(spath) is True:
+        fname=os.path.split(k)[1]
         try:
-            with requests.get(k, stream=True) as response:
-                response.raise_for_status()
-                fname=os.path.split(k)[1]
-                filepath=os.path.join(spath,fname)
-                with open(filepath, 'wb') as writefile:
-                    for chunk in response.iter_content(chunk_size=10000000):
-                        writefile.write(chunk)
+            fetch.fetch_file(k,spath,manifest=manifest)
             i=i+1
             print('Downloaded',fname, v)
         except requests.exceptions.RequestException as e:
@@ -47,19 +49,16 @@ for k,v in pubs.items():
         pubfolder=os.path.join(nodatafolder,v)
         if not os.path.exists(pubfolder):
             os.makedirs(pubfolder)
+        fname=os.path.split(k)[1]
         try:
-            with requests.get(k, stream=True) as response:
-                response.raise_for_status()
-                fname=os.path.split(k)[1]
-                filepath=os.path.join(pubfolder,fname)
-                with open(filepath, 'wb') as writefile:
-                    for chunk in response.iter_content(chunk_size=10000000):
-                        writefile.write(chunk)
+            fetch.fetch_file(k,pubfolder,manifest=manifest)
             i=i+1
             print('Downloaded pub to No Data folder',fname, v)
         except requests.exceptions.RequestException as e:
             print('Could not retrieve',fname,'because of',e)
             
+manifest.save()
 print('Finished downloading',i,'documents.')
+session.report()
 
     
\ No newline at end of file